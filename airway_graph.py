@@ -1,9 +1,20 @@
+import multiprocessing
+import os
+import time
+
 import numpy as np
 import pandas as pd
 
 from geographiclib.geodesic import Geodesic
 
+import nasr_delta
+import nasr_ingest
+from geo_utils import geodesic_distances
 from map_types import Airway, AirwayType, Waypoint, WaypointType
+from spatial_index import SpatialIndex, neighbors_table
+
+# Number of point pairs in each chunk of distances sent to a worker process.
+DISTANCE_CHUNK = 4096
 
 
 class AirwayGraph:
@@ -40,6 +51,23 @@ class AirwayGraph:
         """
         self.airways = {}
 
+        # NASR effective date ("YYYY/MM/DD") of the most recent data loaded into the graph.
+        self.eff_date = ""
+
+    def update_eff_date(self, nasr_csv: pd.DataFrame):
+        """
+        Tracks the NASR effective date of loaded data. The graph keeps the most recent date seen.
+
+        Arguments:
+        - `nasr_csv` (DataFrame): a NASR subscription table with an `EFF_DATE` column.
+        """
+        if "EFF_DATE" not in nasr_csv.columns:
+            return
+
+        dates = nasr_csv["EFF_DATE"].dropna()
+        if len(dates) > 0:
+            self.eff_date = max(self.eff_date, str(dates.max()))
+
     def add_airway(self, start_wpt_id: str, end_wpt_id: Waypoint, airway_type: AirwayType, name="", bidirectional=True):
         """
         Adds an airway (edge) to the graph. Airways are bidirectional, so two airways are added between
@@ -180,6 +208,245 @@ class AirwayGraph:
         # routes get added correctly.
         self.load_nasr_airways(awy_file)
 
+    def load_nasr_data_bulk(self, fix_file: str, apt_file: str, navaid_file: str, awy_file: str,
+                            star_rte_file: str, star_apt_file: str, sid_rte_file: str, sid_apt_file: str,
+                            cache_dir: str = "", processes: int = 1) -> dict:
+        """
+        Loads all NASR data into the airway graph using whole-column operations instead of one
+        `add_waypoint`/`add_airway` call per row. Waypoint and airway tables are deduplicated with
+        pandas, and all airway distances are computed in one vectorized batch. The resulting
+        `waypoints` and `airways` are the same as those built by `load_nasr_data`.
+
+        With more than one process, the build runs as a staged pipeline: the files are parsed and turned
+        into waypoint and airway rows in worker processes, the waypoints are merged as soon as their three
+        tables are ready, and the distances are split between the workers. The merges keep the priority
+        rules, so the graph is the same as with one process.
+
+        Arguments: same as `load_nasr_data`, and
+        - `cache_dir` (str, optional): directory of the parsed NASR table cache, see `nasr_ingest.read_nasr_csv`.
+        - `processes` (int, optional): number of worker processes. 1 runs in this process, `None` uses the
+                                       number of CPUs.
+
+        Returns:
+        A dictionary of stage name to elapsed wall-clock seconds.
+        """
+        timings = {}
+        start_time = time.perf_counter()
+        if processes is None:
+            processes = os.cpu_count() or 1
+
+        # The waypoint files are queued first, so the waypoints can be merged while the airway files are
+        # still being parsed.
+        files = {"fixes": fix_file, "airports": apt_file, "navaids": navaid_file, "star_rte": star_rte_file,
+                 "star_apt": star_apt_file, "sid_rte": sid_rte_file, "sid_apt": sid_apt_file, "awy_seg": awy_file}
+        pool = multiprocessing.Pool(processes) if processes > 1 else None
+        try:
+            # 1. Parse all of the NASR files and build their waypoint and airway rows.
+            if pool is None:
+                stages = {stage: nasr_ingest.table_stage((stage, csv_file, cache_dir))
+                          for stage, csv_file in files.items()}
+            else:
+                pending = {stage: pool.apply_async(nasr_ingest.table_stage, ((stage, csv_file, cache_dir),))
+                           for stage, csv_file in files.items()}
+                stages = {stage: pending[stage].get() for stage in ("fixes", "airports", "navaids")}
+            timings["read_csv"] = time.perf_counter() - start_time
+
+            # 2. Merge the deduplicated waypoint table and add it to the graph.
+            start_time = time.perf_counter()
+            waypoint_table = nasr_ingest.merge_waypoint_tables(stages["fixes"][1], stages["airports"][1],
+                                                               stages["navaids"][1], self.waypoints.keys())
+            self.add_waypoints_bulk(waypoint_table)
+            timings["waypoints"] = time.perf_counter() - start_time
+
+            # Waypoints must be loaded before the airways.
+            if len(self.waypoints.items()) == 0:
+                if self.verbose:
+                    print("Error: Fixes must be non-empty prior to loading airways.")
+                raise Exception
+
+            # 3. Build the deduplicated, directed airway table. STARs and SIDs come before the generic airways
+            # to ensure the named routes get added correctly.
+            start_time = time.perf_counter()
+            if pool is not None:
+                stages.update({stage: result.get() for stage, result in pending.items() if stage not in stages})
+            for eff_date, _ in stages.values():
+                self.eff_date = max(self.eff_date, eff_date)
+            edge_table = pd.concat([stages[stage][1] for stage in ("star_rte", "star_apt", "sid_rte", "sid_apt",
+                                                                    "awy_seg")], ignore_index=True)
+            existing_pairs = ((start, end) for start, ends in self.airways.items() for end in ends.keys())
+            directed = nasr_ingest.resolve_directed_edges(edge_table, self.waypoints.keys(), existing_pairs)
+            timings["airway_table"] = time.perf_counter() - start_time
+
+            # 4. Compute every airway distance in one batch, split between the workers.
+            start_time = time.perf_counter()
+            distances = self.compute_airway_distances(directed["start"], directed["end"], pool)
+            timings["distances"] = time.perf_counter() - start_time
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        # 5. Add the airways to the graph.
+        start_time = time.perf_counter()
+        self.add_airways_bulk(directed, distances)
+        timings["airways"] = time.perf_counter() - start_time
+
+        timings["total"] = sum(timings.values())
+        if self.verbose:
+            for stage, elapsed in timings.items():
+                print(f"{stage}: {elapsed:.3f} s")
+
+        return timings
+
+    def update_nasr_data(self, prev_tables: nasr_delta.NasrTables, new_tables: nasr_delta.NasrTables) -> dict:
+        """
+        Updates a graph built from one NASR cycle to the next cycle. Only the differences between the two
+        cycles are applied: removed waypoints and airways are dropped, moved waypoints are updated in place,
+        and distances are only computed for added or changed airways and for airways touching a moved
+        waypoint. The waypoint and airway dictionaries are then put in the order a full build would have
+        produced, so the graph is identical to one built from scratch with `load_nasr_data_bulk`. CUSTOM
+        airways are not part of a NASR cycle and are removed.
+
+        Arguments:
+        - `prev_tables` (NasrTables): resolved NASR cycle the graph was built from.
+        - `new_tables` (NasrTables): resolved NASR cycle to update to.
+
+        Returns:
+        A dictionary with the `delta` applied and the `timings` of each stage in seconds.
+        """
+        timings = {}
+
+        # The graph must hold exactly the previous cycle, otherwise the update would not match a full build.
+        if self.eff_date != prev_tables.eff_date or len(self.waypoints) != len(prev_tables.waypoints):
+            raise ValueError(f"Airway graph (effective {self.eff_date}) was not built from the previous NASR "
+                             f"cycle (effective {prev_tables.eff_date})")
+
+        # 1. Compare the cycles.
+        start_time = time.perf_counter()
+        delta = nasr_delta.diff_nasr_tables(prev_tables, new_tables)
+        timings["diff"] = time.perf_counter() - start_time
+
+        # 2. Apply the waypoint changes, keeping the Waypoint objects of moved waypoints so existing airways
+        # see their new position.
+        start_time = time.perf_counter()
+        wpt_types = {t.value: t for t in WaypointType}
+        new_wpts = new_tables.waypoints.set_index("name")
+        for name in delta.removed_waypoints:
+            del self.waypoints[name]
+        for name in delta.modified_waypoints:
+            wpt = self.waypoints[name]
+            wpt.lat = float(new_wpts.at[name, "lat"])
+            wpt.lon = float(new_wpts.at[name, "lon"])
+            wpt.wpt_type = wpt_types[new_wpts.at[name, "wpt_type"]]
+        for name in delta.added_waypoints:
+            self.waypoints[name] = Waypoint(name, float(new_wpts.at[name, "lat"]), float(new_wpts.at[name, "lon"]),
+                                            wpt_types[new_wpts.at[name, "wpt_type"]], "")
+
+        wpts = self.waypoints
+        self.waypoints = {name: wpts[name] for name in new_tables.waypoints["name"]}
+        timings["waypoints"] = time.perf_counter() - start_time
+
+        # 3. Find the airways that need a new distance.
+        start_time = time.perf_counter()
+        directed = new_tables.airways
+        keys = pd.MultiIndex.from_arrays([directed["from"], directed["to"]])
+        rebuilt = keys.isin(delta.added_airways + delta.modified_airways)
+        moved = directed["start"].isin(delta.modified_waypoints) | directed["end"].isin(delta.modified_waypoints)
+        recompute = rebuilt | moved.to_numpy()
+        distances = self.compute_airway_distances(directed["start"][recompute], directed["end"][recompute])
+        timings["distances"] = time.perf_counter() - start_time
+
+        # 4. Rebuild the airway dictionaries in the new cycle's order, reusing unchanged Airway objects.
+        start_time = time.perf_counter()
+        awy_types = {t.value: t for t in AirwayType}
+        new_distances = dict(zip(keys[recompute], distances.tolist()))
+        old_airways = self.airways
+        self.airways = {}
+        for from_id, to_id, start_id, end_id, awy_type, name, is_rebuilt in zip(
+                directed["from"], directed["to"], directed["start"], directed["end"],
+                directed["airway_type"], directed["name"], rebuilt.tolist()):
+            if is_rebuilt:
+                awy = Airway(wpts[start_id], wpts[end_id], new_distances[(from_id, to_id)], True,
+                             awy_types[awy_type], name)
+            else:
+                awy = old_airways[from_id][to_id]
+                if (from_id, to_id) in new_distances:
+                    awy.distance = new_distances[(from_id, to_id)]
+            self.airways.setdefault(from_id, {})[to_id] = awy
+        timings["airways"] = time.perf_counter() - start_time
+
+        self.eff_date = new_tables.eff_date
+
+        timings["total"] = sum(timings.values())
+        if self.verbose:
+            print(f"NASR update {delta.prev_eff_date} -> {delta.eff_date}: "
+                  f"{len(delta.added_waypoints)} added, {len(delta.removed_waypoints)} removed, "
+                  f"{len(delta.modified_waypoints)} moved waypoints; {len(delta.added_airways)} added, "
+                  f"{len(delta.removed_airways)} removed, {len(delta.modified_airways)} changed airways; "
+                  f"{int(recompute.sum())} distances recomputed")
+            for stage, elapsed in timings.items():
+                print(f"{stage}: {elapsed:.3f} s")
+
+        return {"delta": delta, "timings": timings}
+
+    def add_waypoints_bulk(self, waypoint_table: pd.DataFrame):
+        """
+        Adds every row of a waypoint table to the waypoint dictionary. Rows are expected to be new and
+        unique, as produced by `nasr_ingest.build_waypoint_table`.
+
+        Arguments:
+        - `waypoint_table` (DataFrame): table with `nasr_ingest.WAYPOINT_COLUMNS`.
+        """
+        wpt_types = {t.value: t for t in WaypointType}
+        for name, lat, lon, wpt_type in zip(waypoint_table["name"], waypoint_table["lat"].tolist(),
+                                            waypoint_table["lon"].tolist(), waypoint_table["wpt_type"]):
+            self.waypoints[name] = Waypoint(name, lat, lon, wpt_types[wpt_type], "")
+
+    def compute_airway_distances(self, start_ids, end_ids, pool=None) -> np.ndarray:
+        """
+        Computes the geodesic distance between pairs of waypoints in one vectorized batch. Each
+        distinct pair is only computed once.
+
+        Arguments:
+        - `start_ids` (array-like): start waypoint identifiers.
+        - `end_ids` (array-like): end waypoint identifiers.
+        - `pool` (multiprocessing.Pool, optional): worker processes to split the batch between.
+
+        Returns:
+        A float64 array of distances in meters.
+        """
+        pairs = pd.DataFrame({"start": np.asarray(start_ids, dtype=object), "end": np.asarray(end_ids, dtype=object)})
+        codes, unique_pairs = pd.MultiIndex.from_frame(pairs).factorize()
+
+        start_wpts = [self.waypoints[name] for name in unique_pairs.get_level_values(0)]
+        end_wpts = [self.waypoints[name] for name in unique_pairs.get_level_values(1)]
+        points = [np.array([w.lat for w in start_wpts]), np.array([w.lon for w in start_wpts]),
+                  np.array([w.lat for w in end_wpts]), np.array([w.lon for w in end_wpts])]
+        if pool is None:
+            distances = geodesic_distances(*points)
+        else:
+            chunks = [[p[i:i + DISTANCE_CHUNK] for p in points] for i in range(0, len(start_wpts), DISTANCE_CHUNK)]
+            distances = np.concatenate([np.zeros(0)] + pool.map(_geodesic_chunk, chunks))
+
+        return distances[codes]
+
+    def add_airways_bulk(self, directed: pd.DataFrame, distances: np.ndarray):
+        """
+        Adds resolved, directed airways to the graph. Rows are expected to be new and in insertion
+        order, as produced by `nasr_ingest.resolve_directed_edges`.
+
+        Arguments:
+        - `directed` (DataFrame): directed airway table.
+        - `distances` (np.ndarray): airway distances in meters, one per row of `directed`.
+        """
+        awy_types = {t.value: t for t in AirwayType}
+        wpts = self.waypoints
+        for from_id, to_id, start_id, end_id, awy_type, name, distance in zip(
+                directed["from"], directed["to"], directed["start"], directed["end"],
+                directed["airway_type"], directed["name"], distances.tolist()):
+            awy = Airway(wpts[start_id], wpts[end_id], distance, True, awy_types[awy_type], name)
+            self.airways.setdefault(from_id, {})[to_id] = awy
+
     def load_nasr_fixes(self, fix_file: str):
         """
         Loads the NASR fixes into the waypoint dictionary. These are used later when determining airway information.
@@ -190,6 +457,7 @@ class AirwayGraph:
 
         # Load the NASR fixes from the CSV.
         nasr_fix_base_csv = pd.read_csv(fix_file)
+        self.update_eff_date(nasr_fix_base_csv)
 
         # Go through all fixes and generate waypoints.
         for _, row in nasr_fix_base_csv.iterrows():
@@ -210,6 +478,7 @@ class AirwayGraph:
 
         # Load the NASR fixes from the CSV.
         nasr_apt_base_csv = pd.read_csv(apt_file)
+        self.update_eff_date(nasr_apt_base_csv)
 
         # Go through all fixes and generate waypoints.
         for _, row in nasr_apt_base_csv.iterrows():
@@ -230,6 +499,7 @@ class AirwayGraph:
 
         # Load the NASR fixes from the CSV.
         nasr_nav_base_csv = pd.read_csv(nav_file)
+        self.update_eff_date(nasr_nav_base_csv)
 
         # Go through all navaids and generate waypoints.
         for _, row in nasr_nav_base_csv.iterrows():
@@ -264,6 +534,7 @@ class AirwayGraph:
 
         # Load the NASR airways.
         nasr_airways_csv = pd.read_csv(awy_file)
+        self.update_eff_date(nasr_airways_csv)
 
         # Go through each row, and construct an airway.
         for idx, row in nasr_airways_csv.iterrows():
@@ -279,6 +550,7 @@ class AirwayGraph:
         """
         # Load the NASR STAR routes CSV.
         nasr_star_rte_csv = pd.read_csv(star_rte_file)
+        self.update_eff_date(nasr_star_rte_csv)
 
         # Go through each route and add it in as an ARRIVAL airway
         for _, row in nasr_star_rte_csv.iterrows():
@@ -310,6 +582,7 @@ class AirwayGraph:
         """
         # Load the NASR standard departure routes CSV.
         nasr_sid_rte_csv = pd.read_csv(sid_rte_file)
+        self.update_eff_date(nasr_sid_rte_csv)
 
         # Go through each route and add it in as an DEPARTURE airway
         for _, row in nasr_sid_rte_csv.iterrows():
@@ -332,17 +605,59 @@ class AirwayGraph:
             # Add the airway.
             self.add_airway(row["ARPT_ID"], dp_wpt, AirwayType.DEPARTURE, bidirectional=False)
 
-    def build_custom_airways(self, n_fix=5):
+    def build_custom_airways(self, n_fix=5, processes=1) -> dict:
         """
         Builds custom airways between FIX type waypoints. NAVAIDs and AIRPORTS are defined by the NASR database.
+        Each fix is connected to its `n_fix` closest fixes with a bidirectional CUSTOM airway, unless the
+        graph already has an airway between them. The neighbors are found with a KD-tree and all distances
+        are computed in one vectorized batch.
 
         Arguments:
         - `n_fix` (int): Number of fixes at most to connect when generating augmented airways.
-        """
+        - `processes` (int, optional): Number of processes to search for neighbors with. `None` uses the
+                                       number of CPUs.
 
-        # Return augmented airways
-        # TODO: load in FIX_BASE.csv and create airways based on the N-closest fixes for a given fix.
-        pass
+        Returns:
+        A dictionary with the number of `airways` added and the `timings` of each stage in seconds.
+        """
+        timings = {}
+
+        # 1. Find the nearest fixes of every fix.
+        start_time = time.perf_counter()
+        fixes = [wpt for wpt in self.waypoints.values() if wpt.wpt_type == WaypointType.FIX]
+        index = SpatialIndex.from_points([wpt.lat for wpt in fixes], [wpt.lon for wpt in fixes])
+        ids, nbrs = neighbors_table(index, n_fix, processes)
+        timings["neighbors"] = time.perf_counter() - start_time
+
+        # 2. Build the directed airway table. Each fix's airways are added closest first, as if
+        # `add_airway` was called for every fix and neighbor in order.
+        start_time = time.perf_counter()
+        fix_names = np.array([wpt.name for wpt in fixes], dtype=object)
+        starts = np.repeat(ids, n_fix)
+        ends = nbrs.ravel()
+        found = ends >= 0
+        edge_table = nasr_ingest.custom_edges(fix_names[starts[found]], fix_names[ends[found]])
+        existing_pairs = ((start, end) for start, ends in self.airways.items() for end in ends.keys())
+        directed = nasr_ingest.resolve_directed_edges(edge_table, self.waypoints.keys(), existing_pairs)
+        timings["airway_table"] = time.perf_counter() - start_time
+
+        # 3. Compute every airway distance in one batch.
+        start_time = time.perf_counter()
+        distances = self.compute_airway_distances(directed["start"], directed["end"])
+        timings["distances"] = time.perf_counter() - start_time
+
+        # 4. Add the airways to the graph.
+        start_time = time.perf_counter()
+        self.add_airways_bulk(directed, distances)
+        timings["airways"] = time.perf_counter() - start_time
+
+        timings["total"] = sum(timings.values())
+        if self.verbose:
+            print(f"Added {len(directed)} custom airways between {len(fixes)} fixes")
+            for stage, elapsed in timings.items():
+                print(f"{stage}: {elapsed:.3f} s")
+
+        return {"airways": len(directed), "timings": timings}
 
     def get_waypoint(self, ident: str) -> Waypoint:
         """
@@ -370,3 +685,10 @@ class AirwayGraph:
             return None
 
         return self.airways[ident]
+
+
+def _geodesic_chunk(points: list) -> np.ndarray:
+    """
+    Computes the distances of one chunk of point pairs in a worker process.
+    """
+    return geodesic_distances(*points)
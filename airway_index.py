@@ -0,0 +1,224 @@
+import argparse
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from compiled_graph import CompiledGraph, StringTable
+from graph_file import load_graph
+
+# pandas is only needed to build the index from the NASR files, so route expansion doesn't import it.
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Arrays stored for the airway sequences.
+_TABLE_KEYS = ["piece_offsets", "fix_offsets", "fixes"]
+
+
+class AirwayIndex:
+    """
+    Ordered fix sequence of every published airway, for expanding and checking filed route strings.
+
+    An airway id can have several pieces: one for each NASR airway location (the contiguous US, Alaska
+    and Hawaii) and one for each run of points between waypoints that are not in the graph, such as
+    border crossings. Pieces are stored as CSR over the airway ids, and the fixes of each piece as CSR
+    over the pieces, in increasing `POINT_SEQ`. The position of a fix on an airway is looked up in a
+    dictionary built the first time the airway is used.
+    """
+
+    def __init__(self, names: StringTable, piece_offsets: np.ndarray, fix_offsets: np.ndarray, fixes: np.ndarray):
+        """
+        Arguments:
+        - `names` (StringTable): airway ids.
+        - `piece_offsets` (np.ndarray): CSR offsets of each airway id's pieces.
+        - `fix_offsets` (np.ndarray): CSR offsets of each piece's fixes.
+        - `fixes` (np.ndarray): node ids of the fixes of every piece, in order.
+        """
+        self.names = names
+        self.piece_offsets = piece_offsets
+        self.fix_offsets = fix_offsets
+        self.fixes = fixes
+
+        # Lookups built on first use: airway id to index, and per airway, node id to (piece, position).
+        self._airway_ids = None
+        self._positions = {}
+
+    @classmethod
+    def build(cls, graph: CompiledGraph, awy_seg: "pd.DataFrame") -> "AirwayIndex":
+        """
+        Builds the index from the NASR airway segments.
+
+        Arguments:
+        - `graph` (CompiledGraph): graph the index is for.
+        - `awy_seg` (DataFrame): parsed AWY_SEG.csv
+        """
+        # 1. Order the points of each airway, and resolve them to node ids.
+        awy_seg = awy_seg[awy_seg["AWY_ID"].notna() & awy_seg["SEG_VALUE"].notna()]
+        awy_seg = awy_seg.sort_values(["AWY_ID", "AWY_LOCATION", "POINT_SEQ"], kind="stable")
+        airway_ids = awy_seg["AWY_ID"].to_numpy(dtype=object)
+        locations = awy_seg["AWY_LOCATION"].fillna("").to_numpy(dtype=object)
+        node_ids = {ident: graph.node_id(ident) for ident in awy_seg["SEG_VALUE"].unique()}
+        nodes = np.array([node_ids[ident] for ident in awy_seg["SEG_VALUE"]], dtype=np.int32)
+
+        # 2. Start a new piece at every new airway or location, and after every point not in the graph.
+        # Those points are then dropped, with pieces that are left with fewer than two fixes.
+        new_airway = np.ones(len(nodes), dtype=bool)
+        new_airway[1:] = (airway_ids[1:] != airway_ids[:-1]) | (locations[1:] != locations[:-1])
+        new_piece = new_airway.copy()
+        new_piece[1:] |= nodes[:-1] < 0
+        known = nodes >= 0
+        piece_of = np.cumsum(new_piece) - 1
+        piece_sizes = np.bincount(piece_of[known], minlength=int(piece_of[-1]) + 1 if len(nodes) > 0 else 0)
+        keep = known & (piece_sizes[piece_of] >= 2)
+
+        # 3. Number the airway ids, and lay out the pieces and their fixes as CSR.
+        names = sorted(set(airway_ids[keep]))
+        name_ids = {name: i for i, name in enumerate(names)}
+        pieces = np.unique(piece_of[keep])
+        piece_airways = np.array([name_ids[airway_ids[row]] for row in np.searchsorted(piece_of, pieces)],
+                                 dtype=np.int64)
+        piece_offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        piece_offsets[1:] = np.cumsum(np.bincount(piece_airways, minlength=len(names)))
+        fix_offsets = np.zeros(len(pieces) + 1, dtype=np.int64)
+        fix_offsets[1:] = np.cumsum(piece_sizes[pieces])
+
+        return cls(StringTable.from_strings(names), piece_offsets, fix_offsets, nodes[keep])
+
+    @classmethod
+    def from_graph(cls, graph: CompiledGraph) -> "AirwayIndex":
+        """
+        Loads the airway index stored with a graph file.
+
+        Arguments:
+        - `graph` (CompiledGraph): graph opened from a binary graph file.
+
+        Returns:
+        The airway index, or `None` if the graph has none.
+        """
+        gf = graph.graph_file
+        if gf is None or not gf.has_section("airway_index.names.data"):
+            return None
+
+        return cls(gf.string_table("airway_index.names"), *[gf.array(f"airway_index.{key}") for key in _TABLE_KEYS])
+
+    def to_sections(self) -> dict:
+        """
+        Get the airway index arrays as graph file sections.
+        """
+        sections = {
+            "airway_index.names.data": self.names.data,
+            "airway_index.names.offsets": self.names.offsets,
+            "airway_index.names.sorted_ids": self.names.sorted_ids,
+        }
+        sections.update({f"airway_index.{key}": getattr(self, key) for key in _TABLE_KEYS})
+
+        return sections
+
+    def airway_id(self, airway: str) -> int:
+        """
+        Get the index of an airway id, or -1 if there is no such airway.
+        """
+        if self._airway_ids is None:
+            self._airway_ids = {name: i for i, name in enumerate(self.names.tolist())}
+        return self._airway_ids.get(airway, -1)
+
+    def pieces(self, airway: str) -> list:
+        """
+        Get the fix sequences of an airway.
+
+        Arguments:
+        - `airway` (str): airway id, such as J52.
+
+        Returns:
+        A list of node id arrays in increasing `POINT_SEQ`, one per piece. Empty for unknown airways.
+        """
+        idx = self.airway_id(airway)
+        if idx < 0:
+            return []
+
+        return [self.fixes[self.fix_offsets[piece]:self.fix_offsets[piece + 1]]
+                for piece in range(int(self.piece_offsets[idx]), int(self.piece_offsets[idx + 1]))]
+
+    def position(self, airway: str, node: int) -> tuple:
+        """
+        Finds a fix on an airway.
+
+        Arguments:
+        - `airway` (str): airway id.
+        - `node` (int): node id of the fix.
+
+        Returns:
+        A (piece, position) tuple, where piece is the id of the airway piece and position is the index of
+        the fix in its fixes, or `None` if the fix is not on the airway. Fixes an airway passes more than
+        once are found at their first position.
+        """
+        idx = self.airway_id(airway)
+        if idx < 0:
+            return None
+
+        positions = self._positions.get(idx)
+        if positions is None:
+            positions = {}
+            for piece in range(int(self.piece_offsets[idx]), int(self.piece_offsets[idx + 1])):
+                lo = int(self.fix_offsets[piece])
+                for pos, fix in enumerate(self.fixes[lo:int(self.fix_offsets[piece + 1])].tolist()):
+                    positions.setdefault(fix, (piece, pos))
+            self._positions[idx] = positions
+
+        return positions.get(node)
+
+    def segment(self, airway: str, entry: int, exit: int) -> np.ndarray:
+        """
+        Get the fixes flown along an airway between two of its fixes, in either direction.
+
+        Arguments:
+        - `airway` (str): airway id.
+        - `entry` (int): node id of the fix where the airway is joined.
+        - `exit` (int): node id of the fix where the airway is left.
+
+        Returns:
+        The node ids from `entry` to `exit`, both included, or `None` if they are not on the same piece of
+        the airway.
+        """
+        start = self.position(airway, entry)
+        end = self.position(airway, exit)
+        if start is None or end is None or start[0] != end[0]:
+            return None
+
+        fixes = self.fixes[self.fix_offsets[start[0]]:self.fix_offsets[start[0] + 1]]
+        if start[1] <= end[1]:
+            return fixes[start[1]:end[1] + 1]
+        return fixes[end[1]:start[1] + 1][::-1]
+
+
+def read_airway_index(graph: CompiledGraph, awy_file: str, cache_dir: str = "") -> AirwayIndex:
+    """
+    Builds the airway index of a graph from the NASR airway segments file.
+
+    Arguments:
+    - `graph` (CompiledGraph): graph the index is for.
+    - `awy_file` (str): File path for the NASR AWY_SEG.csv
+    - `cache_dir` (str, optional): directory of the parsed NASR table cache.
+    """
+    import nasr_ingest
+
+    return AirwayIndex.build(graph, nasr_ingest.read_nasr_csv(awy_file, cache_dir))
+
+
+if __name__ == "__main__":
+    # Make this script configurable
+    parser = argparse.ArgumentParser(description="List the fixes of an airway.")
+    parser.add_argument("airway")
+    parser.add_argument("--graph_file", default="data/airway_graph.fpg")
+
+    args = parser.parse_args()
+
+    graph = load_graph(args.graph_file)
+    index = AirwayIndex.from_graph(graph)
+    if index is None:
+        print(f"{args.graph_file} has no airway index. Generate the graph again to add one.")
+    else:
+        pieces = index.pieces(args.airway)
+        if len(pieces) == 0:
+            print(f"{args.airway} is not a published airway.")
+        for fixes in pieces:
+            print(" ".join(graph.node_name(int(node)) for node in fixes))
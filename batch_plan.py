@@ -0,0 +1,230 @@
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import sys
+import time
+from contextlib import redirect_stdout
+
+from contraction import ContractionHierarchy
+from graph_file import is_graph_file, load_graph
+from landmarks import LandmarkIndex
+from map_types import SearchStats
+from path_search import find_best_path_ch, find_best_path_compiled, find_best_path_tiled, path_distance
+from tiled_graph import TiledGraph
+
+# Per-process search state, set up once by `init_worker`.
+_worker = {}
+
+
+def read_pairs(pairs_file: str):
+    """
+    Reads origin/destination pairs from a CSV or JSON-lines file. CSV files need a header with
+    `start` and `end` (or `origin` and `destination`) columns. JSON-lines files (`.jsonl` or `.json`)
+    need the same keys on each line. Rows that can't be read, or that are missing the start or the end,
+    are still yielded with an error so they are reported as failed routes instead of stopping the batch.
+
+    Arguments:
+    - `pairs_file` (str): file path of the pairs.
+
+    Returns:
+    A generator of (index, start, end, error) tuples. `error` is "" for valid rows.
+    """
+    with open(pairs_file, newline="") as f:
+        if pairs_file.endswith((".jsonl", ".json")):
+            rows = (_parse_json_row(line) for line in f if line.strip() != "")
+        else:
+            rows = csv.DictReader(f)
+
+        for idx, row in enumerate(rows):
+            if not isinstance(row, dict):
+                yield idx, "", "", row
+                continue
+
+            start = row.get("start", row.get("origin"))
+            end = row.get("end", row.get("destination"))
+            start = str(start).strip() if start is not None else ""
+            end = str(end).strip() if end is not None else ""
+            if start == "" or end == "":
+                yield idx, start, end, "row is missing the start or the end"
+            else:
+                yield idx, start, end, ""
+
+
+def _parse_json_row(line: str):
+    # Parses one JSON-lines row, or returns the reason it isn't a JSON object.
+    try:
+        row = json.loads(line)
+    except ValueError as e:
+        return f"invalid JSON: {e}"
+    return row if isinstance(row, dict) else "row is not a JSON object"
+
+
+def check_hierarchy(graph, ch: ContractionHierarchy, graph_file: str, ch_file: str):
+    """
+    Checks that a contraction hierarchy was built for a graph. Searching a hierarchy built for another
+    graph returns wrong routes, or fails on node ids the graph doesn't have.
+
+    Raises:
+    `ValueError` if the hierarchy doesn't match the graph.
+    """
+    if not ch.matches(graph):
+        raise ValueError(f"{ch_file} was not built for {graph_file}")
+
+
+def init_worker(graph_file: str, ch_file: str, use_landmarks: bool, tiled_file: str = "", memory_budget: int = 0):
+    """
+    Loads the airway graph once per worker process. Binary graph files are memory-mapped, so all
+    workers share the same physical pages instead of holding a copy each.
+
+    Arguments:
+    - `graph_file` (str): file path of the airway graph.
+    - `ch_file` (str): file path of a contraction hierarchy for the graph, or "" to use A*.
+    - `use_landmarks` (bool): use the landmarks stored in the graph file for A*.
+    - `tiled_file` (str, optional): tiled graph file to search instead, loading tiles on demand.
+    - `memory_budget` (int, optional): bytes of tiles each worker keeps loaded, 0 for no limit.
+    """
+    if tiled_file != "":
+        _worker["tiled"] = TiledGraph(tiled_file, memory_budget)
+        return
+
+    graph = load_graph(graph_file)
+    ch = ContractionHierarchy.load(ch_file) if ch_file != "" else None
+    if ch is not None:
+        check_hierarchy(graph, ch, graph_file, ch_file)
+
+    _worker["graph"] = graph
+    _worker["ch"] = ch
+    _worker["landmarks"] = LandmarkIndex.from_graph(graph) if use_landmarks else None
+
+
+def plan_route(task: tuple) -> dict:
+    """
+    Plans one route in a worker process.
+
+    Arguments:
+    - `task` (tuple): (index, start, end, error) tuple from `read_pairs`. Rows with an error are not
+                      searched.
+
+    Returns:
+    A dictionary with the input index, start, end, the waypoint list, the route distance in meters, the
+    search time and the search statistics. Failed searches have an empty path and an `error` message, and
+    invalid rows are also flagged with `invalid`.
+    """
+    idx, start, end, error = task
+    if error != "":
+        return {"index": idx, "start": start, "end": end, "path": [], "error": error, "invalid": True}
+
+    tiled = _worker.get("tiled")
+    graph = _worker.get("graph")
+    ch = _worker.get("ch")
+
+    # The searches print their errors, so capture them for the result instead.
+    messages = io.StringIO()
+    stats = SearchStats()
+    start_time = time.perf_counter()
+    with redirect_stdout(messages):
+        if tiled is not None:
+            path = find_best_path_tiled(tiled, start, end, stats=stats)
+        elif ch is not None:
+            path = find_best_path_ch(graph, ch, start, end, stats=stats)
+        else:
+            path = find_best_path_compiled(graph, start, end, landmarks=_worker["landmarks"], stats=stats)
+    elapsed = time.perf_counter() - start_time
+
+    result = {"index": idx, "start": start, "end": end, "path": path, "time": elapsed,
+              "stats": {"nodes_expanded": stats.nodes_expanded, "edges_relaxed": stats.edges_relaxed,
+                        "peak_frontier": stats.peak_frontier, "stale_pops": stats.stale_pops}}
+    if len(path) > 0:
+        result["distance"] = tiled.path_distance(path) if tiled is not None else path_distance(graph, path)
+    else:
+        result["error"] = messages.getvalue().strip()
+
+    return result
+
+
+def run_batch(pairs_file: str, graph_file: str, out, processes: int = None, ch_file: str = "",
+              use_landmarks: bool = True, chunksize: int = 16, tiled_file: str = "", memory_budget: int = 0) -> dict:
+    """
+    Plans every route in a pairs file with a process pool, streaming results as they finish.
+
+    Arguments:
+    - `pairs_file` (str): CSV or JSON-lines file of origin/destination pairs.
+    - `graph_file` (str): file path of the airway graph.
+    - `out` (file): text stream that receives one JSON result per line.
+    - `processes` (int, optional): number of worker processes. Default is the number of CPUs.
+    - `ch_file` (str, optional): contraction hierarchy to search with instead of A*.
+    - `use_landmarks` (bool, optional): use the landmarks stored in the graph file for A*.
+    - `chunksize` (int, optional): number of pairs sent to a worker at a time.
+    - `tiled_file` (str, optional): tiled graph file to search instead of the graph file.
+    - `memory_budget` (int, optional): bytes of tiles each worker keeps loaded, 0 for no limit.
+
+    Returns:
+    A summary dictionary with the number of routes, failures (including invalid rows), invalid rows,
+    elapsed time and throughput.
+
+    Raises:
+    `ValueError` if the contraction hierarchy wasn't built for the graph.
+    """
+    # Check the hierarchy before starting the workers. A worker that fails to start is replaced by the
+    # pool, so the batch would never finish.
+    if ch_file != "" and tiled_file == "":
+        check_hierarchy(load_graph(graph_file), ContractionHierarchy.load(ch_file), graph_file, ch_file)
+
+    summary = {"routes": 0, "failures": 0, "invalid": 0}
+    start_time = time.perf_counter()
+    with multiprocessing.Pool(processes, initializer=init_worker,
+                              initargs=(graph_file, ch_file, use_landmarks, tiled_file, memory_budget)) as pool:
+        for result in pool.imap_unordered(plan_route, read_pairs(pairs_file), chunksize):
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+
+            summary["routes"] += 1
+            if len(result["path"]) == 0:
+                summary["failures"] += 1
+            if result.get("invalid", False):
+                summary["invalid"] += 1
+
+    summary["elapsed"] = time.perf_counter() - start_time
+    summary["routes_per_second"] = summary["routes"] / summary["elapsed"] if summary["elapsed"] > 0 else 0.0
+
+    return summary
+
+
+if __name__ == "__main__":
+    # Configurable parameters
+    parser = argparse.ArgumentParser(description="Plan routes for a file of origin/destination pairs.")
+    parser.add_argument("pairs_file", help="CSV with start,end columns or JSON lines with start/end keys")
+    parser.add_argument("--graph_file", default="data/airway_graph.fpg")
+    parser.add_argument("--out_file", default="-", help="JSON-lines output file. Default is stdout")
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes. Default is the CPU count")
+    parser.add_argument("--chunksize", type=int, default=16)
+    parser.add_argument("--ch_file", default="", help="Contraction hierarchy to search with instead of A*")
+    parser.add_argument("--no_landmarks", action="store_true")
+    parser.add_argument("--tiled_file", default="",
+                        help="Tiled graph file from tiled_graph.py. Workers load its tiles on demand")
+    parser.add_argument("--memory_budget_mb", type=float, default=0,
+                        help="Megabytes of tiles each worker keeps loaded with --tiled_file. 0 for no limit")
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    if args.tiled_file == "" and not is_graph_file(args.graph_file):
+        print("Warning: pickled graphs are loaded separately by every worker. "
+              "Convert the graph with convert_graph.py to share it between workers.", file=sys.stderr)
+
+    out = sys.stdout if args.out_file == "-" else open(args.out_file, "w")
+    try:
+        summary = run_batch(args.pairs_file, args.graph_file, out, args.processes, args.ch_file,
+                            not args.no_landmarks, args.chunksize, args.tiled_file,
+                            int(args.memory_budget_mb * 1e6))
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print(f"Planned {summary['routes']} routes ({summary['failures']} failed, {summary['invalid']} invalid rows) "
+          f"in {summary['elapsed']:.2f} s, {summary['routes_per_second']:.1f} routes/s", file=sys.stderr)
@@ -0,0 +1,385 @@
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+import numpy as np
+
+from airway_graph import AirwayGraph
+from compiled_graph import CompiledGraph
+from graph_file import is_stale, load_graph
+from landmarks import LandmarkIndex
+from path_search import find_best_path, find_best_path_compiled
+
+# Routes from the README, always benchmarked first when both waypoints are in the graph.
+README_PAIRS = [("MONIA", "MILBY"), ("SWAGG", "LIMBO")]
+
+# NASR files read by `AirwayGraph.load_nasr_data`, in argument order.
+NASR_FILES = ["FIX_BASE.csv", "APT_BASE.csv", "NAV_BASE.csv", "AWY_SEG.csv", "STAR_RTE.csv", "STAR_APT.csv",
+              "DP_RTE.csv", "DP_APT.csv"]
+
+# Run by `time_cold_start` in a new interpreter, so nothing is imported yet: imports what `main.py` imports,
+# loads the graph the way it does and runs one query, and prints the time of each step.
+_COLD_START_SCRIPT = """
+import json, sys, time
+start_time = time.perf_counter()
+import main
+import_time = time.perf_counter()
+graph = main.load_graph(sys.argv[1])
+if graph.eff_date != "":
+    main.is_stale(graph.eff_date)
+landmarks = main.LandmarkIndex.from_graph(graph)
+load_time = time.perf_counter()
+main.find_best_path_compiled(graph, sys.argv[2], sys.argv[3], landmarks=landmarks)
+query_time = time.perf_counter()
+print(json.dumps({"import": import_time - start_time, "load": load_time - import_time,
+                  "first_query": query_time - load_time, "pandas": "pandas" in sys.modules}))
+"""
+
+# Smallest changes reported as regressions, so timer and allocator noise on tiny values is ignored.
+_MIN_DELTA = {"_s": 1e-3, "_bytes": 64 * 1024}
+
+
+def time_nasr_build(nasr_files: list) -> tuple:
+    """
+    Times each stage of `AirwayGraph.load_nasr_data` by running the stages one at a time, in the same order.
+
+    Arguments:
+    - `nasr_files` (list): NASR file paths, in `load_nasr_data` argument order.
+
+    Returns:
+    A (timings, graph) tuple with a dictionary of stage name to elapsed seconds, and the built graph.
+    """
+    fix_file, apt_file, navaid_file, awy_file, star_rte_file, star_apt_file, sid_rte_file, sid_apt_file = nasr_files
+    graph = AirwayGraph(verbose=False)
+    stages = [
+        ("fixes", lambda: graph.load_nasr_fixes(fix_file)),
+        ("airports", lambda: graph.load_nasr_airports(apt_file)),
+        ("navaids", lambda: graph.load_nasr_navaids(navaid_file)),
+        ("stars", lambda: graph.load_nasr_stars(star_rte_file, star_apt_file)),
+        ("sids", lambda: graph.load_nasr_sids(sid_rte_file, sid_apt_file)),
+        ("airways", lambda: graph.load_nasr_airways(awy_file)),
+    ]
+
+    timings = {}
+    for stage, load in stages:
+        start_time = time.perf_counter()
+        load()
+        timings[stage] = time.perf_counter() - start_time
+    timings["total"] = sum(timings.values())
+
+    return timings, graph
+
+
+def time_graph_load(graph_file: str, repeat: int = 5) -> dict:
+    """
+    Times loading a graph file the way `main.py` does: load the graph, check its NASR cycle and read the
+    landmarks.
+
+    Arguments:
+    - `graph_file` (str): file path of the airway graph.
+    - `repeat` (int, optional): number of loads. The fastest is reported, along with the first.
+
+    Returns:
+    A dictionary with the first and fastest load times in seconds.
+    """
+    times = []
+    for _ in range(max(repeat, 1)):
+        start_time = time.perf_counter()
+        graph = load_graph(graph_file)
+        if graph.eff_date != "":
+            is_stale(graph.eff_date)
+        LandmarkIndex.from_graph(graph)
+        times.append(time.perf_counter() - start_time)
+
+    return {"first": times[0], "best": min(times)}
+
+
+def time_cold_start(graph_file: str, start: str, end: str, repeat: int = 3) -> dict:
+    """
+    Times a cold start of a route query, as a scripted `main.py` call sees it: a new Python process that
+    imports the route query modules, loads the graph and finds one route.
+
+    Arguments:
+    - `graph_file` (str): file path of the airway graph.
+    - `start` (str): start identifier of the route.
+    - `end` (str): end identifier of the route.
+    - `repeat` (int, optional): number of processes started. The fastest of each step is reported.
+
+    Returns:
+    A dictionary with the fastest import, graph load, first query and whole process times in seconds, and
+    whether pandas was imported.
+    """
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for _ in range(max(repeat, 1)):
+        start_time = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", _COLD_START_SCRIPT, os.path.abspath(graph_file), start, end],
+                                cwd=repo_dir, capture_output=True, text=True, check=True)
+        process_time = time.perf_counter() - start_time
+        times.append(dict(json.loads(result.stdout.strip().splitlines()[-1]), process=process_time))
+
+    cold_start = {step: min(t[step] for t in times) for step in ("import", "load", "first_query", "process")}
+    cold_start["pandas"] = any(t["pandas"] for t in times)
+
+    return cold_start
+
+
+def od_pairs(graph: CompiledGraph, n_pairs: int, seed: int = 0) -> list:
+    """
+    Draws a fixed set of origin/destination pairs. The README routes come first, followed by random pairs
+    of waypoints that both have airways leaving and arriving, so that most pairs have a route.
+
+    Arguments:
+    - `graph` (CompiledGraph): graph to draw the waypoints from.
+    - `n_pairs` (int): number of random pairs.
+    - `seed` (int, optional): random seed. The same seed and graph always give the same pairs.
+
+    Returns:
+    A list of (start, end) identifier pairs.
+    """
+    pairs = [(start, end) for start, end in README_PAIRS if graph.node_id(start) >= 0 and graph.node_id(end) >= 0]
+
+    # Waypoints with airways in both directions.
+    rev_offsets, _, _ = graph.reverse_adjacency()
+    connected = np.flatnonzero((np.diff(graph.offsets) > 0) & (np.diff(rev_offsets) > 0)).tolist()
+
+    rng = random.Random(seed)
+    for _ in range(n_pairs):
+        start, end = rng.sample(connected, 2)
+        pairs.append((graph.node_name(start), graph.node_name(end)))
+
+    return pairs
+
+
+def time_queries(search, pairs: list, repeat: int = 3) -> dict:
+    """
+    Measures the route query latency and peak memory of a search function.
+
+    Arguments:
+    - `search` (callable): function taking a (start, end) pair and returning a path.
+    - `pairs` (list): (start, end) identifier pairs.
+    - `repeat` (int, optional): number of times each query is run. Its fastest time is its latency, which
+                                filters out most of the timer noise.
+
+    Returns:
+    A dictionary of latency statistics in seconds, the largest peak memory of a query in bytes, and the
+    number of routes found.
+    """
+    # Warm up caches that are built on the first query.
+    with redirect_stdout(io.StringIO()):
+        search(*pairs[0])
+
+    # 1. Latency. The searches print failed queries, so their output is discarded.
+    latencies = []
+    found = 0
+    with redirect_stdout(io.StringIO()):
+        for start, end in pairs:
+            latency = float("inf")
+            for _ in range(max(repeat, 1)):
+                start_time = time.perf_counter()
+                path = search(start, end)
+                latency = min(latency, time.perf_counter() - start_time)
+            latencies.append(latency)
+            found += len(path) > 0
+
+    # 2. Peak memory, in a separate pass since tracing allocations slows the search down.
+    peak = 0
+    tracemalloc.start()
+    with redirect_stdout(io.StringIO()):
+        for start, end in pairs:
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            search(start, end)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    latencies = np.array(latencies)
+    return {
+        "mean_s": float(latencies.mean()),
+        "p50_s": float(np.percentile(latencies, 50)),
+        "p90_s": float(np.percentile(latencies, 90)),
+        "p99_s": float(np.percentile(latencies, 99)),
+        "max_s": float(latencies.max()),
+        "peak_memory_bytes": int(peak),
+        "found": found,
+    }
+
+
+def run_benchmarks(nasr_dir: str, graph_file: str, n_pairs: int = 100, seed: int = 0, build: bool = True,
+                   load_repeat: int = 5, query_repeat: int = 3, verbose: bool = True) -> dict:
+    """
+    Runs the benchmark suite.
+
+    Arguments:
+    - `nasr_dir` (str): directory with the NASR files to time the graph build on.
+    - `graph_file` (str): airway graph to time loading and route queries on.
+    - `n_pairs` (int, optional): number of random routes to query.
+    - `seed` (int, optional): random seed for the routes.
+    - `build` (bool, optional): time the NASR graph build.
+    - `load_repeat` (int, optional): number of graph file loads, and of cold start processes.
+    - `query_repeat` (int, optional): number of times each route is queried.
+    - `verbose` (bool, optional): print progress.
+
+    Returns:
+    A dictionary with the benchmark settings under `meta` and flat metric name to value under `metrics`.
+    Metric names end in `_s` for seconds and `_bytes` for memory.
+    """
+    metrics = {}
+    meta = {
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "nasr_dir": nasr_dir,
+        "graph_file": graph_file,
+        "pairs": n_pairs,
+        "seed": seed,
+    }
+
+    # 1. Graph build from the NASR files.
+    awy_graph = None
+    nasr_files = [os.path.join(nasr_dir, f) for f in NASR_FILES]
+    missing = [f for f in nasr_files if not os.path.exists(f)]
+    if build and len(missing) > 0:
+        print(f"Skipping the graph build benchmark, missing NASR files: {', '.join(missing)}")
+    elif build:
+        if verbose:
+            print(f"Timing the graph build from {nasr_dir}...")
+        timings, awy_graph = time_nasr_build(nasr_files)
+        for stage, elapsed in timings.items():
+            metrics[f"build.{stage}_s"] = elapsed
+
+    # 2. Graph file load. Without a graph file, the queries run on the graph built above.
+    landmarks = None
+    if os.path.exists(graph_file):
+        if verbose:
+            print(f"Timing graph loads from {graph_file}...")
+        load_times = time_graph_load(graph_file, load_repeat)
+        metrics["load.first_s"] = load_times["first"]
+        metrics["load.best_s"] = load_times["best"]
+        graph = load_graph(graph_file)
+        landmarks = LandmarkIndex.from_graph(graph)
+        awy_graph = graph.to_airway_graph(verbose=False)
+    elif awy_graph is not None:
+        print(f"Skipping the graph load benchmark, {graph_file} does not exist. Querying the built graph.")
+        graph = CompiledGraph.from_airway_graph(awy_graph)
+    else:
+        print(f"Skipping the query benchmarks, {graph_file} does not exist and no graph was built.")
+        return {"meta": meta, "metrics": metrics}
+    meta["eff_date"] = graph.eff_date
+
+    # 3. Cold start of a route query in a new process. Route queries shouldn't import the pandas ingest code.
+    pairs = od_pairs(graph, n_pairs, seed)
+    if os.path.exists(graph_file) and len(pairs) > 0:
+        if verbose:
+            print(f"Timing {load_repeat} cold starts...")
+        cold_start = time_cold_start(graph_file, *pairs[0], repeat=load_repeat)
+        for step in ("import", "load", "first_query", "process"):
+            metrics[f"startup.{step}_s"] = cold_start[step]
+        meta["startup_imports_pandas"] = cold_start["pandas"]
+        if cold_start["pandas"]:
+            print("Warning: the route query imports pandas, which slows down every cold start.")
+
+    # 4. Route queries with the original A* and the compiled A* used by `main.py`.
+    searches = {
+        "find_best_path": lambda start, end: find_best_path(awy_graph, start, end),
+        "compiled": lambda start, end: find_best_path_compiled(graph, start, end, landmarks=landmarks),
+    }
+    for name, search in searches.items():
+        if verbose:
+            print(f"Timing {len(pairs)} {name} queries...")
+        for metric, value in time_queries(search, pairs, query_repeat).items():
+            metrics[f"query.{name}.{metric}"] = value
+
+    return {"meta": meta, "metrics": metrics}
+
+
+def compare_results(prev: dict, curr: dict, threshold: float = 0.2) -> list:
+    """
+    Compares two benchmark results. Every metric ending in `_s` or `_bytes` is lower-is-better.
+
+    Arguments:
+    - `prev` (dict): previous `run_benchmarks` result.
+    - `curr` (dict): current `run_benchmarks` result.
+    - `threshold` (float, optional): relative increase flagged as a regression.
+
+    Returns:
+    A list of (metric, previous, current, ratio, regressed) tuples for the metrics in both results.
+    """
+    rows = []
+    for metric, value in curr["metrics"].items():
+        prev_value = prev["metrics"].get(metric)
+        unit = next((u for u in _MIN_DELTA if metric.endswith(u)), None)
+        if prev_value is None or unit is None:
+            continue
+
+        ratio = value / prev_value if prev_value > 0 else float("inf") if value > 0 else 1.0
+        regressed = value > prev_value * (1.0 + threshold) and value - prev_value > _MIN_DELTA[unit]
+        rows.append((metric, prev_value, value, ratio, regressed))
+
+    return rows
+
+
+def _format(metric: str, value: float) -> str:
+    if metric.endswith("_bytes"):
+        return f"{value / 1024:.0f} KiB"
+    if metric.endswith("_s"):
+        return f"{1000 * value:.2f} ms"
+    return f"{value}"
+
+
+if __name__ == "__main__":
+    # Make this script configurable
+    parser = argparse.ArgumentParser(description="Benchmark the graph build, graph load and route queries.")
+    parser.add_argument("--nasr_dir", default="data", help="Directory with the NASR files to build a graph from")
+    parser.add_argument("--graph_file", default="data/airway_graph.fpg")
+    parser.add_argument("--pairs", type=int, default=100, help="Number of random routes to query")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no_build", action="store_true", help="Skip the graph build benchmark")
+    parser.add_argument("--load_repeat", type=int, default=5, help="Number of graph file loads")
+    parser.add_argument("--query_repeat", type=int, default=3,
+                        help="Number of times each route is queried, the fastest time is used")
+    parser.add_argument("--out_file", default="", help="JSON file to save the results to")
+    parser.add_argument("--compare", default="", help="JSON results of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative slowdown or memory increase flagged as a regression")
+
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.nasr_dir, args.graph_file, args.pairs, args.seed, not args.no_build,
+                             args.load_repeat, args.query_repeat)
+
+    if args.out_file != "":
+        with open(args.out_file, "w") as f:
+            json.dump(results, f, indent=2)
+
+    # Print the results, compared with the previous run if one was given.
+    if args.compare != "":
+        with open(args.compare) as f:
+            prev = json.load(f)
+        if prev["meta"].get("pairs") != args.pairs or prev["meta"].get("seed") != args.seed:
+            print("Warning: the previous run queried a different set of routes.")
+
+        rows = compare_results(prev, results, args.threshold)
+        print(f"{'metric':<40} {'previous':>12} {'current':>12} {'ratio':>6}")
+        for metric, prev_value, value, ratio, regressed in rows:
+            flag = " REGRESSION" if regressed else ""
+            print(f"{metric:<40} {_format(metric, prev_value):>12} {_format(metric, value):>12} {ratio:>6.2f}{flag}")
+
+        regressions = [row[0] for row in rows if row[4]]
+        if len(regressions) > 0:
+            print(f"{len(regressions)} regressions over {100 * args.threshold:.0f}%.")
+            sys.exit(1)
+        print("No regressions.")
+    else:
+        for metric, value in results["metrics"].items():
+            print(f"{metric:<40} {_format(metric, value):>12}")
@@ -0,0 +1,275 @@
+import numpy as np
+
+from geo_utils import ecef
+from map_types import Airway, AirwayType, Waypoint, WaypointType
+
+
+class StringTable:
+    """
+    Immutable table of strings stored as one UTF-8 buffer plus offsets. Strings are looked up by
+    integer id, and ids are looked up by string with a binary search over a sorted permutation, so no
+    per-string Python objects are needed until a string is actually used.
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray, sorted_ids: np.ndarray):
+        # UTF-8 bytes of all strings back to back.
+        self.data = data
+
+        # String i is data[offsets[i]:offsets[i + 1]].
+        self.offsets = offsets
+
+        # String ids ordered by their UTF-8 bytes.
+        self.sorted_ids = sorted_ids
+
+    @classmethod
+    def from_strings(cls, strings) -> "StringTable":
+        """
+        Builds a string table.
+
+        Arguments:
+        - `strings` (iterable): strings to store, in id order.
+        """
+        encoded = [s.encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded], dtype=np.int64)
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        sorted_ids = np.array(sorted(range(len(encoded)), key=encoded.__getitem__), dtype=np.int32)
+
+        return cls(data, offsets, sorted_ids)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> str:
+        return self.get_bytes(idx).decode("utf-8")
+
+    def get_bytes(self, idx: int) -> bytes:
+        return self.data[self.offsets[idx]:self.offsets[idx + 1]].tobytes()
+
+    def tolist(self) -> list:
+        raw = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        return [raw[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(self))]
+
+    def find(self, name: str) -> int:
+        """
+        Finds the id of a string.
+
+        Arguments:
+        - `name` (str): string to find.
+
+        Returns:
+        The id of `name` if it is in the table, else -1.
+        """
+        key = name.encode("utf-8")
+        lo = 0
+        hi = len(self.sorted_ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get_bytes(self.sorted_ids[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < len(self.sorted_ids):
+            idx = int(self.sorted_ids[lo])
+            if self.get_bytes(idx) == key:
+                return idx
+        return -1
+
+
+class CompiledGraph:
+    """
+    Array form of an `AirwayGraph` for fast searching. Waypoints are numbered 0..N-1 and airways are
+    stored in compressed sparse row (CSR) layout: the airways leaving node i are the entries
+    offsets[i]:offsets[i + 1] of `targets`, `weights`, `airway_type` and `airway_name_ids`.
+    """
+
+    def __init__(self, names: StringTable, lat: np.ndarray, lon: np.ndarray, wpt_type: np.ndarray,
+                 offsets: np.ndarray, targets: np.ndarray, weights: np.ndarray, airway_type: np.ndarray,
+                 airway_names: StringTable, airway_name_ids: np.ndarray, eff_date: str = ""):
+        # Node tables.
+        self.names = names
+        self.lat = lat
+        self.lon = lon
+        self.wpt_type = wpt_type
+
+        # Edge tables in CSR layout.
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self.airway_type = airway_type
+
+        # Airway names (procedure names for SIDs and STARs). Id 0 is the empty name.
+        self.airway_names = airway_names
+        self.airway_name_ids = airway_name_ids
+
+        # NASR effective date of the source data ("YYYY/MM/DD"), empty if unknown.
+        self.eff_date = eff_date
+
+        # Binary graph file backing the arrays, if the graph was opened from one.
+        self.graph_file = None
+
+        # Reverse adjacency and ECEF coordinates, built on first use.
+        self._reverse = None
+        self._ecef = None
+
+    @classmethod
+    def from_airway_graph(cls, graph) -> "CompiledGraph":
+        """
+        Compiles an airway graph. Node ids follow the waypoint dictionary order and each node's edges
+        follow its airway dictionary order, so searches visit neighbors in the same order as
+        `find_best_path`.
+
+        Arguments:
+        - `graph` (AirwayGraph): airway graph to compile.
+        """
+        wpt_names = list(graph.waypoints.keys())
+        node_ids = {name: i for i, name in enumerate(wpt_names)}
+        wpts = list(graph.waypoints.values())
+
+        # Edges, grouped by start node.
+        degree = np.zeros(len(wpt_names), dtype=np.int64)
+        targets = []
+        weights = []
+        awy_types = []
+        awy_name_ids = []
+        awy_name_table = {"": 0}
+        for i, name in enumerate(wpt_names):
+            airways = graph.airways.get(name, {})
+            degree[i] = len(airways)
+            for end_id, awy in airways.items():
+                targets.append(node_ids[end_id])
+                weights.append(awy.distance)
+                awy_types.append(awy.airway_type.value)
+
+                # Unnamed airways may carry a missing value from the source CSV.
+                awy_name = awy.name if isinstance(awy.name, str) else ""
+                awy_name_ids.append(awy_name_table.setdefault(awy_name, len(awy_name_table)))
+
+        offsets = np.zeros(len(wpt_names) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(degree)
+
+        return cls(
+            StringTable.from_strings(wpt_names),
+            np.array([w.lat for w in wpts], dtype=np.float64),
+            np.array([w.lon for w in wpts], dtype=np.float64),
+            np.array([w.wpt_type.value for w in wpts], dtype=np.int8),
+            offsets,
+            np.array(targets, dtype=np.int32),
+            np.array(weights, dtype=np.float64),
+            np.array(awy_types, dtype=np.int8),
+            StringTable.from_strings(awy_name_table.keys()),
+            np.array(awy_name_ids, dtype=np.int32),
+            eff_date=getattr(graph, "eff_date", ""))
+
+    def to_airway_graph(self, verbose=True):
+        """
+        Rebuilds an `AirwayGraph` from the compiled arrays.
+
+        Arguments:
+        - `verbose` (bool, optional): flag for turning the graph's prints on and off.
+
+        Returns:
+        An `AirwayGraph` with the same waypoints and airways.
+        """
+        from airway_graph import AirwayGraph
+
+        graph = AirwayGraph(verbose=verbose)
+        graph.eff_date = self.eff_date
+
+        names = self.names.tolist()
+        wpt_types = {t.value: t for t in WaypointType}
+        for name, lat, lon, wpt_type in zip(names, self.lat.tolist(), self.lon.tolist(), self.wpt_type.tolist()):
+            graph.waypoints[name] = Waypoint(name, lat, lon, wpt_types[wpt_type], "")
+
+        awy_types = {t.value: t for t in AirwayType}
+        awy_names = self.airway_names.tolist()
+        offsets = self.offsets.tolist()
+        targets = self.targets.tolist()
+        weights = self.weights.tolist()
+        edge_types = self.airway_type.tolist()
+        edge_names = self.airway_name_ids.tolist()
+        for node, name in enumerate(names):
+            if offsets[node] == offsets[node + 1]:
+                continue
+
+            airways = graph.airways.setdefault(name, {})
+            start_pt = graph.waypoints[name]
+            for edge in range(offsets[node], offsets[node + 1]):
+                end_pt = graph.waypoints[names[targets[edge]]]
+                airways[end_pt.name] = Airway(start_pt, end_pt, weights[edge], True,
+                                              awy_types[edge_types[edge]], awy_names[edge_names[edge]])
+
+        return graph
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.targets)
+
+    def node_id(self, ident: str) -> int:
+        """
+        Get the node id of a named waypoint.
+
+        Arguments:
+        - `ident` (str): The waypoint name to find.
+
+        Returns:
+        The node id if the waypoint exists, else -1.
+        """
+        return self.names.find(ident)
+
+    def node_name(self, node: int) -> str:
+        return self.names[node]
+
+    def edge_range(self, node: int) -> tuple:
+        """
+        Get the range of edge indices leaving a node.
+
+        Arguments:
+        - `node` (int): node id.
+
+        Returns:
+        A (start, stop) tuple of edge indices.
+        """
+        return int(self.offsets[node]), int(self.offsets[node + 1])
+
+    def reverse_adjacency(self) -> tuple:
+        """
+        Get the reverse adjacency in CSR layout: the airways arriving at node i are the entries
+        rev_offsets[i]:rev_offsets[i + 1] of `rev_sources` (the airway start nodes) and `rev_edges` (the
+        airway edge indices). One-way DEPARTURE and ARRIVAL airways only appear in their own direction.
+
+        Returns:
+        A (rev_offsets, rev_sources, rev_edges) tuple of arrays.
+        """
+        if self._reverse is None:
+            sources = np.repeat(np.arange(self.num_nodes, dtype=np.int32), np.diff(self.offsets))
+            rev_edges = np.argsort(self.targets, kind="stable").astype(np.int64)
+            rev_offsets = np.zeros(self.num_nodes + 1, dtype=np.int64)
+            rev_offsets[1:] = np.cumsum(np.bincount(self.targets, minlength=self.num_nodes))
+            self._reverse = (rev_offsets, sources[rev_edges], rev_edges)
+
+        return self._reverse
+
+    def ecef(self) -> np.ndarray:
+        """
+        Get the Earth-centered, Earth-fixed coordinates of the nodes, used for fast distance lower bounds.
+
+        Returns:
+        A float64 array of shape (num_nodes, 3) with x, y, z in meters.
+        """
+        if self._ecef is None:
+            self._ecef = ecef(self.lat, self.lon)
+
+        return self._ecef
+
+    def get_waypoint_type(self, node: int) -> WaypointType:
+        return WaypointType(int(self.wpt_type[node]))
+
+    def get_airway_type(self, edge: int) -> AirwayType:
+        return AirwayType(int(self.airway_type[edge]))
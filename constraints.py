@@ -0,0 +1,489 @@
+import argparse
+import datetime
+import json
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from airway_index import AirwayIndex
+from compiled_graph import CompiledGraph
+from map_types import AirwayType
+from procedures import ProcedureIndex
+
+
+@dataclass
+class Closure:
+    """
+    Closed area, airways or fixes, such as a TFR or a NOTAM. A closure blocks every airway that crosses
+    its polygon, every airway with one of its names, and every airway into or out of one of its fixes,
+    while the flight is inside its altitude and time windows.
+    """
+    name: str = ""
+
+    # Closed area as (lat, lon) vertices in decimal degrees.
+    polygon: list = field(default_factory=list)
+
+    # Closed airway and procedure names, and closed waypoint identifiers.
+    airways: list = field(default_factory=list)
+    fixes: list = field(default_factory=list)
+
+    # Altitude window in feet MSL. None is unbounded.
+    floor: float = None
+    ceiling: float = None
+
+    # Time window. None is unbounded.
+    start: datetime.datetime = None
+    end: datetime.datetime = None
+
+    def is_active(self, altitude: float = None, when: datetime.datetime = None) -> bool:
+        """
+        Checks if the closure applies to a flight. An unknown altitude or time matches every window.
+
+        Arguments:
+        - `altitude` (float, optional): flight altitude in feet MSL.
+        - `when` (datetime, optional): time of the flight.
+        """
+        if altitude is not None:
+            if self.floor is not None and altitude < self.floor:
+                return False
+            if self.ceiling is not None and altitude > self.ceiling:
+                return False
+
+        if when is not None:
+            if self.start is not None and when < self.start:
+                return False
+            if self.end is not None and when > self.end:
+                return False
+
+        return True
+
+
+class EdgeGrid:
+    """
+    Grid index of airway segments. Each airway is treated as a straight segment in latitude/longitude and
+    is listed in every grid cell it passes through, in CSR layout: the airways in cell c are
+    edges[cell_offsets[c]:cell_offsets[c + 1]].
+    """
+
+    def __init__(self, cell_size: float, lat0: float, lon0: float, n_rows: int, n_cols: int,
+                 cell_offsets: np.ndarray, edges: np.ndarray):
+        # Grid geometry, with the cell (0, 0) south-west corner at (lat0, lon0).
+        self.cell_size = cell_size
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+
+        # Edge ids per cell, in CSR layout.
+        self.cell_offsets = cell_offsets
+        self.edges = edges
+
+    @classmethod
+    def build(cls, graph: CompiledGraph, cell_size: float = 0.5) -> "EdgeGrid":
+        """
+        Builds the grid over the airways of a graph.
+
+        Arguments:
+        - `graph` (CompiledGraph): graph whose airways are indexed.
+        - `cell_size` (float, optional): grid cell size in degrees.
+        """
+        src = np.repeat(np.arange(graph.num_nodes), np.diff(graph.offsets))
+        dst = np.asarray(graph.targets)
+        lat = np.asarray(graph.lat, dtype=np.float64)
+        lon = np.asarray(graph.lon, dtype=np.float64)
+
+        lat0 = np.floor(lat.min() / cell_size) * cell_size if len(lat) > 0 else 0.0
+        lon0 = np.floor(lon.min() / cell_size) * cell_size if len(lon) > 0 else 0.0
+        n_rows = int((lat.max() - lat0) // cell_size) + 1 if len(lat) > 0 else 1
+        n_cols = int((lon.max() - lon0) // cell_size) + 1 if len(lon) > 0 else 1
+        grid = cls(cell_size, lat0, lon0, n_rows, n_cols, np.zeros(n_rows * n_cols + 1, dtype=np.int64),
+                   np.zeros(0, dtype=np.int32))
+
+        # Split each airway into pieces no longer than a cell in either direction. A piece's bounding box
+        # covers at most 2 x 2 cells, and together they cover every cell the airway passes through.
+        steps = np.maximum(np.ceil(np.fmax(np.abs(lat[dst] - lat[src]), np.abs(lon[dst] - lon[src])) / cell_size), 1)
+        steps = steps.astype(np.int64)
+        piece_edges = np.repeat(np.arange(len(dst), dtype=np.int64), steps)
+        piece = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+        t0 = piece / steps[piece_edges]
+        t1 = (piece + 1) / steps[piece_edges]
+        a_lat, a_lon = lat[src][piece_edges], lon[src][piece_edges]
+        d_lat, d_lon = lat[dst][piece_edges] - a_lat, lon[dst][piece_edges] - a_lon
+        row0, col0 = grid._cell(a_lat + t0 * d_lat, a_lon + t0 * d_lon)
+        row1, col1 = grid._cell(a_lat + t1 * d_lat, a_lon + t1 * d_lon)
+
+        # Corners of each piece's cell box, deduplicated per airway.
+        rows = np.concatenate((row0, row0, row1, row1))
+        cols = np.concatenate((col0, col1, col0, col1))
+        keys = np.unique(np.tile(piece_edges, 4) * (n_rows * n_cols) + rows * n_cols + cols)
+        edge_ids = (keys // (n_rows * n_cols)).astype(np.int32)
+        cells = keys % (n_rows * n_cols)
+
+        order = np.argsort(cells, kind="stable")
+        grid.edges = edge_ids[order]
+        grid.cell_offsets = np.zeros(n_rows * n_cols + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=n_rows * n_cols), out=grid.cell_offsets[1:])
+
+        return grid
+
+    @classmethod
+    def from_graph(cls, graph: CompiledGraph) -> "EdgeGrid":
+        """
+        Loads the edge grid stored with a graph file.
+
+        Returns:
+        The edge grid, or `None` if the graph has no edge grid.
+        """
+        gf = graph.graph_file
+        if gf is None or not gf.has_section("edge_grid.edges"):
+            return None
+
+        cell_size, lat0, lon0, n_rows, n_cols = gf.array("edge_grid.geometry").tolist()
+        return cls(cell_size, lat0, lon0, int(n_rows), int(n_cols), gf.array("edge_grid.cell_offsets"),
+                   gf.array("edge_grid.edges"))
+
+    def to_sections(self) -> dict:
+        """
+        Get the grid arrays as graph file sections.
+        """
+        return {
+            "edge_grid.geometry": np.array([self.cell_size, self.lat0, self.lon0, self.n_rows, self.n_cols]),
+            "edge_grid.cell_offsets": self.cell_offsets,
+            "edge_grid.edges": self.edges,
+        }
+
+    def candidates(self, min_lat, min_lon, max_lat, max_lon) -> tuple:
+        """
+        Get the airways listed in the cells overlapping a set of latitude/longitude boxes.
+
+        Arguments:
+        - `min_lat`, `min_lon`, `max_lat`, `max_lon` (array-like): box corners in decimal degrees.
+
+        Returns:
+        A (box ids, edge ids) tuple of arrays. Airways spanning several cells of a box are listed once per cell.
+        """
+        row_lo, col_lo = self._cell(np.atleast_1d(min_lat), np.atleast_1d(min_lon))
+        row_hi, col_hi = self._cell(np.atleast_1d(max_lat), np.atleast_1d(max_lon))
+
+        # The cells of a box row are contiguous in the CSR layout.
+        box_ids = []
+        found = []
+        for box, (r0, r1, c0, c1) in enumerate(zip(row_lo.tolist(), row_hi.tolist(), col_lo.tolist(),
+                                                   col_hi.tolist())):
+            for row in range(r0, r1 + 1):
+                edges = self.edges[self.cell_offsets[row * self.n_cols + c0]:self.cell_offsets[row * self.n_cols + c1 + 1]]
+                box_ids.append(np.full(len(edges), box, dtype=np.int64))
+                found.append(edges)
+
+        if len(found) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        return np.concatenate(box_ids), np.concatenate(found)
+
+    def _cell(self, lat, lon) -> tuple:
+        # Grid row and column of a point, clipped to the grid.
+        row = np.clip(((np.asarray(lat) - self.lat0) // self.cell_size).astype(np.int64), 0, self.n_rows - 1)
+        col = np.clip(((np.asarray(lon) - self.lon0) // self.cell_size).astype(np.int64), 0, self.n_cols - 1)
+        return row, col
+
+
+class ConstraintSet:
+    """
+    Turns closures into per-query edge masks for a graph. The graph itself is never modified: searches
+    skip the airways flagged in the mask.
+
+    Enroute airways are stored without their ids, so closed airways are found through the airway index:
+    every segment between consecutive fixes of the airway is blocked, in both directions.
+    """
+
+    def __init__(self, graph: CompiledGraph, edge_grid: EdgeGrid = None, airways: AirwayIndex = None,
+                 procedures: ProcedureIndex = None):
+        """
+        Arguments:
+        - `graph` (CompiledGraph): graph the masks are for.
+        - `edge_grid` (EdgeGrid, optional): airway segment index of the graph. Default is the one stored in
+                                            the graph file, or a new one if there is none.
+        - `airways` (AirwayIndex, optional): fix sequences of the published airways, to close enroute
+                                             airways by id. Default is the one stored in the graph file.
+        - `procedures` (ProcedureIndex, optional): procedure index of the graph, to recognize closed
+                                                   procedure computer codes. Default is the one stored in
+                                                   the graph file.
+        """
+        self.graph = graph
+        if edge_grid is None:
+            edge_grid = EdgeGrid.from_graph(graph)
+        self.edge_grid = edge_grid if edge_grid is not None else EdgeGrid.build(graph)
+        self.airways = airways if airways is not None else AirwayIndex.from_graph(graph)
+
+        # Computer codes of the procedure options, which `procedure_mask` closes.
+        if procedures is None:
+            procedures = ProcedureIndex.from_graph(graph)
+        self._procedure_names = set()
+        if procedures is not None:
+            for table in procedures.tables.values():
+                self._procedure_names.update(procedures.names[int(i)] for i in np.unique(table["name_ids"]))
+
+        # Start node of every airway, for the segment tests.
+        self._sources = np.repeat(np.arange(graph.num_nodes, dtype=np.int32), np.diff(graph.offsets))
+
+    def edge_mask(self, closures: list, altitude: float = None, when: datetime.datetime = None) -> np.ndarray:
+        """
+        Builds the mask of airways blocked by a set of closures.
+
+        Arguments:
+        - `closures` (list): `Closure` objects.
+        - `altitude` (float, optional): flight altitude in feet MSL. Default applies every altitude window.
+        - `when` (datetime, optional): time of the flight. Default applies every time window.
+
+        Returns:
+        A boolean array over edge ids, True for blocked airways.
+        """
+        graph = self.graph
+        blocked = np.zeros(graph.num_edges, dtype=bool)
+        active = [closure for closure in closures if closure.is_active(altitude, when)]
+
+        # 1. Airways crossing the closed areas, tested for all polygons at once.
+        polygons = [closure.polygon for closure in active if len(closure.polygon) >= 3]
+        if len(polygons) > 0:
+            blocked[self.polygon_edges(polygons)] = True
+
+        for closure in active:
+            # 2. Enroute airways by id, and procedure airways by name. Names that match nothing would
+            # silently leave the airway open, so they are reported.
+            for name in closure.airways:
+                edges = self.airway_edges(name)
+                name_id = graph.airway_names.find(name)
+                if name_id > 0:
+                    edges = np.union1d(edges, np.flatnonzero(graph.airway_name_ids == name_id))
+                blocked[edges] = True
+
+                if len(edges) == 0 and name not in self._procedure_names:
+                    print(f"Warning: closure {closure.name}: {name} is not an airway or procedure of the graph, "
+                          f"it closes nothing.")
+
+            # 3. Airways into and out of closed fixes.
+            nodes = [graph.node_id(ident) for ident in closure.fixes]
+            nodes = [n for n in nodes if n >= 0]
+            if len(nodes) > 0:
+                blocked |= np.isin(self._sources, nodes) | np.isin(graph.targets, nodes)
+
+        return blocked
+
+    def airway_edges(self, airway: str) -> np.ndarray:
+        """
+        Finds the segments of an enroute airway, in both directions.
+
+        Arguments:
+        - `airway` (str): airway id, such as J52.
+
+        Returns:
+        An array of edge ids. Empty if the airway is unknown or the graph has no airway index.
+        """
+        pieces = self.airways.pieces(airway) if self.airways is not None else []
+        if len(pieces) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # Consecutive fixes of each piece, as source * num_nodes + target keys.
+        n_nodes = np.int64(self.graph.num_nodes)
+        src = np.concatenate([fixes[:-1] for fixes in pieces]).astype(np.int64)
+        dst = np.concatenate([fixes[1:] for fixes in pieces]).astype(np.int64)
+        keys = np.concatenate((src * n_nodes + dst, dst * n_nodes + src))
+
+        edge_keys = self._sources.astype(np.int64) * n_nodes + self.graph.targets
+        enroute = self.graph.airway_type == AirwayType.ENROUTE.value
+        return np.flatnonzero(np.isin(edge_keys, keys) & enroute)
+
+    def polygon_edges(self, polygons: list) -> np.ndarray:
+        """
+        Finds the airways crossing any of a set of polygons. Airways are treated as straight segments in
+        latitude/longitude, like the polygon sides.
+
+        Arguments:
+        - `polygons` (list): polygons as lists of (lat, lon) vertices in decimal degrees.
+
+        Returns:
+        An array of unique edge ids.
+        """
+        verts = _pad_polygons(polygons)
+
+        # Candidate airways of each polygon, from the grid cells of its bounding box.
+        min_lat, max_lat = verts[:, :, 0].min(axis=1), verts[:, :, 0].max(axis=1)
+        min_lon, max_lon = verts[:, :, 1].min(axis=1), verts[:, :, 1].max(axis=1)
+        poly_ids, edges = self.edge_grid.candidates(min_lat, min_lon, max_lat, max_lon)
+        if len(edges) == 0:
+            return edges
+
+        # Drop candidates whose bounding box misses the polygon's, and duplicates from airways listed in
+        # several cells.
+        src = self._sources[edges]
+        dst = self.graph.targets[edges]
+        a_lat, a_lon = self.graph.lat[src], self.graph.lon[src]
+        b_lat, b_lon = self.graph.lat[dst], self.graph.lon[dst]
+        overlaps = ((np.fmax(a_lat, b_lat) >= min_lat[poly_ids]) & (np.fmin(a_lat, b_lat) <= max_lat[poly_ids]) &
+                    (np.fmax(a_lon, b_lon) >= min_lon[poly_ids]) & (np.fmin(a_lon, b_lon) <= max_lon[poly_ids]))
+        keys = np.unique(poly_ids[overlaps] * self.graph.num_edges + edges[overlaps])
+        poly_ids = keys // self.graph.num_edges
+        edges = keys % self.graph.num_edges
+
+        hits = _segments_cross_polygons(self._sources[edges], self.graph.targets[edges], self.graph, verts, poly_ids)
+        return np.unique(edges[hits])
+
+    def procedure_mask(self, procedures, kind: str, closures: list, altitude: float = None,
+                       when: datetime.datetime = None) -> np.ndarray:
+        """
+        Builds the mask of departure or arrival options blocked by a set of closures. Procedure legs are not
+        airways of the graph, so an option is checked on its own path: it is blocked if one of its legs
+        crosses a closed area, if it flies through a closed fix, or if its computer code is closed.
+
+        Arguments:
+        - `procedures` (ProcedureIndex): procedure index of the graph.
+        - `kind` (str): "departures" or "arrivals".
+        - `closures` (list): `Closure` objects.
+        - `altitude` (float, optional): flight altitude in feet MSL. Default applies every altitude window.
+        - `when` (datetime, optional): time of the flight. Default applies every time window.
+
+        Returns:
+        A boolean array over the option ids of `kind`, True for blocked options.
+        """
+        table = procedures.tables[kind]
+        path = table["path"]
+        n_options = len(table["path_offsets"]) - 1
+        option_of = np.repeat(np.arange(n_options), np.diff(table["path_offsets"]))
+        blocked = np.zeros(n_options, dtype=bool)
+        active = [closure for closure in closures if closure.is_active(altitude, when)]
+
+        # 1. Legs crossing the closed areas. Legs join consecutive points of the same option.
+        polygons = [closure.polygon for closure in active if len(closure.polygon) >= 3]
+        legs = np.flatnonzero(option_of[:-1] == option_of[1:])
+        if len(polygons) > 0 and len(legs) > 0:
+            verts = _pad_polygons(polygons)
+            poly_ids = np.repeat(np.arange(len(polygons)), len(legs))
+            legs = np.tile(legs, len(polygons))
+            hits = _segments_cross_polygons(path[legs], path[legs + 1], self.graph, verts, poly_ids)
+            blocked[option_of[legs[hits]]] = True
+
+        for closure in active:
+            # 2. Options by computer code.
+            name_ids = [procedures.names.find(name) for name in closure.airways]
+            name_ids = [i for i in name_ids if i >= 0]
+            if len(name_ids) > 0:
+                blocked |= np.isin(table["name_ids"], name_ids)
+
+            # 3. Options through closed fixes.
+            nodes = [self.graph.node_id(ident) for ident in closure.fixes]
+            nodes = [n for n in nodes if n >= 0]
+            if len(nodes) > 0:
+                blocked[option_of[np.isin(path, nodes)]] = True
+
+        return blocked
+
+
+def _pad_polygons(polygons: list) -> np.ndarray:
+    # Pads the polygons to the same number of vertices by repeating their last vertex. The padding sides
+    # have zero length, so they never cross anything.
+    n_vertices = max(len(poly) for poly in polygons)
+    return np.array([list(poly) + [poly[-1]] * (n_vertices - len(poly)) for poly in polygons], dtype=np.float64)
+
+
+def _segments_cross_polygons(src: np.ndarray, dst: np.ndarray, graph: CompiledGraph, verts: np.ndarray,
+                             poly_ids: np.ndarray) -> np.ndarray:
+    # Tests each segment src -> dst between graph nodes against the padded polygon `verts[poly_ids]`.
+    a = (graph.lat[src][:, None], graph.lon[src][:, None])
+    b = (graph.lat[dst][:, None], graph.lon[dst][:, None])
+
+    # Polygon sides c -> d, one row per segment.
+    c = (verts[poly_ids, :, 0], verts[poly_ids, :, 1])
+    d = (np.roll(c[0], -1, axis=1), np.roll(c[1], -1, axis=1))
+
+    # A segment crosses a polygon if an end point is inside it or if it crosses one of its sides.
+    return _points_in_polygons(a, c, d) | _points_in_polygons(b, c, d) | _crosses_sides(a, b, c, d)
+
+
+def _points_in_polygons(p: tuple, c: tuple, d: tuple) -> np.ndarray:
+    # Even-odd ray casting of each point p against the sides c -> d of its polygon. Points and sides are
+    # (lat, lon) tuples of arrays.
+    y, x = p
+    y1, x1 = c
+    y2, x2 = d
+
+    straddles = (y1 > y) != (y2 > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    return np.count_nonzero(straddles & (x < x_cross), axis=1) % 2 == 1
+
+
+def _crosses_sides(a: tuple, b: tuple, c: tuple, d: tuple) -> np.ndarray:
+    # Segment intersection by orientation tests of each segment a -> b against the sides c -> d of its polygon.
+    def orient(p, q, r):
+        return np.sign((q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0]))
+
+    crosses = (orient(a, b, c) != orient(a, b, d)) & (orient(c, d, a) != orient(c, d, b))
+    return np.any(crosses, axis=1)
+
+
+def parse_time(value: str) -> datetime.datetime:
+    """
+    Parses an ISO 8601 time, in UTC unless a time zone is given.
+
+    Arguments:
+    - `value` (str): time string, or `None`.
+    """
+    if value is None:
+        return None
+
+    when = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return when if when.tzinfo is not None else when.replace(tzinfo=datetime.timezone.utc)
+
+
+def parse_closure(data: dict) -> Closure:
+    """
+    Builds a closure from its JSON form: an object with optional `name`, `polygon` ([[lat, lon], ...]),
+    `airways`, `fixes`, `floor` and `ceiling` (feet MSL), and `start` and `end` (ISO 8601 times, UTC
+    unless given).
+    """
+    return Closure(data.get("name", ""), [tuple(p) for p in data.get("polygon", [])], list(data.get("airways", [])),
+                   list(data.get("fixes", [])), data.get("floor"), data.get("ceiling"),
+                   parse_time(data.get("start")), parse_time(data.get("end")))
+
+
+def load_constraints(constraints_file: str) -> list:
+    """
+    Reads closures from a JSON file holding a list of closures, or an object with a `closures` list.
+
+    Arguments:
+    - `constraints_file` (str): file path of the closures.
+
+    Returns:
+    A list of `Closure` objects.
+    """
+    with open(constraints_file) as f:
+        data = json.load(f)
+
+    if isinstance(data, dict):
+        data = data.get("closures", [])
+
+    return [parse_closure(item) for item in data]
+
+
+if __name__ == "__main__":
+    from graph_file import load_graph
+
+    # Make this script configurable
+    parser = argparse.ArgumentParser(description="Report the airways blocked by a set of closures.")
+    parser.add_argument("constraints_file", help="JSON file of closures")
+    parser.add_argument("--graph_file", default="data/airway_graph.fpg")
+    parser.add_argument("--altitude", type=float, default=None, help="Flight altitude in feet MSL")
+    parser.add_argument("--time", default=None, help="Flight time in ISO 8601, UTC unless given")
+
+    args = parser.parse_args()
+
+    graph = load_graph(args.graph_file)
+    closures = load_constraints(args.constraints_file)
+    constraints = ConstraintSet(graph)
+
+    start_time = time.perf_counter()
+    mask = constraints.edge_mask(closures, args.altitude, parse_time(args.time))
+    elapsed = time.perf_counter() - start_time
+
+    print(f"{len(closures)} closures block {int(mask.sum())} of {graph.num_edges} airways ({elapsed * 1000:.2f} ms)")
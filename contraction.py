@@ -0,0 +1,376 @@
+import argparse
+import heapq
+import io
+import math
+import random
+import sys
+import time
+from contextlib import redirect_stdout
+
+import numpy as np
+
+from compiled_graph import CompiledGraph
+from map_types import AirwayType
+
+
+class ContractionHierarchy:
+    """
+    Contraction hierarchy (CH) over a compiled airway graph. Nodes are contracted one at a time in
+    order of importance. Contracting a node removes it and adds shortcut airways between its remaining
+    neighbors wherever the node was on the only shortest path between them. A query then only needs
+    to search "upward" (towards more important nodes) from both the start and the end.
+
+    Airways are directed, so one-way DEPARTURE and ARRIVAL airways are handled naturally: shortcuts
+    are only created along existing airway directions.
+
+    Edge storage, in CSR layout per node v:
+    - `up_*`: edges v->x with rank[x] > rank[v], searched forward from the start.
+    - `down_*`: edges u->v with rank[u] > rank[v], stored at v and searched backward from the end.
+    Each edge has a `middle` node: -1 for an original airway, otherwise the node it shortcuts.
+    """
+
+    def __init__(self, rank: np.ndarray, up_offsets: np.ndarray, up_targets: np.ndarray, up_weights: np.ndarray,
+                 up_middle: np.ndarray, down_offsets: np.ndarray, down_sources: np.ndarray,
+                 down_weights: np.ndarray, down_middle: np.ndarray, eff_date: str = "", num_edges: int = 0):
+        self.rank = rank
+        self.up_offsets = up_offsets
+        self.up_targets = up_targets
+        self.up_weights = up_weights
+        self.up_middle = up_middle
+        self.down_offsets = down_offsets
+        self.down_sources = down_sources
+        self.down_weights = down_weights
+        self.down_middle = down_middle
+
+        # Fingerprint of the graph the hierarchy was built for.
+        self.eff_date = eff_date
+        self.num_edges = num_edges
+
+    @classmethod
+    def build(cls, graph: CompiledGraph, witness_settle_limit=200, witness_hop_limit=5, priority_hop_limit=2,
+              allow_custom=False, verbose=False) -> "ContractionHierarchy":
+        """
+        Builds a contraction hierarchy.
+
+        Arguments:
+        - `graph` (CompiledGraph): graph to preprocess.
+        - `witness_settle_limit` (int, optional): maximum number of nodes settled by each witness
+                                                  search. Lower values build faster but add more
+                                                  (unneeded, but harmless) shortcuts.
+        - `witness_hop_limit` (int, optional): maximum number of airways in a witness path. Like the settle
+                                               limit, this bounds the witness searches once the remaining
+                                               graph gets dense, at the cost of extra shortcuts.
+        - `priority_hop_limit` (int, optional): hop limit of the witness searches that only estimate a
+                                                node's priority. The estimate only orders the nodes, so it
+                                                can be rougher than the searches run to contract them.
+        - `allow_custom` (bool, optional): build the hierarchy even if the graph has CUSTOM airways. The
+                                           many short CUSTOM airways make the remaining graph dense, so the
+                                           build takes much longer, and the hierarchy can't be used to
+                                           route without custom airways.
+        - `verbose` (bool, optional): print progress.
+
+        Raises:
+        `ValueError` if the graph has CUSTOM airways and `allow_custom` is False.
+        """
+        n_custom = int(np.count_nonzero(graph.airway_type == AirwayType.CUSTOM.value))
+        if n_custom > 0:
+            if not allow_custom:
+                raise ValueError(f"The graph has {n_custom} CUSTOM airways. Contraction hierarchies of graphs with "
+                                 f"custom airways are slow to build and can't route without them.")
+            print(f"Warning: building a contraction hierarchy over {n_custom} CUSTOM airways, this can take a "
+                  f"long time.")
+
+        n_nodes = graph.num_nodes
+
+        # Remaining graph as adjacency dictionaries: out_adj[v][x] = in_adj[x][v] = (weight, middle).
+        out_adj = [{} for _ in range(n_nodes)]
+        in_adj = [{} for _ in range(n_nodes)]
+        offsets = graph.offsets.tolist()
+        targets = graph.targets.tolist()
+        weights = graph.weights.tolist()
+        for node in range(n_nodes):
+            for edge in range(offsets[node], offsets[node + 1]):
+                end = targets[edge]
+                if end == node:
+                    continue
+                if end not in out_adj[node] or weights[edge] < out_adj[node][end][0]:
+                    out_adj[node][end] = (weights[edge], -1)
+                    in_adj[end][node] = (weights[edge], -1)
+
+        contracted = [False] * n_nodes
+        contracted_neighbors = [0] * n_nodes
+
+        def find_shortcuts(node: int, hop_limit: int) -> list:
+            # Find the shortcuts needed to contract `node`, as (start, end, weight) tuples.
+            shortcuts = []
+            for start, (w_in, _) in in_adj[node].items():
+                max_len = 0.0
+                for end, (w_out, _) in out_adj[node].items():
+                    if end != start:
+                        max_len = max(max_len, w_in + w_out)
+                if max_len == 0.0:
+                    continue
+
+                witness = _witness_search(out_adj, start, node, max_len, witness_settle_limit, hop_limit)
+                for end, (w_out, _) in out_adj[node].items():
+                    if end == start:
+                        continue
+                    via_len = w_in + w_out
+                    if witness.get(end, math.inf) > via_len:
+                        shortcuts.append((start, end, via_len))
+            return shortcuts
+
+        def priority(node: int, shortcuts: list) -> int:
+            # Edge difference plus the number of contracted neighbors, to contract uniformly.
+            return len(shortcuts) - len(in_adj[node]) - len(out_adj[node]) + contracted_neighbors[node]
+
+        # Initial node order, from the cheaper estimate.
+        queue = [(priority(node, find_shortcuts(node, priority_hop_limit)), node) for node in range(n_nodes)]
+        heapq.heapify(queue)
+
+        rank = np.zeros(n_nodes, dtype=np.int32)
+        up_edges = [None] * n_nodes
+        down_edges = [None] * n_nodes
+        next_rank = 0
+        start_time = time.perf_counter()
+        while queue:
+            _, node = heapq.heappop(queue)
+            if contracted[node]:
+                continue
+
+            # Lazy update: re-evaluate the priority with the cheaper estimate, and defer the node if it is no
+            # longer the best.
+            prio = priority(node, find_shortcuts(node, priority_hop_limit))
+            if queue and prio > queue[0][0]:
+                heapq.heappush(queue, (prio, node))
+                continue
+
+            # Contract the node.
+            for start, end, via_len in find_shortcuts(node, witness_hop_limit):
+                if end not in out_adj[start] or via_len < out_adj[start][end][0]:
+                    out_adj[start][end] = (via_len, node)
+                    in_adj[end][start] = (via_len, node)
+
+            # The remaining edges of the node all lead to higher ranked nodes.
+            up_edges[node] = [(end, w, mid) for end, (w, mid) in out_adj[node].items()]
+            down_edges[node] = [(start, w, mid) for start, (w, mid) in in_adj[node].items()]
+            for end in out_adj[node]:
+                del in_adj[end][node]
+                contracted_neighbors[end] += 1
+            for start in in_adj[node]:
+                del out_adj[start][node]
+                contracted_neighbors[start] += 1
+            out_adj[node] = {}
+            in_adj[node] = {}
+
+            contracted[node] = True
+            rank[node] = next_rank
+            next_rank += 1
+
+            if verbose and next_rank % 5000 == 0:
+                print(f"Contracted {next_rank}/{n_nodes} nodes in {time.perf_counter() - start_time:.1f} s")
+
+        up = _to_csr(up_edges)
+        down = _to_csr(down_edges)
+        return cls(rank, *up, *down, eff_date=graph.eff_date, num_edges=graph.num_edges)
+
+    @property
+    def num_shortcuts(self) -> int:
+        return int(np.count_nonzero(self.up_middle >= 0) + np.count_nonzero(self.down_middle >= 0))
+
+    def matches(self, graph: CompiledGraph) -> bool:
+        """
+        Checks that the hierarchy was built for the given graph.
+        """
+        return (len(self.rank) == graph.num_nodes and self.num_edges == graph.num_edges
+                and self.eff_date == graph.eff_date)
+
+    def save(self, ch_file: str):
+        """
+        Saves the hierarchy as a NumPy archive.
+
+        Arguments:
+        - `ch_file` (str): output file path.
+        """
+        with open(ch_file, "wb") as f:
+            np.savez(f, rank=self.rank,
+                     up_offsets=self.up_offsets, up_targets=self.up_targets,
+                     up_weights=self.up_weights, up_middle=self.up_middle,
+                     down_offsets=self.down_offsets, down_sources=self.down_sources,
+                     down_weights=self.down_weights, down_middle=self.down_middle,
+                     eff_date=np.array(self.eff_date), num_edges=np.array(self.num_edges))
+
+    @classmethod
+    def load(cls, ch_file: str) -> "ContractionHierarchy":
+        """
+        Loads a hierarchy saved with `save`.
+
+        Arguments:
+        - `ch_file` (str): file path of the hierarchy.
+        """
+        with np.load(ch_file) as data:
+            return cls(data["rank"],
+                       data["up_offsets"], data["up_targets"], data["up_weights"], data["up_middle"],
+                       data["down_offsets"], data["down_sources"], data["down_weights"], data["down_middle"],
+                       eff_date=str(data["eff_date"]), num_edges=int(data["num_edges"]))
+
+    def unpack_edge(self, start: int, end: int, middle: int) -> list:
+        """
+        Expands a hierarchy edge into the original airway nodes it stands for.
+
+        Arguments:
+        - `start` (int): edge start node.
+        - `end` (int): edge end node.
+        - `middle` (int): the edge's middle node, -1 for an original airway.
+
+        Returns:
+        The list of nodes from `start` to `end`, excluding `start`.
+        """
+        nodes = []
+        stack = [(start, end, middle)]
+        while stack:
+            start, end, middle = stack.pop()
+            if middle < 0:
+                nodes.append(end)
+                continue
+
+            # The halves of a shortcut were the middle node's edges when it was contracted: start->middle
+            # is one of its down edges and middle->end is one of its up edges. Push the second half first
+            # so the first half is expanded first.
+            stack.append((middle, end, self._edge_middle(self.up_offsets, self.up_targets, self.up_middle,
+                                                         middle, end)))
+            stack.append((start, middle, self._edge_middle(self.down_offsets, self.down_sources, self.down_middle,
+                                                           middle, start)))
+        return nodes
+
+    @staticmethod
+    def _edge_middle(offsets: np.ndarray, others: np.ndarray, middles: np.ndarray, node: int, other: int) -> int:
+        lo = offsets[node]
+        hi = offsets[node + 1]
+        idx = lo + int(np.flatnonzero(others[lo:hi] == other)[0])
+        return int(middles[idx])
+
+
+def _witness_search(out_adj: list, source: int, excluded: int, max_len: float, settle_limit: int,
+                    hop_limit: int) -> dict:
+    """
+    Bounded Dijkstra search from `source` that avoids `excluded`. The search stops after `settle_limit`
+    nodes, and doesn't follow paths of more than `hop_limit` airways.
+
+    Returns:
+    A dictionary of node to tentative distance.
+    """
+    dist = {source: 0.0}
+    frontier = [(0.0, 0, source)]
+    settled = 0
+    while frontier and settled < settle_limit:
+        d_val, hops, node = heapq.heappop(frontier)
+        if d_val > dist[node]:
+            continue
+        if d_val > max_len:
+            break
+        settled += 1
+        if hops == hop_limit:
+            continue
+
+        for nbr, (w, _) in out_adj[node].items():
+            if nbr == excluded:
+                continue
+            nbr_d = d_val + w
+            if nbr_d < dist.get(nbr, math.inf):
+                dist[nbr] = nbr_d
+                heapq.heappush(frontier, (nbr_d, hops + 1, nbr))
+
+    return dist
+
+
+def _to_csr(edge_lists: list) -> tuple:
+    """
+    Converts per-node lists of (other, weight, middle) tuples into CSR arrays.
+    """
+    degree = [len(edges) if edges is not None else 0 for edges in edge_lists]
+    offsets = np.zeros(len(edge_lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(degree)
+
+    flat = [edge for edges in edge_lists if edges is not None for edge in edges]
+    others = np.array([e[0] for e in flat], dtype=np.int32)
+    weights = np.array([e[1] for e in flat], dtype=np.float64)
+    middles = np.array([e[2] for e in flat], dtype=np.int32)
+
+    return offsets, others, weights, middles
+
+
+def validate(graph: CompiledGraph, ch: ContractionHierarchy, n_pairs=100, seed=0) -> dict:
+    """
+    Compares contraction hierarchy queries with plain A* on random pairs of connected waypoints.
+
+    Arguments:
+    - `graph` (CompiledGraph): graph the hierarchy was built for.
+    - `ch` (ContractionHierarchy): hierarchy to validate.
+    - `n_pairs` (int, optional): number of random queries.
+    - `seed` (int, optional): random seed for the queries.
+
+    Returns:
+    A dictionary with the number of queries, distance mismatches, differing (equal length) routes
+    and the total query time of each method.
+    """
+    from path_search import find_best_path_ch, find_best_path_compiled, path_distance
+
+    rng = random.Random(seed)
+    connected = np.flatnonzero(np.diff(graph.offsets) > 0).tolist()
+    result = {"queries": 0, "distance_mismatches": 0, "route_differences": 0, "astar_time": 0.0, "ch_time": 0.0}
+    for _ in range(n_pairs):
+        start, end = (graph.node_name(node) for node in rng.sample(connected, 2))
+
+        # Failed searches print a message, which is not useful here.
+        with redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            astar_path = find_best_path_compiled(graph, start, end)
+            result["astar_time"] += time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            ch_path = find_best_path_ch(graph, ch, start, end)
+            result["ch_time"] += time.perf_counter() - start_time
+
+        result["queries"] += 1
+        if len(astar_path) == 0 or len(ch_path) == 0:
+            result["distance_mismatches"] += len(astar_path) != len(ch_path)
+            continue
+
+        astar_dist = path_distance(graph, astar_path)
+        ch_dist = path_distance(graph, ch_path)
+        if not math.isclose(astar_dist, ch_dist, rel_tol=1e-9, abs_tol=1e-6):
+            result["distance_mismatches"] += 1
+        elif astar_path != ch_path:
+            result["route_differences"] += 1
+
+    return result
+
+
+if __name__ == "__main__":
+    from graph_file import load_graph
+
+    # Make this script configurable
+    parser = argparse.ArgumentParser(description="Build and validate a contraction hierarchy for an airway graph.")
+    parser.add_argument("--graph_file", default="data/airway_graph.fpg")
+    parser.add_argument("--ch_file", default="data/airway_graph.ch.npz")
+    parser.add_argument("--validate", type=int, default=100, help="Number of random validation queries")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--allow_custom", action="store_true",
+                        help="Build the hierarchy even if the graph has custom airways (slow)")
+
+    args = parser.parse_args()
+
+    graph = load_graph(args.graph_file)
+
+    start_time = time.perf_counter()
+    try:
+        ch = ContractionHierarchy.build(graph, allow_custom=args.allow_custom, verbose=True)
+    except ValueError as e:
+        print(f"Error: {e} Use --allow_custom to build it anyway.")
+        sys.exit(1)
+    print(f"Built contraction hierarchy with {ch.num_shortcuts} shortcuts in {time.perf_counter() - start_time:.1f} s")
+    ch.save(args.ch_file)
+
+    if args.validate > 0:
+        print(validate(graph, ch, args.validate, args.seed))
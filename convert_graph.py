@@ -0,0 +1,19 @@
+import argparse
+
+from graph_file import convert_pickle
+
+if __name__ == "__main__":
+    # Make this script configurable
+    parser = argparse.ArgumentParser(description="Convert a pickled AirwayGraph into a binary graph file.")
+    parser.add_argument("in_file")
+    parser.add_argument("--out_file", required=False, default="data/airway_graph.fpg")
+    parser.add_argument("--eff_date", required=False, default=None,
+                        help="NASR effective date (YYYY/MM/DD) to store if the pickle predates it")
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    graph = convert_pickle(args.in_file, args.out_file, args.eff_date)
+
+    print(f"Converted {graph.num_nodes} waypoints and {graph.num_edges} airways "
+          f"(NASR effective date '{graph.eff_date}') to {args.out_file}")
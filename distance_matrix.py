@@ -0,0 +1,297 @@
+import argparse
+import heapq
+import math
+import multiprocessing
+import time
+
+import numpy as np
+
+from compiled_graph import CompiledGraph
+from geo_utils import METERS_PER_NM
+from graph_file import load_graph
+from map_types import WaypointType
+from path_search import search_weights
+
+# Per-process search state, set up once by `_init_worker`.
+_worker = {}
+
+
+class DistanceMatrix:
+    """
+    Shortest airway route distances from a set of source waypoints to a set of target waypoints, with the
+    optional shortest path trees needed to rebuild the routes.
+    """
+
+    def __init__(self, sources: list, targets: list, distances: np.ndarray, predecessors: np.ndarray = None,
+                 eff_date: str = ""):
+        """
+        Arguments:
+        - `sources` (list): source waypoint identifiers, one per row.
+        - `targets` (list): target waypoint identifiers, one per column.
+        - `distances` (np.ndarray): (sources, targets) route distances in meters, infinite if there is no route.
+        - `predecessors` (np.ndarray, optional): (sources, nodes) array with the previous node on the route
+                                                 from each source to each node, -1 if not reached.
+        - `eff_date` (str, optional): NASR effective date of the graph.
+        """
+        self.sources = list(sources)
+        self.targets = list(targets)
+        self.distances = distances
+        self.predecessors = predecessors
+        self.eff_date = eff_date
+
+    def distance(self, source: str, target: str) -> float:
+        """
+        Get the route distance between a source and a target, in meters.
+        """
+        return float(self.distances[self.sources.index(source), self.targets.index(target)])
+
+    def path(self, graph: CompiledGraph, source: str, target: str) -> list:
+        """
+        Rebuilds the route between a source and a target from the predecessors.
+
+        Arguments:
+        - `graph` (CompiledGraph): the graph the matrix was computed on.
+        - `source` (str): source waypoint identifier.
+        - `target` (str): target waypoint identifier.
+
+        Returns:
+        The list of waypoint identifiers from source to target, or an empty list if there is no route.
+        """
+        if self.predecessors is None:
+            raise ValueError("The distance matrix was computed without predecessors")
+
+        parents = self.predecessors[self.sources.index(source)]
+        start = graph.node_id(source)
+        node = graph.node_id(target)
+        if node != start and parents[node] < 0:
+            return []
+
+        path = [node]
+        while path[-1] != start:
+            path.append(int(parents[path[-1]]))
+        path.reverse()
+
+        return [graph.node_name(node) for node in path]
+
+    def save(self, matrix_file: str, compact: bool = True):
+        """
+        Saves the matrix as a NumPy archive.
+
+        Arguments:
+        - `matrix_file` (str): output file path.
+        - `compact` (bool, optional): store the distances as float32, which is accurate to within a meter.
+        """
+        arrays = {
+            "sources": np.array(self.sources),
+            "targets": np.array(self.targets),
+            "distances": self.distances.astype(np.float32) if compact else self.distances,
+            "eff_date": np.array(self.eff_date),
+        }
+        if self.predecessors is not None:
+            arrays["predecessors"] = self.predecessors
+
+        with open(matrix_file, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, matrix_file: str) -> "DistanceMatrix":
+        """
+        Loads a matrix saved with `save`.
+
+        Arguments:
+        - `matrix_file` (str): file path of the matrix.
+        """
+        with np.load(matrix_file) as data:
+            predecessors = data["predecessors"] if "predecessors" in data.files else None
+            return cls(data["sources"].tolist(), data["targets"].tolist(), data["distances"].astype(np.float64),
+                       predecessors, eff_date=str(data["eff_date"]))
+
+
+def one_to_many(graph: CompiledGraph, source: int, targets: np.ndarray, weights: np.ndarray = None) -> tuple:
+    """
+    Runs Dijkstra's algorithm from one node until every target is settled.
+
+    Arguments:
+    - `graph` (CompiledGraph): Compiled airway graph to search on.
+    - `source` (int): node id to search from.
+    - `targets` (np.ndarray): target node ids.
+    - `weights` (np.ndarray, optional): airway lengths to use instead of the graph's, indexed by edge id.
+
+    Returns:
+    A (distances, parents) tuple with the distance to each target in meters (infinite if unreachable), and
+    the previous node on the route to every node (-1 if not reached).
+    """
+    if weights is None:
+        weights = graph.weights
+    offsets = graph.offsets
+    edge_targets = graph.targets
+
+    n_nodes = graph.num_nodes
+    dist = [math.inf] * n_nodes
+    parents = [-1] * n_nodes
+    dist[source] = 0.0
+
+    # Targets left to settle. The search stops once there are none.
+    remaining = set(targets.tolist())
+    remaining.discard(source)
+
+    frontier = [(0.0, source)]
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+    while frontier and remaining:
+        d_val, node = heappop(frontier)
+        if d_val > dist[node]:
+            continue
+        remaining.discard(node)
+
+        lo = offsets[node]
+        hi = offsets[node + 1]
+        for nbr, airway_len in zip(edge_targets[lo:hi].tolist(), weights[lo:hi].tolist()):
+            nbr_d = d_val + airway_len
+            if nbr_d < dist[nbr]:
+                dist[nbr] = nbr_d
+                parents[nbr] = node
+                heappush(frontier, (nbr_d, nbr))
+
+    dist = np.array(dist, dtype=np.float64)
+    return dist[targets], np.array(parents, dtype=np.int32)
+
+
+def _init_worker(graph, weights: np.ndarray, targets: np.ndarray, predecessors: bool):
+    """
+    Sets up the graph once per worker process. Graphs opened from a binary graph file are passed by file
+    name and memory-mapped again, so the workers share one copy.
+    """
+    _worker["graph"] = load_graph(graph) if isinstance(graph, str) else graph
+    _worker["weights"] = weights
+    _worker["targets"] = targets
+    _worker["predecessors"] = predecessors
+
+
+def _source_row(source: int) -> tuple:
+    dist, parents = one_to_many(_worker["graph"], source, _worker["targets"], _worker["weights"])
+    return dist, parents if _worker["predecessors"] else None
+
+
+def many_to_many(graph: CompiledGraph, sources: list, targets: list, processes: int = None,
+                 predecessors: bool = False, custom_airways: bool = True, blocked: np.ndarray = None,
+                 verbose: bool = False) -> DistanceMatrix:
+    """
+    Computes the route distances between every source and every target, with one Dijkstra tree per source.
+    The trees are independent, so they are spread over a process pool.
+
+    Arguments:
+    - `graph` (CompiledGraph): Compiled airway graph to search on.
+    - `sources` (list): source waypoint identifiers.
+    - `targets` (list): target waypoint identifiers.
+    - `processes` (int, optional): number of worker processes. Default is the number of CPUs, 1 runs the
+                                   searches in this process.
+    - `predecessors` (bool, optional): keep the shortest path tree of every source, to rebuild routes.
+    - `custom_airways` (bool, optional): allow the routes to use CUSTOM airways between fixes.
+    - `blocked` (np.ndarray, optional): boolean mask over edge ids of closed airways.
+    - `verbose` (bool, optional): print progress.
+
+    Returns:
+    The `DistanceMatrix`.
+
+    Raises:
+    `ValueError` if an identifier is not in the graph.
+    """
+    source_ids = np.array([graph.node_id(ident) for ident in sources], dtype=np.int64)
+    target_ids = np.array([graph.node_id(ident) for ident in targets], dtype=np.int64)
+    unknown = [ident for ident, node in zip(list(sources) + list(targets), np.concatenate((source_ids, target_ids)))
+               if node < 0]
+    if len(unknown) > 0:
+        raise ValueError(f"Waypoints not in the graph: {', '.join(sorted(set(unknown)))}")
+
+    weights = search_weights(graph, custom_airways, blocked)
+    distances = np.full((len(sources), len(targets)), np.inf)
+    parents = np.full((len(sources), graph.num_nodes), -1, dtype=np.int32) if predecessors else None
+
+    # Workers can reopen graph files themselves instead of receiving a copy of the graph, and only need the
+    # weights if they differ from the graph's.
+    graph_arg = graph.graph_file.path if graph.graph_file is not None else graph
+    initargs = (graph_arg, weights if weights is not graph.weights else None, target_ids, predecessors)
+
+    if processes == 1:
+        _init_worker(graph, *initargs[1:])
+        rows = map(_source_row, source_ids.tolist())
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=initargs)
+        rows = pool.imap(_source_row, source_ids.tolist())
+
+    try:
+        for i, (dist, tree) in enumerate(rows):
+            distances[i] = dist
+            if parents is not None:
+                parents[i] = tree
+            if verbose and (i + 1) % 100 == 0:
+                print(f"{i + 1}/{len(sources)} sources done")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return DistanceMatrix(sources, targets, distances, parents, graph.eff_date)
+
+
+def read_waypoints(waypoints_file: str) -> list:
+    """
+    Reads waypoint identifiers separated by whitespace or commas. Lines starting with # are ignored.
+    """
+    idents = []
+    with open(waypoints_file) as f:
+        for line in f:
+            if line.lstrip().startswith("#"):
+                continue
+            idents.extend(ident for ident in line.replace(",", " ").split() if ident != "")
+
+    return idents
+
+
+if __name__ == "__main__":
+    # Make this script configurable
+    parser = argparse.ArgumentParser(description="Compute airway route distances between sets of waypoints.")
+    parser.add_argument("waypoints_file", nargs="?", default="",
+                        help="Source waypoint identifiers, separated by whitespace, commas or new lines")
+    parser.add_argument("--targets_file", default="",
+                        help="Target waypoint identifiers. Default is the same waypoints as the sources")
+    parser.add_argument("--airports", type=int, default=0,
+                        help="Use this many airports with airways as the waypoints instead of a file")
+    parser.add_argument("--graph_file", default="data/airway_graph.fpg")
+    parser.add_argument("--out_file", default="data/distance_matrix.npz")
+    parser.add_argument("--processes", type=int, default=0, help="Worker processes. 0 uses the number of CPUs")
+    parser.add_argument("--predecessors", action="store_true",
+                        help="Also save the shortest path tree of every source, so routes can be rebuilt")
+    parser.add_argument("--no_custom", action="store_true", help="Only use published airways")
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    graph = load_graph(args.graph_file)
+
+    if args.waypoints_file != "":
+        sources = read_waypoints(args.waypoints_file)
+    elif args.airports > 0:
+        # Sample airports that have airways leaving them.
+        airports = np.flatnonzero((graph.wpt_type == WaypointType.AIRPORT.value) & (np.diff(graph.offsets) > 0))
+        rng = np.random.default_rng(args.seed)
+        chosen = np.sort(rng.choice(airports, min(args.airports, len(airports)), replace=False))
+        sources = [graph.node_name(int(node)) for node in chosen]
+    else:
+        parser.error("either a waypoints file or --airports is required")
+    targets = read_waypoints(args.targets_file) if args.targets_file != "" else sources
+
+    start_time = time.perf_counter()
+    matrix = many_to_many(graph, sources, targets, args.processes if args.processes > 0 else None,
+                          args.predecessors, not args.no_custom, verbose=True)
+    elapsed = time.perf_counter() - start_time
+
+    matrix.save(args.out_file)
+
+    reachable = np.isfinite(matrix.distances)
+    print(f"Computed {len(sources)} x {len(targets)} distances in {elapsed:.2f} s. "
+          f"{int((~reachable).sum())} pairs have no route.")
+    if reachable.any():
+        print(f"Longest route: {matrix.distances[reachable].max() / METERS_PER_NM:.0f} NM. Saved to {args.out_file}")
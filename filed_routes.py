@@ -0,0 +1,353 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+from airway_index import AirwayIndex
+from compiled_graph import CompiledGraph
+from geo_utils import geodesic_distances
+from graph_file import load_graph
+from map_types import ExpandedRoute, WaypointType
+from procedures import ProcedureIndex
+
+# Per-process expansion state, set up once by `init_worker`.
+_worker = {}
+
+
+def parse_route(route: str) -> list:
+    """
+    Splits a filed route string into its elements. Speed and altitude changes after a slash
+    (`LIMBO/N0450F350`) and `DCT` are dropped, since every element is flown directly to unless an airway
+    is named.
+
+    Arguments:
+    - `route` (str): route string, such as "KOKC OKC J52 LIMBO".
+
+    Returns:
+    A list of upper case waypoint, airway and procedure identifiers.
+    """
+    elements = []
+    for element in route.upper().split():
+        element = element.split("/")[0]
+        if element != "" and element != "DCT":
+            elements.append(element)
+
+    return elements
+
+
+def node_id_lookup(graph: CompiledGraph) -> dict:
+    """
+    Maps every waypoint identifier of a graph to its node id. Looking identifiers up in a dictionary is
+    much faster than `CompiledGraph.node_id` when expanding many routes.
+    """
+    return {name: i for i, name in enumerate(graph.names.tolist())}
+
+
+def _route_node_id(graph: CompiledGraph, node_ids: dict, ident: str) -> int:
+    """
+    Looks up a route element, falling back to the FAA id of ICAO airport codes. NASR identifies US airports
+    by their FAA id (OKC), while filed routes use the ICAO code (KOKC, or PANC and PHNL in Alaska and the
+    Pacific).
+
+    Returns:
+    The node id, or -1 if the element is not a waypoint of the graph.
+    """
+    node = node_ids.get(ident, -1)
+    if node < 0 and len(ident) == 4 and ident[0] in "KP":
+        node = node_ids.get(ident[1:], -1)
+        if node >= 0 and graph.wpt_type[node] != WaypointType.AIRPORT.value:
+            node = -1
+
+    return node
+
+
+def expand_route_nodes(graph: CompiledGraph, airways: AirwayIndex, route: str, procedures: ProcedureIndex = None,
+                       node_ids: dict = None) -> tuple:
+    """
+    Expands a route string into the node ids it flies through. Invalid segments are reported and skipped,
+    and the route goes on directly from the last valid waypoint, so every segment gets checked.
+
+    Arguments:
+    - `graph` (CompiledGraph): Compiled airway graph.
+    - `airways` (AirwayIndex): fix sequences of the published airways.
+    - `route` (str): route string.
+    - `procedures` (ProcedureIndex, optional): departure and arrival procedures, to expand procedure names
+    such as CONRA3.LOA. Without them, procedure names are reported as invalid.
+    - `node_ids` (dict, optional): identifier to node id lookup from `node_id_lookup`.
+
+    Returns:
+    A (nodes, errors) tuple of the node id list and the list of invalid segment descriptions.
+    """
+    if node_ids is None:
+        node_ids = node_id_lookup(graph)
+
+    elements = parse_route(route)
+    nodes = []
+    errors = []
+
+    i = 0
+    while i < len(elements):
+        element = elements[i]
+        node = _route_node_id(graph, node_ids, element)
+
+        # 1. Waypoints are flown to directly.
+        if node >= 0:
+            if len(nodes) == 0 or nodes[-1] != node:
+                nodes.append(node)
+            i += 1
+            continue
+
+        # 2. Airways are flown from the waypoint before them to the waypoint after them.
+        if airways.airway_id(element) >= 0:
+            exit_node = _route_node_id(graph, node_ids, elements[i + 1]) if i + 1 < len(elements) else -1
+            if len(nodes) == 0:
+                errors.append(f"{element}: no waypoint to join the airway at")
+            elif exit_node < 0:
+                errors.append(f"{element}: no waypoint to leave the airway at")
+            else:
+                fixes = airways.segment(element, nodes[-1], exit_node)
+                if fixes is None:
+                    entry = graph.node_name(nodes[-1])
+                    off_airway = [ident for ident, node in ((entry, nodes[-1]), (elements[i + 1], exit_node))
+                                  if airways.position(element, node) is None]
+                    if len(off_airway) > 0:
+                        errors.append(f"{element}: {' and '.join(off_airway)} not on the airway")
+                    else:
+                        errors.append(f"{element}: {entry} and {elements[i + 1]} are on separate parts of the airway")
+                else:
+                    nodes.extend(fixes[1:].tolist())
+            i += 1
+            continue
+
+        # 3. Procedures are flown from their airport or the waypoint before them.
+        if "." in element and procedures is not None:
+            next_node = _route_node_id(graph, node_ids, elements[i + 1]) if i + 1 < len(elements) else -1
+            fixes = _procedure_nodes(graph, procedures, element, nodes, next_node)
+            if fixes is None:
+                errors.append(f"{element}: no procedure with this name joins the route")
+            else:
+                nodes.extend(fixes[1:] if len(nodes) > 0 and nodes[-1] == fixes[0] else fixes)
+            i += 1
+            continue
+
+        errors.append(f"{element}: unknown waypoint, airway or procedure")
+        i += 1
+
+    return nodes, errors
+
+
+def _procedure_nodes(graph: CompiledGraph, procedures: ProcedureIndex, name: str, nodes: list,
+                     next_node: int) -> list:
+    """
+    Finds the departure of the previous waypoint, or the arrival into the next waypoint, with a name.
+    Arrivals must start at the previous waypoint when there is one.
+
+    Returns:
+    The node ids flown along the procedure, or `None` if no procedure matches.
+    """
+    # 1. A departure from the waypoint before the procedure.
+    if len(nodes) > 0:
+        for proc in procedures.options(graph, "departures", graph.node_name(nodes[-1])):
+            if proc.name == name:
+                return [graph.node_id(ident) for ident in proc.path]
+
+    # 2. An arrival into the next waypoint.
+    if next_node >= 0:
+        for proc in procedures.options(graph, "arrivals", graph.node_name(next_node)):
+            if proc.name == name and (len(nodes) == 0 or graph.node_id(proc.path[0]) == nodes[-1]):
+                # The airport is added by the next element.
+                return [graph.node_id(ident) for ident in proc.path[:-1]]
+
+    return None
+
+
+def expand_routes(graph: CompiledGraph, airways: AirwayIndex, routes: list, procedures: ProcedureIndex = None,
+                  node_ids: dict = None) -> list:
+    """
+    Expands a batch of route strings, with the distances of all routes computed in one vectorized call.
+
+    Arguments:
+    - `graph` (CompiledGraph): Compiled airway graph.
+    - `airways` (AirwayIndex): fix sequences of the published airways.
+    - `routes` (list): route strings.
+    - `procedures` (ProcedureIndex, optional): departure and arrival procedures of the graph.
+    - `node_ids` (dict, optional): identifier to node id lookup from `node_id_lookup`.
+
+    Returns:
+    A list of `ExpandedRoute`, one per route string.
+    """
+    # 1. Expand every route to its node ids.
+    if node_ids is None:
+        node_ids = node_id_lookup(graph)
+    expanded = [expand_route_nodes(graph, airways, route, procedures, node_ids) for route in routes]
+
+    # 2. Flatten the paths and add up their legs in one batch. The leg out of the last point of each path
+    # leads into the next path, so it is left out.
+    path_offsets = np.zeros(len(expanded) + 1, dtype=np.int64)
+    path_offsets[1:] = np.cumsum([len(nodes) for nodes, _ in expanded])
+    path = np.array([node for nodes, _ in expanded for node in nodes], dtype=np.int64)
+    if len(path) > 1:
+        legs = geodesic_distances(graph.lat[path[:-1]], graph.lon[path[:-1]], graph.lat[path[1:]],
+                                  graph.lon[path[1:]])
+        legs = np.append(legs, 0.0)
+    else:
+        legs = np.zeros(len(path))
+    legs[path_offsets[1:][path_offsets[1:] > 0] - 1] = 0.0
+    distances = np.zeros(len(expanded))
+    np.add.at(distances, np.repeat(np.arange(len(expanded)), np.diff(path_offsets)), legs)
+
+    return [ExpandedRoute(route=route, path=[graph.node_name(node) for node in nodes], distance=float(distance),
+                          errors=errors)
+            for route, (nodes, errors), distance in zip(routes, expanded, distances)]
+
+
+def read_routes(routes_file: str):
+    """
+    Reads filed route strings from a text, CSV or JSON-lines file. Text files have one route per line.
+    CSV files need a header with a `route` column, and JSON-lines files (`.jsonl` or `.json`) a `route`
+    key on each line.
+
+    Arguments:
+    - `routes_file` (str): file path of the routes.
+
+    Returns:
+    A generator of (index, route) tuples.
+    """
+    with open(routes_file, newline="") as f:
+        if routes_file.endswith((".jsonl", ".json")):
+            routes = (json.loads(line)["route"] for line in f if line.strip() != "")
+        elif routes_file.endswith(".csv"):
+            routes = (row["route"] for row in csv.DictReader(f))
+        else:
+            routes = (line for line in f if line.strip() != "")
+
+        for idx, route in enumerate(routes):
+            yield idx, route.strip()
+
+
+def _batches(tasks, batch_size: int):
+    """
+    Groups (index, route) tuples into lists of at most `batch_size`.
+    """
+    batch = []
+    for task in tasks:
+        batch.append(task)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def init_worker(graph_file: str):
+    """
+    Loads the airway graph and its airway and procedure indexes once per worker process.
+
+    Arguments:
+    - `graph_file` (str): file path of the airway graph. It must be a binary graph file with an airway index.
+    """
+    graph = load_graph(graph_file)
+    airways = AirwayIndex.from_graph(graph)
+    if airways is None:
+        raise ValueError(f"{graph_file} has no airway index. Generate the graph again to add one.")
+
+    _worker["graph"] = graph
+    _worker["airways"] = airways
+    _worker["procedures"] = ProcedureIndex.from_graph(graph)
+    _worker["node_ids"] = node_id_lookup(graph)
+
+
+def expand_batch(batch: list) -> list:
+    """
+    Expands a batch of routes in a worker process.
+
+    Arguments:
+    - `batch` (list): (index, route) tuples from `read_routes`.
+
+    Returns:
+    A list of dictionaries with the input index, the route string, the expanded waypoint list, the distance
+    in meters and the invalid segments.
+    """
+    routes = expand_routes(_worker["graph"], _worker["airways"], [route for _, route in batch],
+                           _worker["procedures"], _worker["node_ids"])
+    return [{"index": idx, "route": expanded.route, "path": expanded.path, "distance": expanded.distance,
+             "errors": expanded.errors}
+            for (idx, _), expanded in zip(batch, routes)]
+
+
+def run_expand(routes_file: str, graph_file: str, out, processes: int = 1, batch_size: int = 1000) -> dict:
+    """
+    Expands every route in a file, in batches spread over a process pool, streaming results as they finish.
+
+    Arguments:
+    - `routes_file` (str): text, CSV or JSON-lines file of route strings.
+    - `graph_file` (str): file path of the airway graph.
+    - `out` (file): text stream that receives one JSON result per line.
+    - `processes` (int, optional): number of worker processes. Default is 1, which expands the routes in
+    this process. Use `None` for the number of CPUs.
+    - `batch_size` (int, optional): number of routes expanded together.
+
+    Returns:
+    A summary dictionary with the number of routes, invalid routes, elapsed time and throughput.
+    """
+    summary = {"routes": 0, "invalid": 0}
+    start_time = time.perf_counter()
+    batches = _batches(read_routes(routes_file), batch_size)
+
+    # A single process skips the pool, so small files don't pay for starting workers.
+    pool = None
+    if processes == 1:
+        init_worker(graph_file)
+        results = map(expand_batch, batches)
+    else:
+        pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(graph_file,))
+        results = pool.imap(expand_batch, batches)
+
+    try:
+        for batch in results:
+            for result in batch:
+                out.write(json.dumps(result) + "\n")
+
+                summary["routes"] += 1
+                if len(result["errors"]) > 0:
+                    summary["invalid"] += 1
+            out.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    summary["elapsed"] = time.perf_counter() - start_time
+    summary["routes_per_second"] = summary["routes"] / summary["elapsed"] if summary["elapsed"] > 0 else 0.0
+
+    return summary
+
+
+if __name__ == "__main__":
+    # Configurable parameters
+    parser = argparse.ArgumentParser(description="Expand and check a file of filed route strings.")
+    parser.add_argument("routes_file", help="Text file with one route per line, CSV with a route column or "
+                                            "JSON lines with a route key")
+    parser.add_argument("--graph_file", default="data/airway_graph.fpg")
+    parser.add_argument("--out_file", default="-", help="JSON-lines output file. Default is stdout")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Worker processes. Default is 1, use 0 for the CPU count")
+    parser.add_argument("--batch_size", type=int, default=1000, help="Routes expanded together")
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    out = sys.stdout if args.out_file == "-" else open(args.out_file, "w")
+    try:
+        summary = run_expand(args.routes_file, args.graph_file, out, args.processes if args.processes > 0 else None,
+                             args.batch_size)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print(f"Expanded {summary['routes']} routes ({summary['invalid']} with invalid segments) in "
+          f"{summary['elapsed']:.2f} s, {summary['routes_per_second']:.1f} routes/s", file=sys.stderr)
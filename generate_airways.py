@@ -2,7 +2,16 @@
 import argparse
 import pickle
 
+import nasr_delta
 from airway_graph import AirwayGraph
+from airway_index import read_airway_index
+from compiled_graph import CompiledGraph
+from constraints import EdgeGrid
+from contraction import ContractionHierarchy, validate
+from graph_file import is_graph_file, read_graph_file, write_graph_file
+from landmarks import LandmarkIndex
+from procedures import read_procedure_index
+from spatial_index import SpatialIndex
 
 if __name__ == "__main__":
     # Make this script configurable
@@ -16,7 +25,31 @@ if __name__ == "__main__":
     parser.add_argument("--sid_file", required=False, default="data/DP_RTE.csv")
     parser.add_argument("--sid_apt_file", required=False, default="data/DP_APT.csv")
     parser.add_argument("--in_file", required=False, default="")
-    parser.add_argument("--out_file", required=False, default="data/airway_graph.pkl")
+    parser.add_argument("--out_file", required=False, default="data/airway_graph.fpg",
+                        help="Output graph file. Files ending in .pkl are written as a pickled AirwayGraph")
+    parser.add_argument("--landmarks", type=int, required=False, default=8,
+                        help="Number of ALT landmarks to precompute for binary graph files (0 to skip)")
+    parser.add_argument("--ch_file", required=False, default="",
+                        help="Also build a contraction hierarchy and save it to this file, e.g. data/airway_graph.ch.npz")
+    parser.add_argument("--ch_validate", type=int, required=False, default=100,
+                        help="Number of random queries used to validate the contraction hierarchy against A*")
+    parser.add_argument("--ch_custom", action="store_true",
+                        help="Build the contraction hierarchy even if the graph has custom airways (slow)")
+    parser.add_argument("--custom_airways", type=int, required=False, default=0,
+                        help="Connect each fix to this many of its closest fixes with CUSTOM airways (0 to skip)")
+    parser.add_argument("--custom_processes", type=int, required=False, default=1,
+                        help="Processes used to find the closest fixes. 0 uses the number of CPUs")
+    parser.add_argument("--load_processes", type=int, required=False, default=0,
+                        help="Processes used to parse the NASR files and compute airway distances. 0 uses the "
+                             "number of CPUs")
+    parser.add_argument("--prev_nasr_dir", required=False, default="",
+                        help="Directory with the NASR files --in_file was built from. Only the differences to the new "
+                             "files are applied to the graph")
+    parser.add_argument("--nasr_cache", required=False, default="data/nasr_cache",
+                        help="Directory to cache the parsed NASR tables in, so unchanged files aren't parsed again. "
+                             "Empty to disable")
+    parser.add_argument("--sequential", action="store_true",
+                        help="Load the NASR files row by row instead of using the bulk columnar build")
 
     # Parse the arguments
     args = parser.parse_args()
@@ -30,22 +63,100 @@ if __name__ == "__main__":
     sid_apt_file = args.sid_apt_file
     graph_in_file = args.in_file
     graph_out_file = args.out_file
+    n_landmarks = args.landmarks
+    ch_file = args.ch_file
+    ch_custom = args.ch_custom
+    ch_validate = args.ch_validate
+    sequential = args.sequential
+    n_custom = args.custom_airways
+    custom_processes = args.custom_processes if args.custom_processes > 0 else None
+    load_processes = args.load_processes if args.load_processes > 0 else None
+    prev_nasr_dir = args.prev_nasr_dir
+    nasr_cache = args.nasr_cache
+    nasr_files = [fix_file, apt_file, navaid_file, awy_file, star_file, star_apt_file, sid_file, sid_apt_file]
 
     # If there is a graph input file, load the saved graph.
     awy_graph = None
     if graph_in_file != "":
-        with open(graph_in_file, 'rb') as f:
-            awy_graph = pickle.load(f)
+        if is_graph_file(graph_in_file):
+            awy_graph = read_graph_file(graph_in_file).to_airway_graph()
+        else:
+            with open(graph_in_file, 'rb') as f:
+                awy_graph = pickle.load(f)
     else:
         # Otherwise create a new airway graph.
         awy_graph = AirwayGraph()
 
     # Load data from all NASR subscription files.
-    awy_graph.load_nasr_data(fix_file, apt_file, navaid_file, awy_file,
-                             star_file, star_apt_file, sid_file, sid_apt_file)
+    if prev_nasr_dir != "" and graph_in_file != "":
+        # Update the graph to the new NASR cycle by applying the differences between the cycles.
+        prev_tables = nasr_delta.resolve_nasr_tables(*nasr_delta.nasr_files_in(prev_nasr_dir, nasr_files),
+                                                     cache_dir=nasr_cache)
+        new_tables = nasr_delta.resolve_nasr_tables(*nasr_files, cache_dir=nasr_cache)
+        try:
+            awy_graph.update_nasr_data(prev_tables, new_tables)
+        except ValueError as e:
+            # Fall back to a full build if the input graph doesn't match the previous cycle.
+            print(f"Warning: {e}. Rebuilding the graph from scratch.")
+            awy_graph = AirwayGraph(awy_graph.verbose)
+            awy_graph.load_nasr_data_bulk(*nasr_files, cache_dir=nasr_cache, processes=load_processes)
+    elif sequential:
+        awy_graph.load_nasr_data(fix_file, apt_file, navaid_file, awy_file,
+                                 star_file, star_apt_file, sid_file, sid_apt_file)
+    else:
+        # The bulk build prints a timing report per stage when the graph is verbose.
+        awy_graph.load_nasr_data_bulk(fix_file, apt_file, navaid_file, awy_file,
+                                      star_file, star_apt_file, sid_file, sid_apt_file, cache_dir=nasr_cache,
+                                      processes=load_processes)
+
+    # Connect nearby fixes with custom airways.
+    if n_custom > 0:
+        awy_graph.build_custom_airways(n_custom, custom_processes)
+
+    # Array form of the graph used for the binary graph file and for preprocessing.
+    compiled_graph = CompiledGraph.from_airway_graph(awy_graph)
+
+    # Export the graph, either as a pickle or as a binary graph file.
+    if graph_out_file.endswith(".pkl"):
+        with open(graph_out_file, "wb") as f:
+            pickle.dump(awy_graph, f)
+    else:
+        # Spatial index for nearest waypoint, radius and bounding box queries.
+        extra_sections = SpatialIndex.build(compiled_graph).to_sections()
+
+        # Airway segment grid for turning closed areas into edge masks.
+        extra_sections.update(EdgeGrid.build(compiled_graph).to_sections())
 
-    # Export the graph to a pickle file.
-    with open(graph_out_file, "wb") as f:
-        pickle.dump(awy_graph, f)
+        # Precompute landmark distances for the A* heuristic.
+        if n_landmarks > 0:
+            landmarks = LandmarkIndex.build(compiled_graph, n_landmarks, verbose=awy_graph.verbose)
+            extra_sections.update(landmarks.to_sections())
+
+        # Fix sequence of each published airway for expanding filed routes.
+        extra_sections.update(read_airway_index(compiled_graph, awy_file, cache_dir=nasr_cache).to_sections())
+
+        # Departure and arrival procedures of each airport for airport to airport routing.
+        procedures = read_procedure_index(compiled_graph, sid_file, sid_apt_file, star_file, star_apt_file,
+                                          cache_dir=nasr_cache)
+        extra_sections.update(procedures.to_sections())
+
+        write_graph_file(graph_out_file, compiled_graph, extra_sections)
 
     print(f"Airway graph generated!")
+
+    # Build the contraction hierarchy for fast route queries, and make sure it agrees with A*.
+    ch = None
+    if ch_file != "":
+        try:
+            ch = ContractionHierarchy.build(compiled_graph, allow_custom=ch_custom, verbose=awy_graph.verbose)
+        except ValueError as e:
+            print(f"Warning: {e} Skipping the contraction hierarchy, use --ch_custom to build it anyway.")
+
+    if ch is not None:
+        ch.save(ch_file)
+        print(f"Contraction hierarchy with {ch.num_shortcuts} shortcuts generated!")
+
+        if ch_validate > 0:
+            result = validate(compiled_graph, ch, ch_validate)
+            print(f"Validated {result['queries']} queries: {result['distance_mismatches']} distance mismatches, "
+                  f"{result['route_differences']} equal-length route differences")
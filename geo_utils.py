@@ -0,0 +1,161 @@
+import importlib.util
+import math
+
+import numpy as np
+
+from geographiclib.geodesic import Geodesic
+
+# pyproj wraps the C port of the same geodesic algorithm used by geographiclib and evaluates whole arrays
+# at once. It is optional: without it, distances fall back to one geographiclib call per pair. Importing it
+# takes longer than a route query, so it is only imported the first time distances are computed.
+_VECTOR_GEOD = None
+
+# Flag for whether `geodesic_distances` evaluates arrays in one vectorized call.
+HAVE_VECTOR_GEODESIC = importlib.util.find_spec("pyproj") is not None
+
+
+def _vector_geod():
+    """
+    Get the pyproj WGS84 geodesic, importing pyproj on first use. Returns `None` without pyproj.
+    """
+    global _VECTOR_GEOD
+    if _VECTOR_GEOD is None and HAVE_VECTOR_GEODESIC:
+        from pyproj import Geod
+        _VECTOR_GEOD = Geod(ellps="WGS84")
+
+    return _VECTOR_GEOD
+
+
+def geodesic_distances(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Computes WGS84 geodesic distances between pairs of points in one batch.
+
+    Arguments:
+    - `lat1` (array-like): start latitudes in decimal degrees.
+    - `lon1` (array-like): start longitudes in decimal degrees.
+    - `lat2` (array-like): end latitudes in decimal degrees.
+    - `lon2` (array-like): end longitudes in decimal degrees.
+
+    Returns:
+    A float64 array of distances in meters (labeled s12 by geographiclib).
+    """
+    lat1 = np.asarray(lat1, dtype=np.float64)
+    lon1 = np.asarray(lon1, dtype=np.float64)
+    lat2 = np.asarray(lat2, dtype=np.float64)
+    lon2 = np.asarray(lon2, dtype=np.float64)
+
+    if lat1.size == 0:
+        return np.zeros(0, dtype=np.float64)
+
+    # Vectorized path. pyproj agrees with geographiclib to within nanometers.
+    vector_geod = _vector_geod()
+    if vector_geod is not None:
+        _, _, dist = vector_geod.inv(lon1, lat1, lon2, lat2)
+        return np.asarray(dist, dtype=np.float64)
+
+    # Scalar fallback.
+    geod = Geodesic.WGS84
+    return np.fromiter(
+        (geod.Inverse(a, b, c, d)["s12"] for a, b, c, d in zip(lat1, lon1, lat2, lon2)),
+        dtype=np.float64, count=lat1.size)
+
+
+# WGS84 ellipsoid parameters.
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+
+# Meters in a nautical mile.
+METERS_PER_NM = 1852.0
+
+
+def ecef(lat, lon) -> np.ndarray:
+    """
+    Converts points on the WGS84 ellipsoid to Earth-centered, Earth-fixed coordinates. The straight-line
+    (chord) distance between two ECEF points never exceeds their geodesic distance, so it can be used as
+    a lower bound.
+
+    Arguments:
+    - `lat` (array-like): latitudes in decimal degrees.
+    - `lon` (array-like): longitudes in decimal degrees.
+
+    Returns:
+    A float64 array of shape (N, 3) with x, y, z in meters.
+    """
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+
+    # Prime vertical radius of curvature.
+    n = WGS84_A / np.sqrt(1.0 - WGS84_E2 * np.sin(lat) ** 2)
+    return np.column_stack((n * np.cos(lat) * np.cos(lon),
+                            n * np.cos(lat) * np.sin(lon),
+                            n * (1.0 - WGS84_E2) * np.sin(lat)))
+
+
+# WGS84 semi-minor axis, the smallest distance from the Earth's center to the ellipsoid.
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+
+def ecef_point(lat: float, lon: float) -> tuple:
+    """
+    Scalar version of `ecef` for a single point.
+
+    Arguments:
+    - `lat` (float): latitude in decimal degrees.
+    - `lon` (float): longitude in decimal degrees.
+
+    Returns:
+    A tuple (x, y, z) in meters.
+    """
+    lat = math.radians(lat)
+    lon = math.radians(lon)
+    sin_lat = math.sin(lat)
+    cos_lat = math.cos(lat)
+    n = WGS84_A / math.sqrt(1.0 - WGS84_E2 * sin_lat * sin_lat)
+    return (n * cos_lat * math.cos(lon), n * cos_lat * math.sin(lon), n * (1.0 - WGS84_E2) * sin_lat)
+
+
+def distance_lower_bound(p: tuple, q: tuple) -> float:
+    """
+    Lower bound on the geodesic distance between two ECEF points, for use as an A* heuristic. It is the
+    larger of two bounds that hold on the ellipsoid:
+    - the chord: no path is shorter than the straight line, and
+    - b * angle: projecting a path on the ellipsoid onto the sphere of radius b (the semi-minor axis) can
+      only shorten it, and the projection is at least as long as the great circle arc on that sphere.
+    The chord is tighter for short distances and the arc for long ones. The bound is within 0.4% of the
+    geodesic distance, at a fraction of the cost of solving the inverse problem.
+
+    Arguments:
+    - `p` (tuple): ECEF (x, y, z) of the first point in meters.
+    - `q` (tuple): ECEF (x, y, z) of the second point in meters.
+
+    Returns:
+    The lower bound in meters.
+    """
+    px, py, pz = p
+    qx, qy, qz = q
+    dot = px * qx + py * qy + pz * qz
+    cx = py * qz - pz * qy
+    cy = pz * qx - px * qz
+    cz = px * qy - py * qx
+    angle = math.atan2(math.sqrt(cx * cx + cy * cy + cz * cz), dot)
+    chord = math.sqrt((px - qx) ** 2 + (py - qy) ** 2 + (pz - qz) ** 2)
+    return max(chord, WGS84_B * angle)
+
+
+def distance_lower_bounds(xyz: np.ndarray, point) -> np.ndarray:
+    """
+    Vectorized `distance_lower_bound` from many ECEF points to one.
+
+    Arguments:
+    - `xyz` (np.ndarray): (N, 3) array of ECEF points in meters, as returned by `ecef`.
+    - `point` (array-like): ECEF (x, y, z) of the other point in meters.
+
+    Returns:
+    A float64 array of N lower bounds in meters.
+    """
+    point = np.asarray(point, dtype=np.float64)
+    dot = xyz @ point
+    cross = np.linalg.norm(np.cross(xyz, point), axis=1)
+    chord = np.linalg.norm(xyz - point, axis=1)
+    return np.maximum(chord, WGS84_B * np.arctan2(cross, dot))
@@ -0,0 +1,311 @@
+import datetime
+import json
+import mmap
+import pickle
+import struct
+
+import numpy as np
+
+from compiled_graph import CompiledGraph, StringTable
+
+# File signature and format version of the binary graph file.
+GRAPH_FILE_MAGIC = b"FPGRAPH\x00"
+GRAPH_FILE_VERSION = 1
+
+# Length of a NASR subscription cycle.
+NASR_CYCLE_DAYS = 28
+
+# Sections are aligned so arrays can be viewed in place.
+_ALIGNMENT = 64
+_PREAMBLE = struct.Struct("<8sII")
+
+
+class GraphFile:
+    """
+    Read-only, memory-mapped view of a binary graph file.
+
+    Layout:
+    - 16 byte preamble: magic, format version and header length.
+    - JSON header: NASR effective date, metadata and a directory of sections, each with an offset
+      (relative to the start of the data area), dtype and shape.
+    - Data area: flat arrays, each aligned to 64 bytes.
+
+    Arrays are NumPy views straight onto the mapped pages, so opening a file does not copy it, and
+    several processes opening the same file share the same physical pages.
+    """
+
+    def __init__(self, graph_file: str):
+        self.path = graph_file
+        with open(graph_file, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_len = _PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != GRAPH_FILE_MAGIC:
+            raise ValueError(f"{graph_file} is not a binary graph file")
+        if version != GRAPH_FILE_VERSION:
+            raise ValueError(f"{graph_file} has graph file version {version}, expected {GRAPH_FILE_VERSION}")
+
+        self.version = version
+        self.header = json.loads(self._mmap[_PREAMBLE.size:_PREAMBLE.size + header_len].decode("utf-8"))
+        self._data_start = _align(_PREAMBLE.size + header_len)
+
+    @property
+    def eff_date(self) -> str:
+        return self.header.get("eff_date", "")
+
+    @property
+    def metadata(self) -> dict:
+        return self.header.get("metadata", {})
+
+    def has_section(self, name: str) -> bool:
+        return name in self.header["sections"]
+
+    def section_names(self) -> list:
+        return list(self.header["sections"].keys())
+
+    def array(self, name: str) -> np.ndarray:
+        """
+        Get a section of the file as a read-only array.
+
+        Arguments:
+        - `name` (str): section name.
+        """
+        section = self.header["sections"][name]
+        dtype = np.dtype(section["dtype"])
+        shape = tuple(section["shape"])
+        count = int(np.prod(shape, dtype=np.int64))
+        arr = np.frombuffer(self._mmap, dtype=dtype, count=count, offset=self._data_start + section["offset"])
+
+        return arr.reshape(shape)
+
+    def read_range(self, name: str, start: int, stop: int, f=None) -> np.ndarray:
+        """
+        Reads rows of a section into a new array with a regular file read instead of through the memory
+        map, so the pages read don't stay mapped into the process.
+
+        Arguments:
+        - `name` (str): section name.
+        - `start` (int): first row to read.
+        - `stop` (int): row after the last to read.
+        - `f` (file, optional): the graph file opened in binary mode, to reuse for several reads.
+        """
+        section = self.header["sections"][name]
+        dtype = np.dtype(section["dtype"])
+        row_shape = tuple(section["shape"][1:])
+        row_bytes = dtype.itemsize * int(np.prod(row_shape, dtype=np.int64))
+
+        arr = np.empty((stop - start,) + row_shape, dtype=dtype)
+        if f is None:
+            with open(self.path, "rb") as f:
+                return self.read_range(name, start, stop, f)
+
+        f.seek(self._data_start + section["offset"] + start * row_bytes)
+        f.readinto(memoryview(arr).cast("B"))
+
+        return arr
+
+    def string_table(self, prefix: str) -> StringTable:
+        return StringTable(self.array(f"{prefix}.data"), self.array(f"{prefix}.offsets"),
+                           self.array(f"{prefix}.sorted_ids"))
+
+
+def graph_sections(graph: CompiledGraph) -> dict:
+    """
+    Get the flat arrays that make up a compiled graph, keyed by section name.
+
+    Arguments:
+    - `graph` (CompiledGraph): graph to flatten.
+    """
+    sections = {}
+    sections.update(_string_table_sections("names", graph.names))
+    sections.update({
+        "lat": graph.lat,
+        "lon": graph.lon,
+        "wpt_type": graph.wpt_type,
+        "offsets": graph.offsets,
+        "targets": graph.targets,
+        "weights": graph.weights,
+        "airway_type": graph.airway_type,
+        "airway_name_ids": graph.airway_name_ids,
+    })
+    sections.update(_string_table_sections("airway_names", graph.airway_names))
+
+    return sections
+
+
+def _string_table_sections(prefix: str, table: StringTable) -> dict:
+    return {
+        f"{prefix}.data": table.data,
+        f"{prefix}.offsets": table.offsets,
+        f"{prefix}.sorted_ids": table.sorted_ids,
+    }
+
+
+def write_graph_file(graph_file: str, graph: CompiledGraph, extra_sections: dict = None, metadata: dict = None):
+    """
+    Writes a compiled graph to a binary graph file.
+
+    Arguments:
+    - `graph_file` (str): output file path.
+    - `graph` (CompiledGraph): graph to write. Its NASR effective date is stored in the header.
+    - `extra_sections` (dict, optional): additional named arrays to store with the graph.
+    - `metadata` (dict, optional): additional JSON-serializable header fields.
+    """
+    sections = graph_sections(graph)
+    if extra_sections is not None:
+        sections.update(extra_sections)
+
+    header = {
+        "eff_date": graph.eff_date,
+        "num_nodes": graph.num_nodes,
+        "num_edges": graph.num_edges,
+        "metadata": metadata if metadata is not None else {},
+    }
+    write_sections(graph_file, sections, header)
+
+
+def write_sections(graph_file: str, sections: dict, header: dict):
+    """
+    Writes named arrays in the binary graph file layout, so they can be opened with `GraphFile`.
+
+    Arguments:
+    - `graph_file` (str): output file path.
+    - `sections` (dict): named arrays to store.
+    - `header` (dict): JSON-serializable header fields. The creation time and section directory are added.
+    """
+    # Lay out the sections in the data area.
+    sections = dict(sections)
+    directory = {}
+    offset = 0
+    for name, arr in sections.items():
+        arr = np.ascontiguousarray(arr)
+        sections[name] = arr
+        directory[name] = {"offset": offset, "dtype": arr.dtype.str, "shape": list(arr.shape)}
+        offset = _align(offset + arr.nbytes)
+
+    header = dict(header)
+    header["created"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    header["sections"] = directory
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _align(_PREAMBLE.size + len(header_bytes))
+
+    with open(graph_file, "wb") as f:
+        f.write(_PREAMBLE.pack(GRAPH_FILE_MAGIC, GRAPH_FILE_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, arr in sections.items():
+            f.seek(data_start + directory[name]["offset"])
+            f.write(arr.tobytes())
+
+        # Pad the end of the file so the final section is fully aligned.
+        f.truncate(data_start + offset)
+
+
+def read_graph_file(graph_file: str) -> CompiledGraph:
+    """
+    Opens a binary graph file as a compiled graph backed by the memory-mapped file.
+
+    Arguments:
+    - `graph_file` (str): file path of the binary graph file.
+    """
+    gf = GraphFile(graph_file)
+    graph = CompiledGraph(
+        gf.string_table("names"),
+        gf.array("lat"),
+        gf.array("lon"),
+        gf.array("wpt_type"),
+        gf.array("offsets"),
+        gf.array("targets"),
+        gf.array("weights"),
+        gf.array("airway_type"),
+        gf.string_table("airway_names"),
+        gf.array("airway_name_ids"),
+        eff_date=gf.eff_date)
+
+    # Keep the file around for any optional sections stored with the graph.
+    graph.graph_file = gf
+
+    return graph
+
+
+def is_graph_file(graph_file: str) -> bool:
+    """
+    Checks if a file is a binary graph file (as opposed to a pickled `AirwayGraph`).
+
+    Arguments:
+    - `graph_file` (str): file path to check.
+    """
+    with open(graph_file, "rb") as f:
+        return f.read(len(GRAPH_FILE_MAGIC)) == GRAPH_FILE_MAGIC
+
+
+def load_graph(graph_file: str) -> CompiledGraph:
+    """
+    Loads a compiled graph from either a binary graph file or a pickled `AirwayGraph`.
+
+    Arguments:
+    - `graph_file` (str): file path of the airway graph.
+    """
+    if is_graph_file(graph_file):
+        return read_graph_file(graph_file)
+
+    with open(graph_file, "rb") as f:
+        return CompiledGraph.from_airway_graph(pickle.load(f))
+
+
+def convert_pickle(pickle_file: str, graph_file: str, eff_date: str = None) -> CompiledGraph:
+    """
+    Converts a pickled `AirwayGraph` into a binary graph file.
+
+    Arguments:
+    - `pickle_file` (str): file path of the pickled airway graph.
+    - `graph_file` (str): output file path.
+    - `eff_date` (str, optional): NASR effective date to store, for pickles that predate it.
+    """
+    with open(pickle_file, "rb") as f:
+        graph = CompiledGraph.from_airway_graph(pickle.load(f))
+
+    if eff_date is not None:
+        graph.eff_date = eff_date
+
+    write_graph_file(graph_file, graph)
+
+    return graph
+
+
+def parse_eff_date(eff_date: str) -> datetime.date:
+    """
+    Parses a NASR effective date ("YYYY/MM/DD").
+
+    Arguments:
+    - `eff_date` (str): NASR effective date.
+
+    Returns:
+    The date, or `None` if the effective date is unknown.
+    """
+    if not eff_date:
+        return None
+    return datetime.datetime.strptime(eff_date, "%Y/%m/%d").date()
+
+
+def is_stale(eff_date: str, today: datetime.date = None) -> bool:
+    """
+    Checks if data with the given NASR effective date is past its 28 day cycle.
+
+    Arguments:
+    - `eff_date` (str): NASR effective date ("YYYY/MM/DD").
+    - `today` (date, optional): date to check against. Default is today.
+
+    Returns:
+    True if the cycle has ended or the effective date is unknown.
+    """
+    effective = parse_eff_date(eff_date)
+    if effective is None:
+        return True
+
+    if today is None:
+        today = datetime.date.today()
+    return (today - effective).days >= NASR_CYCLE_DAYS
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
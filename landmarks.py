@@ -0,0 +1,224 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+from compiled_graph import CompiledGraph
+from map_types import SearchStats, WaypointType
+from path_search import find_best_path_bidirectional, find_best_path_compiled, shortest_path_tree
+
+
+class LandmarkIndex:
+    """
+    Landmark (ALT) distances for A* lower bounds. For every landmark L the index stores d(L, v) and
+    d(v, L) for all nodes v, computed along the directed airways. By the triangle inequality,
+
+        d(v, t) >= d(L, t) - d(L, v)    and    d(v, t) >= d(v, L) - d(t, L),
+
+    so the largest of these differences over all landmarks is an admissible, consistent heuristic.
+    """
+
+    def __init__(self, nodes: np.ndarray, forward: np.ndarray, reverse: np.ndarray):
+        # Landmark node ids.
+        self.nodes = nodes
+
+        # forward[k, v] = d(L_k, v) and reverse[k, v] = d(v, L_k), infinite when unreachable.
+        self.forward = forward
+        self.reverse = reverse
+
+    @classmethod
+    def build(cls, graph: CompiledGraph, n_landmarks=8, airports_only=False, verbose=False) -> "LandmarkIndex":
+        """
+        Selects landmarks and computes their distance tables. Landmarks are picked with farthest
+        selection: each new landmark is the node farthest (along the airways) from the landmarks chosen
+        so far, which places them around the edges of the network.
+
+        Arguments:
+        - `graph` (CompiledGraph): graph to preprocess.
+        - `n_landmarks` (int, optional): number of landmarks to select.
+        - `airports_only` (bool, optional): only select airports as landmarks.
+        - `verbose` (bool, optional): print progress.
+        """
+        # Candidate landmarks must have airways in both directions.
+        rev_offsets, _, _ = graph.reverse_adjacency()
+        candidates = (np.diff(graph.offsets) > 0) & (np.diff(rev_offsets) > 0)
+        if airports_only:
+            candidates &= graph.wpt_type == WaypointType.AIRPORT.value
+
+        if not np.any(candidates):
+            return cls(np.zeros(0, dtype=np.int32), np.zeros((0, graph.num_nodes)), np.zeros((0, graph.num_nodes)))
+
+        # Start the selection from the node farthest from the best connected node.
+        seed = int(np.argmax(np.where(candidates, np.diff(graph.offsets), -1)))
+        seed_dist, _ = shortest_path_tree(graph, seed)
+        closeness = np.where(np.isfinite(seed_dist), seed_dist, -np.inf)
+
+        nodes = []
+        forward = []
+        reverse = []
+        while len(nodes) < n_landmarks:
+            scores = np.where(candidates, closeness, -np.inf)
+            scores[nodes] = -np.inf
+            landmark = int(np.argmax(scores))
+            if scores[landmark] <= 0.0:
+                break
+
+            fwd, _ = shortest_path_tree(graph, landmark)
+            rev, _ = shortest_path_tree(graph, landmark, reverse=True)
+            nodes.append(landmark)
+            forward.append(fwd)
+            reverse.append(rev)
+
+            if verbose:
+                print(f"Landmark {len(nodes)}: {graph.node_name(landmark)}")
+
+            # Distance from each node to its closest landmark, in either direction.
+            reach = np.fmin(fwd, rev)
+            closeness = reach if len(nodes) == 1 else np.fmin(closeness, reach)
+            closeness = np.where(np.isfinite(closeness), closeness, -np.inf)
+
+        return cls(np.array(nodes, dtype=np.int32), np.array(forward), np.array(reverse))
+
+    @classmethod
+    def from_graph(cls, graph: CompiledGraph) -> "LandmarkIndex":
+        """
+        Loads the landmark index stored with a graph file.
+
+        Arguments:
+        - `graph` (CompiledGraph): graph opened from a binary graph file.
+
+        Returns:
+        The landmark index, or `None` if the graph has no landmarks.
+        """
+        gf = graph.graph_file
+        if gf is None or not gf.has_section("landmarks.nodes"):
+            return None
+
+        return cls(gf.array("landmarks.nodes"), gf.array("landmarks.forward"), gf.array("landmarks.reverse"))
+
+    def to_sections(self) -> dict:
+        """
+        Get the landmark arrays as graph file sections.
+        """
+        return {
+            "landmarks.nodes": self.nodes,
+            "landmarks.forward": self.forward,
+            "landmarks.reverse": self.reverse,
+        }
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def lower_bounds(self, goal: int) -> np.ndarray:
+        """
+        Computes the landmark lower bound on the distance from every node to the goal.
+
+        Arguments:
+        - `goal` (int): goal node id.
+
+        Returns:
+        A float64 array of lower bounds in meters, infinite for nodes that cannot reach the goal.
+        """
+        if len(self.nodes) == 0:
+            return np.zeros(self.forward.shape[1])
+
+        with np.errstate(invalid="ignore"):
+            fwd_bounds = self.forward[:, goal:goal + 1] - self.forward
+            rev_bounds = self.reverse - self.reverse[:, goal:goal + 1]
+
+        # Undefined (infinite minus infinite) bounds are ignored by fmax.
+        bounds = np.fmax(np.fmax.reduce(fwd_bounds, axis=0), np.fmax.reduce(rev_bounds, axis=0))
+        return np.fmax(bounds, 0.0)
+
+    def lower_bounds_from(self, source: int) -> np.ndarray:
+        """
+        Computes the landmark lower bound on the distance from a source to every node, using
+
+            d(s, v) >= d(L, v) - d(L, s)    and    d(s, v) >= d(s, L) - d(v, L).
+
+        Arguments:
+        - `source` (int): source node id.
+
+        Returns:
+        A float64 array of lower bounds in meters, infinite for nodes that cannot be reached from the source.
+        """
+        if len(self.nodes) == 0:
+            return np.zeros(self.forward.shape[1])
+
+        with np.errstate(invalid="ignore"):
+            fwd_bounds = self.forward - self.forward[:, source:source + 1]
+            rev_bounds = self.reverse[:, source:source + 1] - self.reverse
+
+        # Undefined (infinite minus infinite) bounds are ignored by fmax.
+        bounds = np.fmax(np.fmax.reduce(fwd_bounds, axis=0), np.fmax.reduce(rev_bounds, axis=0))
+        return np.fmax(bounds, 0.0)
+
+
+def expansion_report(graph: CompiledGraph, landmarks: LandmarkIndex, pairs: list) -> list:
+    """
+    Compares A* and bidirectional A* with and without landmarks on a set of queries.
+
+    Arguments:
+    - `graph` (CompiledGraph): graph to search on.
+    - `landmarks` (LandmarkIndex): landmark index for the graph.
+    - `pairs` (list): (start, end) identifier pairs.
+
+    Returns:
+    A list of dictionaries with the path length and the nodes expanded and query time for each mode.
+    """
+    report = []
+    for start_ident, end_ident in pairs:
+        row = {"start": start_ident, "end": end_ident}
+        for mode, search, index in (("plain", find_best_path_compiled, None),
+                                    ("alt", find_best_path_compiled, landmarks),
+                                    ("bidir", find_best_path_bidirectional, None),
+                                    ("bidir_alt", find_best_path_bidirectional, landmarks)):
+            stats = SearchStats()
+            start_time = time.perf_counter()
+            path = search(graph, start_ident, end_ident, landmarks=index, stats=stats)
+            row[f"{mode}_expanded"] = stats.nodes_expanded
+            row[f"{mode}_time"] = time.perf_counter() - start_time
+            row["path_len"] = len(path)
+        report.append(row)
+
+    return report
+
+
+if __name__ == "__main__":
+    from graph_file import load_graph
+
+    # Make this script configurable
+    parser = argparse.ArgumentParser(description="Report A* and bidirectional A* node expansions with and without landmarks.")
+    parser.add_argument("--graph_file", default="data/airway_graph.fpg")
+    parser.add_argument("--pairs", nargs="*", default=["MONIA:MILBY", "SWAGG:LIMBO"],
+                        help="Queries as START:END identifier pairs")
+    parser.add_argument("--random_pairs", type=int, default=0, help="Number of additional random queries")
+    parser.add_argument("--landmarks", type=int, default=8,
+                        help="Number of landmarks to build if the graph file does not contain any")
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    graph = load_graph(args.graph_file)
+    landmarks = LandmarkIndex.from_graph(graph)
+    if landmarks is None:
+        landmarks = LandmarkIndex.build(graph, args.landmarks)
+
+    pairs = [tuple(p.split(":")) for p in args.pairs]
+    connected = np.flatnonzero(np.diff(graph.offsets) > 0)
+    rng = random.Random(args.seed)
+    for _ in range(args.random_pairs):
+        start, end = rng.sample(connected.tolist(), 2)
+        pairs.append((graph.node_name(start), graph.node_name(end)))
+
+    modes = ["plain", "alt", "bidir", "bidir_alt"]
+    print(f"{'start':>10} {'end':>10} {'len':>4} " + " ".join(f"{mode:>9}" for mode in modes) + f" {'ratio':>6}")
+    totals = dict.fromkeys(modes, 0)
+    for row in expansion_report(graph, landmarks, pairs):
+        ratio = row["plain_expanded"] / max(row["alt_expanded"], 1)
+        print(f"{row['start']:>10} {row['end']:>10} {row['path_len']:>4} " +
+              " ".join(f"{row[f'{mode}_expanded']:>9}" for mode in modes) + f" {ratio:>6.1f}")
+        for mode in modes:
+            totals[mode] += row[f"{mode}_expanded"]
+    print(f"{'total':>10} {'':>10} {'':>4} " + " ".join(f"{totals[mode]:>9}" for mode in modes))
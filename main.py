@@ -1,29 +1,215 @@
-
 import argparse
-import pickle
 
-from path_search import find_best_path
+from constraints import ConstraintSet, load_constraints, parse_time
+from contraction import ContractionHierarchy
+from graph_file import is_stale, load_graph
+from landmarks import LandmarkIndex
+from map_types import SearchStats
+from geo_utils import METERS_PER_NM
+from path_search import (find_best_path_bidirectional, find_best_path_ch, find_best_path_compiled,
+                         find_airport_route, find_k_best_paths, path_distance)
+from procedures import ProcedureIndex
+from route_cache import RouteCache, graph_identity
+from search_trace import SearchTrace
+from wind_model import WindCostModel, WindField
 
 if __name__ == "__main__":
     # Configurable parameters
     parser = argparse.ArgumentParser()
     parser.add_argument("start_point")
     parser.add_argument("end_point")
-    parser.add_argument("--graph_file", default="data/airway_graph.pkl")
+    parser.add_argument("--graph_file", default="data/airway_graph.fpg")
+    parser.add_argument("--no_landmarks", action="store_true",
+                        help="Ignore landmark distances stored in the graph file")
+    parser.add_argument("--ch_file", default="",
+                        help="Contraction hierarchy built for the graph. If given, it is used for the search")
+    parser.add_argument("--bidirectional", action="store_true",
+                        help="Search from both ends at once with bidirectional A*")
+    parser.add_argument("--alternates", type=int, default=0,
+                        help="Also find this many alternate routes, the next shortest after the recommended one")
+    parser.add_argument("--no_procedures", action="store_true",
+                        help="Don't fly the departure and arrival procedures stored in the graph file")
+    parser.add_argument("--no_custom", action="store_true",
+                        help="Only use published airways, not the custom airways between nearby fixes")
+    parser.add_argument("--cache_file", default="",
+                        help="Route cache file. Routes found before on the same NASR cycle are read from it")
+    parser.add_argument("--constraints", default="",
+                        help="JSON file of closed areas, airways and fixes (TFRs, NOTAMs) to route around")
+    parser.add_argument("--altitude", type=float, default=None,
+                        help="Flight altitude in feet MSL, to apply only the closures at this altitude")
+    parser.add_argument("--time", default=None,
+                        help="Flight time in ISO 8601 (UTC unless given), to apply only the closures active then")
+    parser.add_argument("--wind_file", default="",
+                        help="Gridded wind forecast (npz). If given, the route with the shortest flight time is found")
+    parser.add_argument("--forecast_hour", type=float, default=0.0,
+                        help="Forecast hour of the wind field to fly in")
+    parser.add_argument("--tas", type=float, default=120.0, help="True airspeed in knots, used with --wind_file")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Print search statistics and where the search time was spent")
+    parser.add_argument("--trace_file", default="",
+                        help="JSON-lines file to append a trace of the waypoints expanded by the search to")
+    parser.add_argument("--trace_sample", type=int, default=1,
+                        help="Only trace every n-th expanded waypoint")
 
     # Parse the arguments
     args = parser.parse_args()
     start_id = args.start_point
     end_id = args.end_point
     graph_file = args.graph_file
+    use_landmarks = not args.no_landmarks
+    ch_file = args.ch_file
+    cache_file = args.cache_file
+    use_custom = not args.no_custom
+    bidirectional = args.bidirectional
+    constraints_file = args.constraints
+    verbose = args.verbose
+    n_alternates = args.alternates
+    wind_file = args.wind_file
+    use_procedures = not args.no_procedures
+
+    if wind_file != "" and args.altitude is None:
+        parser.error("--altitude is required with --wind_file")
+
+    # Load the airway graph. Binary graph files are memory-mapped, pickled AirwayGraphs are compiled on load.
+    graph = load_graph(graph_file)
+
+    # Warn if the graph was built from an expired NASR cycle.
+    if graph.eff_date == "":
+        print("Warning: airway graph has no NASR effective date, it may be out of date.")
+    elif is_stale(graph.eff_date):
+        print(f"Warning: airway graph NASR cycle effective {graph.eff_date} has expired.")
+
+    # Route between airports through their departure and arrival procedures, if the graph has them and either
+    # end has any.
+    procedures = ProcedureIndex.from_graph(graph) if use_procedures else None
+    if procedures is not None and len(procedures.options(graph, "departures", start_id)) == 0 and \
+            len(procedures.options(graph, "arrivals", end_id)) == 0:
+        procedures = None
+    if procedures is not None and wind_file != "":
+        print("Warning: procedures are flown in still air only, ignoring them.")
+        procedures = None
+    elif procedures is not None and n_alternates > 0:
+        print("Warning: alternate routes don't fly procedures, ignoring them.")
+        procedures = None
+
+    # Load the contraction hierarchy if requested.
+    ch = None
+    if ch_file != "":
+        ch = ContractionHierarchy.load(ch_file)
+        if not ch.matches(graph):
+            print(f"Warning: {ch_file} was not built for {graph_file}, ignoring it.")
+            ch = None
+        elif not use_custom:
+            print("Warning: the contraction hierarchy includes custom airways, ignoring it.")
+            ch = None
+        elif constraints_file != "":
+            print("Warning: the contraction hierarchy can't route around closures, ignoring it.")
+            ch = None
+        elif wind_file != "":
+            print("Warning: the contraction hierarchy is built on distances, not flight times, ignoring it.")
+            ch = None
+        elif n_alternates > 0:
+            print("Warning: the contraction hierarchy can't find alternate routes, ignoring it.")
+            ch = None
+        elif procedures is not None:
+            print("Warning: the contraction hierarchy can't fly procedures, ignoring it.")
+            ch = None
+        elif bidirectional:
+            print("Warning: --bidirectional is ignored, the contraction hierarchy search is already bidirectional.")
+
+    # Mask the airways closed by the constraints.
+    blocked = None
+    blocked_procedures = None
+    if constraints_file != "":
+        closures = load_constraints(constraints_file)
+        constraint_set = ConstraintSet(graph)
+        blocked = constraint_set.edge_mask(closures, args.altitude, parse_time(args.time))
+        print(f"{int(blocked.sum())} airways closed by {len(closures)} closures.")
+
+        # Procedures are checked on their own paths, since their legs are not airways of the graph.
+        if procedures is not None:
+            blocked_procedures = {kind: constraint_set.procedure_mask(procedures, kind, closures, args.altitude,
+                                                                      parse_time(args.time))
+                                  for kind in ("departures", "arrivals")}
+
+    # Compute the flight time of every airway in the forecast winds. The search then minimizes the time, with
+    # its distance heuristic scaled by the fastest possible ground speed.
+    weights = None
+    h_scale = 1.0
+    if wind_file != "":
+        wind_model = WindCostModel(graph, WindField.load(wind_file), args.tas)
+        weights = wind_model.edge_times(args.altitude, args.forecast_hour)
+        h_scale = wind_model.heuristic_scale(args.altitude, args.forecast_hour)
 
-    # Load the airway graph. This must be an AirwayGraph type.
-    graph = None
-    with open(graph_file, "rb") as f:
-        graph = pickle.load(f)
+    # Search instrumentation.
+    stats = SearchStats(timed=True) if verbose else None
+    trace = None
+    if args.trace_file != "":
+        # Only the A* searches record a trace, so don't leave an empty trace file behind for the others.
+        if ch is not None:
+            print("Warning: the contraction hierarchy search can't be traced, ignoring --trace_file.")
+        elif n_alternates > 0:
+            print("Warning: alternate route searches can't be traced, ignoring --trace_file.")
+        elif bidirectional and procedures is None:
+            print("Warning: the bidirectional search can't be traced, ignoring --trace_file.")
+        else:
+            trace = SearchTrace(args.trace_file, sample_every=args.trace_sample)
+
+    # Procedures flown by the route, if any.
+    flown = {}
 
     # Find the shortest path between the points.
-    best_path = find_best_path(graph, start_id, end_id, verbose=True)
+    def search():
+        if procedures is not None:
+            path, flown["departure"], flown["arrival"] = find_airport_route(graph, procedures, start_id, end_id,
+                                                                           stats=stats, custom_airways=use_custom,
+                                                                           blocked=blocked,
+                                                                           blocked_procedures=blocked_procedures,
+                                                                           trace=trace)
+            return path
+        if ch is not None:
+            return find_best_path_ch(graph, ch, start_id, end_id, stats=stats)
+
+        # Use the precomputed landmarks, if any, to tighten the A* heuristic.
+        landmarks = LandmarkIndex.from_graph(graph) if use_landmarks else None
+        if bidirectional:
+            return find_best_path_bidirectional(graph, start_id, end_id, landmarks=landmarks, stats=stats,
+                                                custom_airways=use_custom, blocked=blocked, weights=weights,
+                                                h_scale=h_scale)
+        return find_best_path_compiled(graph, start_id, end_id, landmarks=landmarks, stats=stats,
+                                       custom_airways=use_custom, blocked=blocked, trace=trace, weights=weights,
+                                       h_scale=h_scale)
+
+    # Find the recommended route and its alternates together. Routes around closures or through winds depend on
+    # them, so they are not cached.
+    alternates = []
+    if n_alternates > 0:
+        routes = find_k_best_paths(graph, start_id, end_id, n_alternates + 1, stats=stats, custom_airways=use_custom,
+                                   blocked=blocked, weights=weights)
+        best_path = routes[0][0] if len(routes) > 0 else []
+        alternates = routes[1:]
+    elif cache_file != "" and blocked is None and weights is None:
+        # Reuse the route if it was already found on this NASR cycle.
+        cache = RouteCache(cache_file=cache_file)
+        cache.set_eff_date(graph.eff_date, graph_identity(graph_file, ch_file if ch is not None else ""))
+        options = {"ch": ch is not None, "landmarks": use_landmarks, "custom": use_custom,
+                   "procedures": procedures is not None}
+        best_path = cache.get_or_compute(start_id, end_id, options, search)
+        cache.save()
+    else:
+        best_path = search()
+
+    if trace is not None:
+        trace.close()
+
+    # Print out the search statistics. Routes read from the cache have none.
+    if stats is not None and stats.nodes_expanded > 0:
+        print(f"Expanded {stats.nodes_expanded} waypoints and relaxed {stats.edges_relaxed} airways in "
+              f"{1000 * stats.total_time:.1f} ms (peak frontier {stats.peak_frontier}, "
+              f"{stats.stale_pops} stale entries).")
+        if stats.lookup_time + stats.heuristic_time + stats.queue_time > 0:
+            print(f"Graph lookups {1000 * stats.lookup_time:.1f} ms, heuristic {1000 * stats.heuristic_time:.1f} ms, "
+                  f"queue {1000 * stats.queue_time:.1f} ms.")
 
     # Print out a list of waypoints.
     wpt_plan = ""
@@ -33,5 +219,35 @@ if __name__ == "__main__":
     if len(best_path) > 0:
         print("RECOMMENDED FLIGHT PLAN:")
         print(wpt_plan)
+
+        # Routes read from the cache don't keep the names of their procedures.
+        for kind in ("departure", "arrival"):
+            proc = flown.get(kind)
+            if proc is not None:
+                runways = f" (runways {proc.runways})" if proc.runways != "" else ""
+                print(f"{kind.capitalize()}: {proc.name}{runways}")
     else:
         print("NO PATH FOUND.")
+
+    # Print out the distance and time en route in the winds.
+    if len(best_path) > 0 and weights is not None:
+        ete = path_distance(graph, best_path, weights)
+        print(f"Distance: {path_distance(graph, best_path) / METERS_PER_NM:.1f} NM, "
+              f"time en route: {int(ete // 3600)}h {int(ete % 3600 // 60):02d}m at {args.tas:.0f} kt TAS")
+
+    # Print out the alternates with their extra distance (or time, in winds).
+    if len(best_path) > 0 and n_alternates > 0 and weights is not None:
+        best_time = routes[0][1]
+        for i, (path, ete) in enumerate(alternates):
+            print(f"ALTERNATE {i + 1}: {ete / 60:.1f} min (+{(ete - best_time) / 60:.1f} min)")
+            print(" ".join(path))
+        if len(alternates) < n_alternates:
+            print(f"Only {len(alternates)} alternate routes exist.")
+    elif len(best_path) > 0 and n_alternates > 0:
+        best_dist = routes[0][1]
+        print(f"Distance: {best_dist / METERS_PER_NM:.1f} NM")
+        for i, (path, dist) in enumerate(alternates):
+            print(f"ALTERNATE {i + 1}: {dist / METERS_PER_NM:.1f} NM (+{(dist - best_dist) / METERS_PER_NM:.1f} NM)")
+            print(" ".join(path))
+        if len(alternates) < n_alternates:
+            print(f"Only {len(alternates)} alternate routes exist.")
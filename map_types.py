@@ -38,9 +38,52 @@ class Airway:
     name: str = ""
 
 
+@dataclass
+class TerminalProcedure:
+    # Computer code of the procedure, or of the transition for a procedure flown with a transition.
+    name: str = ""
+    airport: str = ""
+    # Runway ends the procedure serves, comma separated. Empty if it serves all of them.
+    runways: str = ""
+    # Waypoint identifiers in the order they are flown, from the airport for departures and to the
+    # airport for arrivals.
+    path: list = field(default_factory=list)
+    distance: float = 0.0
+
+
+@dataclass
+class ExpandedRoute:
+    # Route string as filed.
+    route: str = ""
+    # Waypoint identifiers of the route with its airways and procedures expanded.
+    path: list = field(default_factory=list)
+    distance: float = 0.0
+    # Descriptions of the invalid segments of the route. Empty if every segment is valid.
+    errors: list = field(default_factory=list)
+
+
 @dataclass(order=True)
 class AStarWaypoint:
     priority: float = field(default=np.inf, compare=True)
     g_val: float = field(default=np.inf, compare=False)
     h_val: float = field(default=np.inf, compare=False)
     wpt: Waypoint = field(default=None, compare=False)
+
+
+@dataclass
+class SearchStats:
+    nodes_expanded: int = 0
+    edges_relaxed: int = 0
+
+    # Largest number of entries in the frontier, and frontier entries skipped because a better path to the
+    # same waypoint was found after they were queued.
+    peak_frontier: int = 0
+    stale_pops: int = 0
+
+    # Wall time of the search in seconds. When `timed` is set, it is also split into graph lookups, heuristic
+    # and queue operations. This adds timer calls to the search loop, so it is off by default.
+    timed: bool = False
+    total_time: float = 0.0
+    lookup_time: float = 0.0
+    heuristic_time: float = 0.0
+    queue_time: float = 0.0
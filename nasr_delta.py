@@ -0,0 +1,138 @@
+import os
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+import nasr_ingest
+
+# Waypoint columns compared between cycles.
+_WAYPOINT_VALUES = ["lat", "lon", "wpt_type"]
+
+# Directed airway columns compared between cycles. Airways are keyed on their (from, to) direction.
+_EDGE_KEYS = ["from", "to"]
+_EDGE_VALUES = ["start", "end", "airway_type", "name"]
+
+
+@dataclass
+class NasrTables:
+    """
+    Resolved NASR cycle: the waypoints and directed airways a full graph build would contain, in
+    insertion order.
+    """
+    eff_date: str = ""
+    waypoints: pd.DataFrame = None
+    airways: pd.DataFrame = None
+
+
+@dataclass
+class NasrDelta:
+    """
+    Differences between two resolved NASR cycles.
+    """
+    prev_eff_date: str = ""
+    eff_date: str = ""
+
+    # Waypoint identifiers that were added, removed, or whose position or type changed.
+    added_waypoints: list = field(default_factory=list)
+    removed_waypoints: list = field(default_factory=list)
+    modified_waypoints: list = field(default_factory=list)
+
+    # Directed airway (from, to) pairs that were added, removed, or whose end points, type or name changed.
+    added_airways: list = field(default_factory=list)
+    removed_airways: list = field(default_factory=list)
+    modified_airways: list = field(default_factory=list)
+
+    def num_changes(self) -> int:
+        return (len(self.added_waypoints) + len(self.removed_waypoints) + len(self.modified_waypoints) +
+                len(self.added_airways) + len(self.removed_airways) + len(self.modified_airways))
+
+
+def nasr_files_in(nasr_dir: str, nasr_files: list) -> list:
+    """
+    Get the paths of the same NASR files in another directory, such as the one holding the previous cycle.
+
+    Arguments:
+    - `nasr_dir` (str): directory of the NASR files.
+    - `nasr_files` (list): NASR file paths, only their file names are used.
+    """
+    return [os.path.join(nasr_dir, os.path.basename(f)) for f in nasr_files]
+
+
+def resolve_nasr_tables(fix_file: str, apt_file: str, navaid_file: str, awy_file: str, star_rte_file: str,
+                        star_apt_file: str, sid_rte_file: str, sid_apt_file: str, cache_dir: str = "") -> NasrTables:
+    """
+    Resolves a set of NASR files into the waypoint and directed airway tables that
+    `AirwayGraph.load_nasr_data_bulk` would add to an empty graph.
+
+    Arguments: same as `AirwayGraph.load_nasr_data_bulk`.
+    """
+    fixes = nasr_ingest.read_nasr_csv(fix_file, cache_dir)
+    airports = nasr_ingest.read_nasr_csv(apt_file, cache_dir)
+    navaids = nasr_ingest.read_nasr_csv(navaid_file, cache_dir)
+    star_rte = nasr_ingest.read_nasr_csv(star_rte_file, cache_dir)
+    star_apt = nasr_ingest.read_nasr_csv(star_apt_file, cache_dir)
+    sid_rte = nasr_ingest.read_nasr_csv(sid_rte_file, cache_dir)
+    sid_apt = nasr_ingest.read_nasr_csv(sid_apt_file, cache_dir)
+    awy_seg = nasr_ingest.read_nasr_csv(awy_file, cache_dir)
+
+    # The cycle's effective date is the most recent date in any of the files.
+    eff_date = ""
+    for nasr_csv in (fixes, airports, navaids, star_rte, star_apt, sid_rte, sid_apt, awy_seg):
+        if "EFF_DATE" in nasr_csv.columns:
+            dates = nasr_csv["EFF_DATE"].dropna()
+            if len(dates) > 0:
+                eff_date = max(eff_date, str(dates.max()))
+
+    waypoints = nasr_ingest.build_waypoint_table(fixes, airports, navaids)
+    edge_table = nasr_ingest.build_edge_table(star_rte, star_apt, sid_rte, sid_apt, awy_seg)
+    airways = nasr_ingest.resolve_directed_edges(edge_table, waypoints["name"])
+
+    return NasrTables(eff_date, waypoints, airways)
+
+
+def diff_nasr_tables(prev: NasrTables, new: NasrTables) -> NasrDelta:
+    """
+    Compares two resolved NASR cycles row by row.
+
+    Arguments:
+    - `prev` (NasrTables): the cycle the graph was built from.
+    - `new` (NasrTables): the cycle to update the graph to.
+
+    Returns:
+    The `NasrDelta` between the cycles.
+    """
+    delta = NasrDelta(prev.eff_date, new.eff_date)
+
+    # 1. Waypoints, keyed on their identifier.
+    added, removed, modified = _diff(prev.waypoints, new.waypoints, ["name"], _WAYPOINT_VALUES)
+    delta.added_waypoints = added["name"].tolist()
+    delta.removed_waypoints = removed["name"].tolist()
+    delta.modified_waypoints = modified["name"].tolist()
+
+    # 2. Directed airways, keyed on their direction.
+    added, removed, modified = _diff(prev.airways, new.airways, _EDGE_KEYS, _EDGE_VALUES)
+    delta.added_airways = list(zip(added["from"], added["to"]))
+    delta.removed_airways = list(zip(removed["from"], removed["to"]))
+    delta.modified_airways = list(zip(modified["from"], modified["to"]))
+
+    return delta
+
+
+def _diff(prev: pd.DataFrame, new: pd.DataFrame, keys: list, values: list) -> tuple:
+    """
+    Splits the keys of two tables into added, removed and modified rows.
+    """
+    merged = prev[keys + values].merge(new[keys + values], on=keys, how="outer", suffixes=("_prev", ""),
+                                       indicator=True)
+    added = merged[merged["_merge"] == "right_only"]
+    removed = merged[merged["_merge"] == "left_only"]
+
+    both = merged[merged["_merge"] == "both"]
+    changed = pd.Series(False, index=both.index)
+    for col in values:
+        prev_col = both[f"{col}_prev"]
+        new_col = both[col]
+        changed |= (prev_col != new_col) & ~(prev_col.isna() & new_col.isna())
+    modified = both[changed.to_numpy()]
+
+    return added[keys], removed[keys], modified[keys]
@@ -0,0 +1,411 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from map_types import AirwayType, WaypointType
+
+# Columns of the waypoint table built from the NASR base files.
+WAYPOINT_COLUMNS = ["name", "lat", "lon", "wpt_type"]
+
+# Columns of the edge table built from the NASR route files. Rows are kept in the order the sequential
+# loader would have called `AirwayGraph.add_airway`.
+EDGE_COLUMNS = ["start", "end", "airway_type", "name", "bidirectional"]
+
+
+# Columns used from each NASR file, keyed on the file name, with the type to parse them as. Identifiers are
+# kept as strings, even when they look like numbers. The other columns are never read.
+NASR_COLUMNS = {
+    "FIX_BASE": {"EFF_DATE": object, "FIX_ID": object, "LAT_DECIMAL": np.float64, "LONG_DECIMAL": np.float64},
+    "APT_BASE": {"EFF_DATE": object, "ARPT_ID": object, "LAT_DECIMAL": np.float64, "LONG_DECIMAL": np.float64},
+    "NAV_BASE": {"EFF_DATE": object, "NAV_ID": object, "NAV_TYPE": object, "NAME": object,
+                 "LAT_DECIMAL": np.float64, "LONG_DECIMAL": np.float64},
+    "STAR_RTE": {"EFF_DATE": object, "STAR_COMPUTER_CODE": object, "ROUTE_PORTION_TYPE": object,
+                 "ROUTE_NAME": object, "BODY_SEQ": np.float64, "TRANSITION_COMPUTER_CODE": object,
+                 "POINT_SEQ": np.float64, "POINT": object, "NEXT_POINT": object},
+    "STAR_APT": {"EFF_DATE": object, "STAR_COMPUTER_CODE": object, "BODY_NAME": object, "BODY_SEQ": np.float64,
+                 "ARPT_ID": object, "RWY_END_ID": object},
+    "DP_RTE": {"EFF_DATE": object, "DP_NAME": object, "DP_COMPUTER_CODE": object, "ROUTE_PORTION_TYPE": object,
+               "ROUTE_NAME": object, "BODY_SEQ": np.float64, "TRANSITION_COMPUTER_CODE": object,
+               "POINT_SEQ": np.float64, "POINT": object, "NEXT_POINT": object},
+    "DP_APT": {"EFF_DATE": object, "DP_COMPUTER_CODE": object, "BODY_NAME": object, "BODY_SEQ": np.float64,
+               "ARPT_ID": object, "RWY_END_ID": object},
+    "AWY_SEG": {"EFF_DATE": object, "AWY_LOCATION": object, "AWY_ID": object, "POINT_SEQ": np.float64,
+                "SEG_VALUE": object, "NEXT_SEG": object},
+}
+
+# Version of the cached table format. Cached tables from other versions are ignored.
+CACHE_VERSION = 1
+
+
+def read_nasr_csv(csv_file: str, cache_dir: str = "") -> pd.DataFrame:
+    """
+    Reads one NASR subscription CSV. Files listed in `NASR_COLUMNS` are read with only the columns the
+    graph build uses; other files are read whole.
+
+    With a cache directory, the parsed table is saved there as a NumPy archive named after a hash of the
+    CSV contents, and later reads of the same file load the archive instead of parsing the CSV again.
+
+    Arguments:
+    - `csv_file` (str): File path for the NASR CSV.
+    - `cache_dir` (str, optional): directory of the parsed table cache. Default is no cache.
+    """
+    columns = NASR_COLUMNS.get(os.path.splitext(os.path.basename(csv_file))[0].upper())
+
+    # 1. Look for the parsed table in the cache.
+    cache_file = ""
+    if cache_dir != "":
+        cache_file = os.path.join(cache_dir, _cache_name(csv_file, columns))
+        if os.path.exists(cache_file):
+            return _load_table(cache_file)
+
+    # 2. Parse the CSV. Columns missing from the file are left out of the table, as they would be if the
+    # whole file was read.
+    if columns is None:
+        table = pd.read_csv(csv_file)
+    else:
+        table = pd.read_csv(csv_file, usecols=lambda col: col in columns, dtype=columns)
+
+    # 3. Save the table for the next read.
+    if cache_file != "":
+        os.makedirs(cache_dir, exist_ok=True)
+        _save_table(table, cache_file)
+
+    return table
+
+
+def _cache_name(csv_file: str, columns: dict) -> str:
+    """
+    Gets the cache file name of a NASR CSV, from a hash of its contents and of the columns read from it.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{CACHE_VERSION} {sorted(columns.items(), key=str) if columns else ''}".encode())
+    with open(csv_file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    stem = os.path.splitext(os.path.basename(csv_file))[0]
+    return f"{stem}.{digest.hexdigest()}.npz"
+
+
+def _save_table(table: pd.DataFrame, cache_file: str):
+    """
+    Saves a parsed table as a NumPy archive. Text columns are dictionary encoded: the distinct values are
+    stored once, with an index per row (-1 for missing values). NASR text columns repeat the same few
+    values on many rows, so this is compact, loads quickly and needs no pickle.
+    """
+    arrays = {"columns": np.array(table.columns, dtype=str)}
+    for i, col in enumerate(table.columns):
+        values = table[col]
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            arrays[f"c{i}"] = values.to_numpy(dtype=np.float64)
+        else:
+            codes, uniques = pd.factorize(values.to_numpy(dtype=object))
+            arrays[f"c{i}"] = codes.astype(np.int32)
+            arrays[f"u{i}"] = np.array([str(value) for value in uniques], dtype=str)
+
+    # Write to a temporary file first, so an interrupted build never leaves a partial archive behind.
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_file, cache_file)
+
+
+def _load_table(cache_file: str) -> pd.DataFrame:
+    """
+    Loads a table saved with `_save_table`.
+    """
+    with np.load(cache_file) as data:
+        table = {}
+        for i, col in enumerate(data["columns"].tolist()):
+            values = data[f"c{i}"]
+            if f"u{i}" in data.files:
+                # The extra last entry is the missing value, which code -1 selects.
+                uniques = np.append(data[f"u{i}"].astype(object), np.nan)
+                values = uniques[values]
+            table[col] = values
+
+    return pd.DataFrame(table)
+
+
+def build_waypoint_table(fixes: pd.DataFrame, airports: pd.DataFrame, navaids: pd.DataFrame,
+                         existing=()) -> pd.DataFrame:
+    """
+    Builds the table of waypoints to add to a graph, applying the same priority rules as the
+    sequential loaders: fixes first, then airports, then navaids renamed on collision. Identifiers
+    that were already seen keep their first definition.
+
+    Arguments:
+    - `fixes` (DataFrame): parsed FIX_BASE.csv
+    - `airports` (DataFrame): parsed APT_BASE.csv
+    - `navaids` (DataFrame): parsed NAV_BASE.csv
+    - `existing` (iterable, optional): waypoint identifiers already in the graph.
+
+    Returns:
+    A DataFrame with `WAYPOINT_COLUMNS`, in insertion order, containing only new waypoints.
+    """
+    return merge_waypoint_tables(fix_waypoints(fixes), airport_waypoints(airports), navaid_waypoints(navaids),
+                                 existing)
+
+
+def fix_waypoints(fixes: pd.DataFrame) -> pd.DataFrame:
+    """
+    FIX waypoint rows of FIX_BASE.csv, before the other tables are merged in.
+    """
+    return _new_waypoints(fixes["FIX_ID"], fixes["LAT_DECIMAL"], fixes["LONG_DECIMAL"], WaypointType.FIX,
+                          pd.Index([], dtype=object))
+
+
+def airport_waypoints(airports: pd.DataFrame) -> pd.DataFrame:
+    """
+    AIRPORT waypoint rows of APT_BASE.csv, before the other tables are merged in.
+    """
+    return _new_waypoints(airports["ARPT_ID"], airports["LAT_DECIMAL"], airports["LONG_DECIMAL"],
+                          WaypointType.AIRPORT, pd.Index([], dtype=object))
+
+
+def navaid_waypoints(navaids: pd.DataFrame) -> pd.DataFrame:
+    """
+    Navaid rows of NAV_BASE.csv with the qualified name each navaid gets if its identifier collides, and
+    whether the identifier repeats an earlier navaid's. Collisions with fixes and airports are only
+    known when the tables are merged.
+    """
+    nav_ids = navaids["NAV_ID"]
+    qualified = nav_ids.astype(str) + "_" + navaids["NAME"].astype(str) + "_" + navaids["NAV_TYPE"].astype(str)
+
+    return pd.DataFrame({
+        "name": nav_ids.to_numpy(dtype=object),
+        "qualified": qualified.to_numpy(dtype=object),
+        "duplicate": nav_ids.duplicated(keep="first").to_numpy(),
+        "lat": navaids["LAT_DECIMAL"].to_numpy(dtype=np.float64),
+        "lon": navaids["LONG_DECIMAL"].to_numpy(dtype=np.float64),
+    })
+
+
+def merge_waypoint_tables(fix_table: pd.DataFrame, apt_table: pd.DataFrame, nav_table: pd.DataFrame,
+                          existing=()) -> pd.DataFrame:
+    """
+    Merges the per-table waypoint rows in priority order: fixes first, then airports, then navaids
+    renamed on collision. The result doesn't depend on the order the tables were built in.
+
+    Arguments:
+    - `fix_table` (DataFrame): rows from `fix_waypoints`.
+    - `apt_table` (DataFrame): rows from `airport_waypoints`.
+    - `nav_table` (DataFrame): rows from `navaid_waypoints`.
+    - `existing` (iterable, optional): waypoint identifiers already in the graph.
+
+    Returns:
+    A DataFrame with `WAYPOINT_COLUMNS`, in insertion order, containing only new waypoints.
+    """
+    existing = pd.Index(list(existing), dtype=object)
+
+    # 1. Fixes.
+    fix_table = fix_table[~fix_table["name"].isin(existing)]
+    existing = existing.append(pd.Index(fix_table["name"]))
+
+    # 2. Airports.
+    apt_table = apt_table[~apt_table["name"].isin(existing)]
+    existing = existing.append(pd.Index(apt_table["name"]))
+
+    # 3. Navaids. A navaid whose identifier is already taken, either by a fix, an airport or an earlier
+    # navaid, gets additional name qualifiers to differentiate it.
+    nav_ids = nav_table["name"]
+    collides = nav_ids.isin(existing) | nav_table["duplicate"]
+    nav_names = nav_ids.where(~collides, nav_table["qualified"])
+    nav_table = _new_waypoints(nav_names, nav_table["lat"], nav_table["lon"], WaypointType.NAVAID, existing)
+
+    return pd.concat([fix_table, apt_table, nav_table], ignore_index=True)
+
+
+def _new_waypoints(names: pd.Series, lats: pd.Series, lons: pd.Series, wpt_type: WaypointType,
+                   existing: pd.Index) -> pd.DataFrame:
+    """
+    Builds waypoint rows of one type, dropping identifiers already seen.
+    """
+    table = pd.DataFrame({
+        "name": names.to_numpy(dtype=object),
+        "lat": lats.to_numpy(dtype=np.float64),
+        "lon": lons.to_numpy(dtype=np.float64),
+        "wpt_type": wpt_type.value,
+    })
+    table = table[table["name"].notna()]
+    table = table[~table["name"].duplicated(keep="first") & ~table["name"].isin(existing)]
+
+    return table.reset_index(drop=True)
+
+
+def build_edge_table(star_rte: pd.DataFrame, star_apt: pd.DataFrame, sid_rte: pd.DataFrame,
+                     sid_apt: pd.DataFrame, awy_seg: pd.DataFrame) -> pd.DataFrame:
+    """
+    Builds the table of candidate airways, in the order the sequential loaders insert them: STAR routes,
+    STAR airport links, SID routes, SID airport links and finally enroute airways.
+
+    Arguments:
+    - `star_rte` (DataFrame): parsed STAR_RTE.csv
+    - `star_apt` (DataFrame): parsed STAR_APT.csv
+    - `sid_rte` (DataFrame): parsed DP_RTE.csv
+    - `sid_apt` (DataFrame): parsed DP_APT.csv
+    - `awy_seg` (DataFrame): parsed AWY_SEG.csv
+
+    Returns:
+    A DataFrame with `EDGE_COLUMNS`.
+    """
+    tables = [
+        star_route_edges(star_rte),
+        star_airport_edges(star_apt),
+        sid_route_edges(sid_rte),
+        sid_airport_edges(sid_apt),
+        enroute_edges(awy_seg),
+    ]
+    return pd.concat(tables, ignore_index=True)
+
+
+def star_route_edges(star_rte: pd.DataFrame) -> pd.DataFrame:
+    """
+    One-way ARRIVAL edges along each STAR route, named after the route.
+    """
+    return _edges(star_rte["POINT"], star_rte["NEXT_POINT"], AirwayType.ARRIVAL, star_rte["ROUTE_NAME"], False)
+
+
+def star_airport_edges(star_apt: pd.DataFrame) -> pd.DataFrame:
+    """
+    One-way ARRIVAL edges linking the STAR body to its airport. The body name field identifies the
+    procedure waypoint: the second part of a hyphenated name, otherwise the whole name.
+    """
+    body = star_apt["BODY_NAME"]
+    star_wpt = body.where(~body.str.contains("-", regex=False, na=False), body.str.split("-").str[1])
+    return _edges(star_wpt, star_apt["ARPT_ID"], AirwayType.ARRIVAL, "", False)
+
+
+def sid_route_edges(sid_rte: pd.DataFrame) -> pd.DataFrame:
+    """
+    One-way DEPARTURE edges along each SID route, named after the procedure.
+    """
+    return _edges(sid_rte["POINT"], sid_rte["NEXT_POINT"], AirwayType.DEPARTURE, sid_rte["DP_NAME"], False)
+
+
+def sid_airport_edges(sid_apt: pd.DataFrame) -> pd.DataFrame:
+    """
+    One-way DEPARTURE edges linking an airport to its SID body. The body name field identifies the
+    procedure waypoint: the first part of a hyphenated name, otherwise the whole name.
+    """
+    body = sid_apt["BODY_NAME"]
+    dp_wpt = body.where(~body.str.contains("-", regex=False, na=False), body.str.split("-").str[0])
+    return _edges(sid_apt["ARPT_ID"], dp_wpt, AirwayType.DEPARTURE, "", False)
+
+
+def enroute_edges(awy_seg: pd.DataFrame) -> pd.DataFrame:
+    """
+    Bidirectional ENROUTE edges between consecutive airway segments.
+    """
+    return _edges(awy_seg["SEG_VALUE"], awy_seg["NEXT_SEG"], AirwayType.ENROUTE, "", True)
+
+
+def custom_edges(starts, ends) -> pd.DataFrame:
+    """
+    Bidirectional CUSTOM edges between pairs of waypoints, such as a fix and its nearest fixes.
+    """
+    return _edges(pd.Series(starts, dtype=object), pd.Series(ends, dtype=object), AirwayType.CUSTOM, "", True)
+
+
+def _edges(starts: pd.Series, ends: pd.Series, airway_type: AirwayType, names, bidirectional: bool) -> pd.DataFrame:
+    """
+    Builds edge rows of one type, dropping rows with a missing end point.
+    """
+    table = pd.DataFrame({
+        "start": starts.to_numpy(dtype=object),
+        "end": ends.to_numpy(dtype=object),
+        "airway_type": airway_type.value,
+        "name": names.to_numpy(dtype=object) if isinstance(names, pd.Series) else names,
+        "bidirectional": bidirectional,
+    })
+    table = table[table["start"].notna() & table["end"].notna()]
+
+    return table.reset_index(drop=True)
+
+
+# Per-table builders of the staged bulk build, keyed on the stage name: the waypoint tables in merge
+# order, then the airway tables in the order of `build_edge_table`.
+TABLE_STAGES = {
+    "fixes": fix_waypoints,
+    "airports": airport_waypoints,
+    "navaids": navaid_waypoints,
+    "star_rte": star_route_edges,
+    "star_apt": star_airport_edges,
+    "sid_rte": sid_route_edges,
+    "sid_apt": sid_airport_edges,
+    "awy_seg": enroute_edges,
+}
+
+
+def table_stage(task: tuple) -> tuple:
+    """
+    Parses one NASR file and builds its waypoint or airway rows. The files don't depend on each other, so
+    the stages can run in separate worker processes.
+
+    Arguments:
+    - `task` (tuple): (stage name in `TABLE_STAGES`, csv file, cache directory) tuple.
+
+    Returns:
+    A (latest NASR effective date, or "" if the file has none; table rows) tuple.
+    """
+    stage, csv_file, cache_dir = task
+    table = read_nasr_csv(csv_file, cache_dir)
+
+    eff_date = ""
+    if "EFF_DATE" in table.columns:
+        dates = table["EFF_DATE"].dropna()
+        if len(dates) > 0:
+            eff_date = str(dates.max())
+
+    return eff_date, TABLE_STAGES[stage](table)
+
+
+def resolve_directed_edges(edges: pd.DataFrame, waypoint_names, existing_pairs=()) -> pd.DataFrame:
+    """
+    Expands an edge table into the directed airway entries that `AirwayGraph.add_airway` would store,
+    in insertion order. Edges whose end points are unknown are dropped, bidirectional edges produce a
+    reverse entry, and entries for a direction that already exists (earlier in the table or in
+    `existing_pairs`) are skipped.
+
+    Arguments:
+    - `edges` (DataFrame): edge table from `build_edge_table`.
+    - `waypoint_names` (iterable): identifiers of all waypoints in the graph.
+    - `existing_pairs` (iterable, optional): (from, to) identifier pairs already in the graph.
+
+    Returns:
+    A DataFrame with columns `from`, `to` (the airway dictionary keys), `start`, `end` (the airway's
+    start and end points, which keep the source row orientation in both directions), `airway_type`,
+    `name` and `row`, the index of the source edge row.
+    """
+    names = pd.Index(list(waypoint_names), dtype=object)
+    edges = edges[edges["start"].isin(names) & edges["end"].isin(names)]
+    rows = edges.index.to_numpy()
+
+    fwd = pd.DataFrame({"from": edges["start"].to_numpy(), "to": edges["end"].to_numpy(),
+                        "order": 2 * rows, "row": rows})
+    bidir = edges[edges["bidirectional"].to_numpy(dtype=bool)]
+    bidir_rows = bidir.index.to_numpy()
+    rev = pd.DataFrame({"from": bidir["end"].to_numpy(), "to": bidir["start"].to_numpy(),
+                        "order": 2 * bidir_rows + 1, "row": bidir_rows})
+
+    directed = pd.concat([fwd, rev], ignore_index=True).sort_values("order", kind="stable")
+    directed = directed[~directed.duplicated(["from", "to"], keep="first")]
+
+    # Skip directions that are already in the graph.
+    existing_pairs = list(existing_pairs)
+    if len(existing_pairs) > 0:
+        existing = pd.MultiIndex.from_tuples(existing_pairs)
+        directed = directed[~pd.MultiIndex.from_arrays([directed["from"], directed["to"]]).isin(existing)]
+
+    source = edges.loc[directed["row"].to_numpy()]
+    return pd.DataFrame({
+        "from": directed["from"].to_numpy(),
+        "to": directed["to"].to_numpy(),
+        "start": source["start"].to_numpy(),
+        "end": source["end"].to_numpy(),
+        "airway_type": source["airway_type"].to_numpy(),
+        "name": source["name"].to_numpy(),
+        "row": directed["row"].to_numpy(),
+    })
@@ -1,13 +1,24 @@
 
+import heapq
+import math
+import time
 from queue import PriorityQueue
+from typing import TYPE_CHECKING
 
-from geographiclib.geodesic import Geodesic
+import numpy as np
 
-from airway_graph import AirwayGraph
-from map_types import AStarWaypoint
+from compiled_graph import CompiledGraph
+from geo_utils import distance_lower_bound, distance_lower_bounds, ecef_point
+from map_types import AirwayType, AStarWaypoint, SearchStats
+from search_trace import SearchTrace
 
+# The AirwayGraph module imports the pandas ingest code, which route queries on compiled graphs never use.
+if TYPE_CHECKING:
+    from airway_graph import AirwayGraph
 
-def find_best_path(graph: AirwayGraph, start_ident: str, end_ident: str, verbose=False) -> list:
+
+def find_best_path(graph: "AirwayGraph", start_ident: str, end_ident: str, verbose=False, blocked=None,
+                   stats: SearchStats = None, trace: SearchTrace = None) -> list:
     """
     Finds the best path between two identifiers in the airway graph.
 
@@ -15,6 +26,10 @@ def find_best_path(graph: AirwayGraph, start_ident: str, end_ident: str, verbose
     - `graph` (AirwayGraph): Airway graph to search on.
     - `start_ident` (str): Named fix of the start point.
     - `end_ident` (str): Named fix of the end point.
+    - `verbose` (bool, optional): print every expansion and relaxation. This is slow, use `trace` instead.
+    - `blocked` (set, optional): (start, end) identifier pairs of closed airways to skip.
+    - `stats` (SearchStats, optional): search statistics to fill in.
+    - `trace` (SearchTrace, optional): trace to record the expansions to.
     """
     # Load in the start and end waypoints.
     start_wpt = graph.get_waypoint(start_ident)
@@ -34,6 +49,14 @@ def find_best_path(graph: AirwayGraph, start_ident: str, end_ident: str, verbose
     if start_ident == end_ident:
         return [start_ident]
 
+    # Instrumentation. With no stats and no trace, the search loop only pays for the `is not None` checks.
+    perf = time.perf_counter
+    timed = stats is not None and stats.timed
+    if stats is not None:
+        query_start = perf()
+    if trace is not None:
+        trace.begin(start_ident, end_ident)
+
     # Create a priority queue of nodes to expand.
     frontier = PriorityQueue()
 
@@ -52,8 +75,10 @@ def find_best_path(graph: AirwayGraph, start_ident: str, end_ident: str, verbose
     # Keep track of the waypoint predecessors in a dictionary.
     path_dict = {}
 
-    # Geodesic is used for heuristic h(x) score.
-    geod = Geodesic.WGS84
+    # The heuristic h(x) score is a lower bound on the geodesic distance to the goal. It only depends on the
+    # waypoint, so it is computed once per waypoint and memoized for the rest of the query.
+    goal_xyz = ecef_point(end_wpt.lat, end_wpt.lon)
+    h_scores = {}
 
     # Flag for tracking if the goal was found.
     goal_found = False
@@ -61,11 +86,21 @@ def find_best_path(graph: AirwayGraph, start_ident: str, end_ident: str, verbose
     # While the frontier is non-empty and the goal waypoint hasn't been reached, expand the best point.
     while frontier.empty() is not True:
         # Get the best waypoint from the queue
+        if timed:
+            t_start = perf()
         expand_pt = frontier.get()
+        if timed:
+            stats.queue_time += perf() - t_start
 
         # Get the waypoint identifier.
         wpt_id = expand_pt.wpt.name
 
+        # Skip points that were improved upon after they were added to the frontier.
+        if expand_pt.g_val > g_scores[wpt_id]:
+            if stats is not None:
+                stats.stale_pops += 1
+            continue
+
         # If the expanded point is the end point, we are done searching.
         if wpt_id == end_wpt.name:
             goal_found = True
@@ -77,32 +112,59 @@ def find_best_path(graph: AirwayGraph, start_ident: str, end_ident: str, verbose
         if verbose:
             print(
                 f"Expanding {wpt_id} - f(x) = {expand_pt.priority}, g(x): {expand_pt.g_val}, h(x): {expand_pt.h_val}...")
+        if trace is not None:
+            trace.expand(wpt_id, expand_pt.g_val, expand_pt.h_val, frontier.qsize())
 
         # Query the graph to see all connected points for this point.
+        if timed:
+            t_start = perf()
         airways = graph.get_airways_at_waypoint(wpt_id)
+        if timed:
+            stats.lookup_time += perf() - t_start
 
         # If no airway is found, just expand the next point.
         if airways is None:
+            if stats is not None:
+                stats.nodes_expanded += 1
             continue
 
+        if stats is not None:
+            stats.nodes_expanded += 1
+            stats.edges_relaxed += len(airways)
+
         # Add all airway end points to the frontier.
         for ident in airways.keys():
+            # Skip closed airways.
+            if blocked is not None and (wpt_id, ident) in blocked:
+                continue
+
             # Create an A* point.
             astar_pt = AStarWaypoint()
 
             # Get the waypoint from the graph.
+            if timed:
+                t_start = perf()
             astar_pt.wpt = graph.get_waypoint(ident)
 
             # Get distance traveled to this point
             airway_len = airways[ident].distance
+            if timed:
+                stats.lookup_time += perf() - t_start
 
             # Compute g(x) score (distance from start to current point)
             astar_pt.g_val = expand_pt.g_val + airway_len
 
-            # Compute h(x) score (heuristic distance to go along path) using the geodesic distance
-            # between points as the heuristic.
-            g = geod.Inverse(astar_pt.wpt.lat, astar_pt.wpt.lon, end_wpt.lat, end_wpt.lon)
-            astar_pt.h_val = g['s12']
+            # Compute h(x) score (heuristic distance to go along path). The exact geodesic distance isn't
+            # needed, any lower bound keeps the path optimal, so the cheap ECEF bound is used instead.
+            if timed:
+                t_start = perf()
+            h_val = h_scores.get(ident)
+            if h_val is None:
+                h_val = distance_lower_bound(ecef_point(astar_pt.wpt.lat, astar_pt.wpt.lon), goal_xyz)
+                h_scores[ident] = h_val
+            astar_pt.h_val = h_val
+            if timed:
+                stats.heuristic_time += perf() - t_start
 
             # Compute the expansion priority as f(x) = g(x) + h(x), i.e. the minimum total path distance.
             astar_pt.priority = astar_pt.g_val + astar_pt.h_val
@@ -112,32 +174,31 @@ def find_best_path(graph: AirwayGraph, start_ident: str, end_ident: str, verbose
                 print(
                     f"{wpt_id}->{ident} - f(x) = {astar_pt.priority}, g(x) = {astar_pt.g_val}, h(x) = {astar_pt.h_val}")
 
-            # If the current point has not been visited, add its g(x) score to the g_score dictionary.
-            # This only occurs when a point does not have a previous point tracked in the path dictionary,
-            # so add the expansion point as the previous point.
-            if ident not in g_scores.keys():
+            # Add the point to the frontier if it has not been visited yet, or if this path to it is better
+            # than the one it was reached by before. In both cases the point being expanded becomes its
+            # previous point in the path dictionary, and its g(x) score is updated.
+            if ident not in g_scores or astar_pt.g_val < g_scores[ident]:
                 g_scores[ident] = astar_pt.g_val
                 path_dict[ident] = expand_pt
 
-                # Add the point to the frontier since it is new.
+                if timed:
+                    t_start = perf()
                 frontier.put(astar_pt)
-            else:
-                # Otherwise, check if the current previous point has a higher g(x) score than this one.
-                # If it does, then we update the path dictionary to track the better route to this point
-                # (via the point being expanded). Also update the g(x) dictionary to reflect the
-                # improved path.
-                if astar_pt.g_val < g_scores[ident]:
-                    g_scores[ident] = astar_pt.g_val
-                    path_dict[ident] = expand_pt
-
-                    # Add the point to the frontier since it has been improved upon.
-                    frontier.put(astar_pt)
+                if timed:
+                    stats.queue_time += perf() - t_start
+
+        if stats is not None:
+            stats.peak_frontier = max(stats.peak_frontier, frontier.qsize())
 
         # Preview queue if requested
         if verbose:
             print(f"Queue size: {frontier.qsize()}")
 
+    if stats is not None:
+        stats.total_time += perf() - query_start
+
     # If the goal was found, retrace the path.
+    path = []
     if goal_found:
         # Traverse the path from end to start
         prev_pt_id = end_wpt.name
@@ -154,9 +215,1002 @@ def find_best_path(graph: AirwayGraph, start_ident: str, end_ident: str, verbose
 
         # Reverse the path so it's in the start->end order.
         path.reverse()
+    else:
+        print("No path available")
+
+    if trace is not None:
+        trace.end(path, stats)
+
+    return path
+
+
+def find_best_path_compiled(graph: CompiledGraph, start_ident: str, end_ident: str,
+                            landmarks=None, stats: SearchStats = None, custom_airways: bool = True,
+                            blocked: np.ndarray = None, trace: SearchTrace = None, weights: np.ndarray = None,
+                            h_scale: float = 1.0) -> list:
+    """
+    Finds the best path between two identifiers in a compiled airway graph. This is the same A* search
+    as `find_best_path`, run on integer node ids with a `heapq` frontier and preallocated g(x), h(x)
+    and predecessor arrays.
+
+    Arguments:
+    - `graph` (CompiledGraph): Compiled airway graph to search on.
+    - `start_ident` (str): Named fix of the start point.
+    - `end_ident` (str): Named fix of the end point.
+    - `landmarks` (LandmarkIndex, optional): landmark distances. When provided, h(x) is the larger of
+                                             the ECEF distance bound and the landmark triangle-inequality bound.
+    - `stats` (SearchStats, optional): search statistics to fill in.
+    - `custom_airways` (bool, optional): allow the search to use CUSTOM airways between fixes.
+    - `blocked` (np.ndarray, optional): boolean mask over edge ids of closed airways to skip, such as one
+                                        built by `constraints.ConstraintSet.edge_mask`.
+    - `trace` (SearchTrace, optional): trace to record the expansions to.
+    - `weights` (np.ndarray, optional): airway costs to minimize instead of the airway lengths, indexed by
+                                        edge id, such as the flight times from `wind_model.WindCostModel`.
+    - `h_scale` (float, optional): factor converting the distance lower bounds of the heuristic into the
+                                   units of `weights`. It must keep h(x) a lower bound on the remaining cost,
+                                   for example 1 / (maximum ground speed) for flight times.
+
+    Returns:
+    The list of waypoint identifiers from start to end, or an empty list if there is no path.
+    """
+    # Look up the start and end nodes.
+    start = graph.node_id(start_ident)
+    goal = graph.node_id(end_ident)
+
+    # Check that the provided identifiers exist.
+    if start < 0:
+        print(
+            f"Error: {start_ident} start identifier is not in the waypoints database. No path available")
+        return []
+    elif goal < 0:
+        print(
+            f"Error: {end_ident} end identifier is not in the waypoints database. No path available")
+        return []
+
+    # If we are flying to/from the same point, short-circuit the search and just return that point.
+    if start == goal:
+        return [start_ident]
+
+    # Instrumentation, as in `find_best_path`.
+    perf = time.perf_counter
+    timed = stats is not None and stats.timed
+    if stats is not None:
+        query_start = perf()
+    if trace is not None:
+        trace.begin(start_ident, end_ident, graph.node_name)
+
+    # Per-query search state, indexed by node id.
+    n_nodes = graph.num_nodes
+    g_scores = [math.inf] * n_nodes
+    parents = [-1] * n_nodes
+    g_scores[start] = 0.0
+
+    # The heuristic h(x) is the ECEF lower bound on the geodesic distance to the goal (see
+    # `geo_utils.distance_lower_bound`), computed for every node in one batch from the cached ECEF
+    # coordinates. Exact geodesics are only used for reported distances.
+    if timed:
+        t_start = perf()
+    xyz = graph.ecef()
+    h_all = distance_lower_bounds(xyz, xyz[goal])
+    if landmarks is not None:
+        h_all = np.fmax(h_all, landmarks.lower_bounds(goal))
+    if h_scale != 1.0:
+        h_all = h_all * h_scale
+    h_scores = h_all.tolist()
+    if timed:
+        stats.heuristic_time += perf() - t_start
+
+    # Graph arrays, bound locally to avoid attribute lookups in the loop.
+    offsets = graph.offsets
+    targets = graph.targets
+    weights = search_weights(graph, custom_airways, blocked, weights)
+
+    # Frontier entries are (f(x), g(x), node).
+    frontier = [(0.0, 0.0, start)]
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+
+    goal_found = False
+    while frontier:
+        if timed:
+            t_start = perf()
+        f_val, g_val, node = heappop(frontier)
+        if timed:
+            stats.queue_time += perf() - t_start
+
+        # Skip entries that were superseded by a better path to the same node.
+        if g_val > g_scores[node]:
+            if stats is not None:
+                stats.stale_pops += 1
+            continue
+
+        if node == goal:
+            goal_found = True
+            break
+
+        if trace is not None:
+            trace.expand(node, g_val, f_val - g_val, len(frontier))
+
+        if timed:
+            t_start = perf()
+        lo = offsets[node]
+        hi = offsets[node + 1]
+        nbrs = zip(targets[lo:hi].tolist(), weights[lo:hi].tolist())
+        if timed:
+            stats.lookup_time += perf() - t_start
+        if stats is not None:
+            stats.nodes_expanded += 1
+            stats.edges_relaxed += int(hi - lo)
+
+        for nbr, airway_len in nbrs:
+            nbr_g = g_val + airway_len
+            if nbr_g < g_scores[nbr]:
+                g_scores[nbr] = nbr_g
+                parents[nbr] = node
+
+                # An infinite bound means the goal is unreachable from this node.
+                h_val = h_scores[nbr]
+                if h_val < math.inf:
+                    if timed:
+                        t_start = perf()
+                    heappush(frontier, (nbr_g + h_val, nbr_g, nbr))
+                    if timed:
+                        stats.queue_time += perf() - t_start
+
+        if stats is not None and len(frontier) > stats.peak_frontier:
+            stats.peak_frontier = len(frontier)
+
+    if stats is not None:
+        stats.total_time += perf() - query_start
+
+    path = []
+    if goal_found:
+        # Retrace the path from end to start.
+        nodes = [goal]
+        while nodes[-1] != start:
+            nodes.append(parents[nodes[-1]])
+        nodes.reverse()
+        path = [graph.node_name(node) for node in nodes]
+    else:
+        print("No path available")
+
+    if trace is not None:
+        trace.end(path, stats)
+
+    return path
+
+
+def search_weights(graph: CompiledGraph, custom_airways: bool = True, blocked: np.ndarray = None,
+                   weights: np.ndarray = None) -> np.ndarray:
+    """
+    Get the airway lengths to search with. Disabled and closed airways get an infinite length, so they
+    never improve a path. Only the weights are replaced, the graph is left untouched.
+
+    Arguments:
+    - `graph` (CompiledGraph): Compiled airway graph to search on.
+    - `custom_airways` (bool, optional): allow the search to use CUSTOM airways between fixes.
+    - `blocked` (np.ndarray, optional): boolean mask over edge ids of closed airways.
+    - `weights` (np.ndarray, optional): airway costs to use instead of the airway lengths.
+
+    Returns:
+    The airway lengths in meters (or the given costs), indexed by edge id.
+    """
+    if weights is None:
+        weights = graph.weights
+    if not custom_airways:
+        custom = graph.airway_type == AirwayType.CUSTOM.value
+        blocked = custom if blocked is None else (blocked | custom)
+    if blocked is None:
+        return weights
+
+    return np.where(blocked, np.inf, weights)
+
+
+def find_best_path_bidirectional(graph: CompiledGraph, start_ident: str, end_ident: str, landmarks=None,
+                                 stats: SearchStats = None, custom_airways: bool = True,
+                                 blocked: np.ndarray = None, weights: np.ndarray = None,
+                                 h_scale: float = 1.0) -> list:
+    """
+    Finds the best path between two identifiers with bidirectional A*. One search runs forward from the
+    start along the airways and one runs backward from the end along the reverse adjacency, so one-way
+    DEPARTURE and ARRIVAL airways are only followed in their own direction. Both searches use the
+    average potential p(x) = (h_end(x) - h_start(x)) / 2, where h_end and h_start are lower bounds on the
+    distance to the end and from the start. This gives both searches the same reduced airway lengths, so
+    the path is optimal once the two smallest frontier keys add up to at least the best meeting distance.
+
+    Arguments: same as `find_best_path_compiled`.
+
+    Returns:
+    The list of waypoint identifiers from start to end, or an empty list if there is no path.
+    """
+    # Look up the start and end nodes.
+    start = graph.node_id(start_ident)
+    goal = graph.node_id(end_ident)
+
+    # Check that the provided identifiers exist.
+    if start < 0:
+        print(
+            f"Error: {start_ident} start identifier is not in the waypoints database. No path available")
+        return []
+    elif goal < 0:
+        print(
+            f"Error: {end_ident} end identifier is not in the waypoints database. No path available")
+        return []
+
+    # If we are flying to/from the same point, short-circuit the search and just return that point.
+    if start == goal:
+        return [start_ident]
+
+    if stats is not None:
+        query_start = time.perf_counter()
+
+    # Forward (index 0) and backward (index 1) adjacency.
+    n_nodes = graph.num_nodes
+    weights = search_weights(graph, custom_airways, blocked, weights)
+    rev_offsets, rev_sources, rev_edges = graph.reverse_adjacency()
+    adjacency = ((graph.offsets, graph.targets, weights), (rev_offsets, rev_sources, weights[rev_edges]))
+
+    # Lower bounds on the distance to the end (index 0) and from the start (index 1), computed for every
+    # node in one batch like `find_best_path_compiled`.
+    xyz = graph.ecef()
+    to_goal = distance_lower_bounds(xyz, xyz[goal])
+    from_start = distance_lower_bounds(xyz, xyz[start])
+    if landmarks is not None:
+        to_goal = np.fmax(to_goal, landmarks.lower_bounds(goal))
+        from_start = np.fmax(from_start, landmarks.lower_bounds_from(start))
+    if h_scale != 1.0:
+        to_goal = to_goal * h_scale
+        from_start = from_start * h_scale
+    bounds = (to_goal.tolist(), from_start.tolist())
+
+    def potential(node: int) -> float:
+        # Forward potential. The backward potential is its negative.
+        h_end = bounds[0][node]
+        h_start = bounds[1][node]
+        return (h_end - h_start) / 2.0 if h_end < math.inf and h_start < math.inf else 0.0
+
+    # Per-query search state, indexed by node id. Frontier entries are (key, distance, node).
+    dist = ([math.inf] * n_nodes, [math.inf] * n_nodes)
+    parents = ([-1] * n_nodes, [-1] * n_nodes)
+    dist[0][start] = 0.0
+    dist[1][goal] = 0.0
+    frontiers = ([(potential(start), 0.0, start)], [(-potential(goal), 0.0, goal)])
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+
+    best = math.inf
+    meet = -1
+    while True:
+        fwd_top = frontiers[0][0][0] if frontiers[0] else math.inf
+        bwd_top = frontiers[1][0][0] if frontiers[1] else math.inf
+        if fwd_top + bwd_top >= best:
+            break
+        side = 0 if fwd_top <= bwd_top else 1
+
+        _, d_val, node = heappop(frontiers[side])
 
-        return path
+        # Skip entries that were superseded by a better path to the same node.
+        if d_val > dist[side][node]:
+            if stats is not None:
+                stats.stale_pops += 1
+            continue
+
+        offsets, others, side_weights = adjacency[side]
+        lo = offsets[node]
+        hi = offsets[node + 1]
+        if stats is not None:
+            stats.nodes_expanded += 1
+            stats.edges_relaxed += int(hi - lo)
+
+        side_dist = dist[side]
+        other_dist = dist[1 - side]
+        for nbr, airway_len in zip(others[lo:hi].tolist(), side_weights[lo:hi].tolist()):
+            nbr_d = d_val + airway_len
+            if nbr_d < side_dist[nbr]:
+                # An infinite bound means the other end is unreachable through this node.
+                if bounds[side][nbr] == math.inf:
+                    continue
+
+                side_dist[nbr] = nbr_d
+                parents[side][nbr] = node
+
+                # Check for a meeting point with the other search.
+                if nbr_d + other_dist[nbr] < best:
+                    best = nbr_d + other_dist[nbr]
+                    meet = nbr
+
+                p_val = potential(nbr)
+                heappush(frontiers[side], (nbr_d + (p_val if side == 0 else -p_val), nbr_d, nbr))
+
+        if stats is not None:
+            stats.peak_frontier = max(stats.peak_frontier, len(frontiers[0]) + len(frontiers[1]))
+
+    if stats is not None:
+        stats.total_time += time.perf_counter() - query_start
+
+    if meet < 0:
+        print("No path available")
+        return []
+
+    # Retrace the path from the meeting point back to the start, then forward to the end.
+    path = [meet]
+    while path[-1] != start:
+        path.append(parents[0][path[-1]])
+    path.reverse()
+    while path[-1] != goal:
+        path.append(parents[1][path[-1]])
+
+    return [graph.node_name(node) for node in path]
+
+
+def shortest_path_tree(graph: CompiledGraph, source: int, reverse=False, weights: np.ndarray = None) -> tuple:
+    """
+    Runs Dijkstra's algorithm from one node over the whole compiled graph.
+
+    Arguments:
+    - `graph` (CompiledGraph): Compiled airway graph to search on.
+    - `source` (int): node id to search from.
+    - `reverse` (bool, optional): search the reversed airways, giving distances from every node to
+                                  `source` instead of from `source` to every node.
+    - `weights` (np.ndarray, optional): airway lengths to use instead of the graph's, indexed by edge id,
+                                        such as the ones returned by `search_weights`.
 
+    Returns:
+    A (distances, parents) tuple of arrays indexed by node id. Unreachable nodes have an infinite
+    distance and a parent of -1.
+    """
+    if weights is None:
+        weights = graph.weights
+    if reverse:
+        offsets, targets, edges = graph.reverse_adjacency()
+        weights = weights[edges]
     else:
+        offsets = graph.offsets
+        targets = graph.targets
+
+    n_nodes = graph.num_nodes
+    dist = [math.inf] * n_nodes
+    parents = [-1] * n_nodes
+    dist[source] = 0.0
+
+    frontier = [(0.0, source)]
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+    while frontier:
+        d_val, node = heappop(frontier)
+        if d_val > dist[node]:
+            continue
+
+        lo = offsets[node]
+        hi = offsets[node + 1]
+        for nbr, airway_len in zip(targets[lo:hi].tolist(), weights[lo:hi].tolist()):
+            nbr_d = d_val + airway_len
+            if nbr_d < dist[nbr]:
+                dist[nbr] = nbr_d
+                parents[nbr] = node
+                heappush(frontier, (nbr_d, nbr))
+
+    return np.array(dist, dtype=np.float64), np.array(parents, dtype=np.int32)
+
+
+def find_k_best_paths(graph: CompiledGraph, start_ident: str, end_ident: str, k: int = 3,
+                      stats: SearchStats = None, custom_airways: bool = True, blocked: np.ndarray = None,
+                      weights: np.ndarray = None) -> list:
+    """
+    Finds the k shortest loopless paths between two identifiers with Yen's algorithm, for alternate routes.
+
+    Each path after the first deviates from an earlier path at a spur node: the route follows the earlier
+    path up to the spur node, then takes the shortest path to the end that neither leaves the spur node
+    along an airway used by an earlier path with the same prefix, nor revisits the prefix. The searches
+    share work in three ways:
+    - One reverse shortest path tree from the end gives the exact distance to the end in the full graph.
+      It is the first path, and the A* heuristic of every spur search. Removing airways only makes paths
+      longer, so it stays admissible, and the spur searches rarely leave the tree.
+    - Prefix distances are read from the earlier path instead of being searched again.
+    - Only the spur nodes after the point where a path deviated from its parent are searched (Lawler's
+      improvement), since the earlier ones were searched when the parent was found.
+
+    Arguments:
+    - `graph` (CompiledGraph): Compiled airway graph to search on.
+    - `start_ident` (str): Named fix of the start point.
+    - `end_ident` (str): Named fix of the end point.
+    - `k` (int, optional): number of paths to find.
+    - `stats` (SearchStats, optional): search statistics to fill in, summed over the spur searches.
+    - `custom_airways` (bool, optional): allow the search to use CUSTOM airways between fixes.
+    - `blocked` (np.ndarray, optional): boolean mask over edge ids of closed airways to skip.
+    - `weights` (np.ndarray, optional): airway costs to minimize instead of the airway lengths.
+
+    Returns:
+    A list of up to k (path, distance) tuples in order of increasing distance, where each path is a list of
+    waypoint identifiers and the distance is in meters (or the units of `weights`). The list is empty if
+    there is no path.
+    """
+    # Look up the start and end nodes.
+    start = graph.node_id(start_ident)
+    goal = graph.node_id(end_ident)
+
+    # Check that the provided identifiers exist.
+    if start < 0:
+        print(
+            f"Error: {start_ident} start identifier is not in the waypoints database. No path available")
+        return []
+    elif goal < 0:
+        print(
+            f"Error: {end_ident} end identifier is not in the waypoints database. No path available")
+        return []
+
+    # If we are flying to/from the same point, short-circuit the search and just return that point.
+    if start == goal:
+        return [([start_ident], 0.0)]
+
+    if stats is not None:
+        query_start = time.perf_counter()
+
+    # 1. Distance from every node to the end, and the next node on its shortest path.
+    weights = search_weights(graph, custom_airways, blocked, weights)
+    to_goal, next_hop = shortest_path_tree(graph, goal, reverse=True, weights=weights)
+    to_goal = to_goal.tolist()
+    next_hop = next_hop.tolist()
+    if to_goal[start] == math.inf:
+        print("No path available")
+        return []
+
+    offsets = graph.offsets
+    targets = graph.targets
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+
+    def spur_path(spur: int, removed_nodes: set, removed_next: set) -> tuple:
+        # A* from the spur node to the end, avoiding the removed nodes and the removed first airways.
+        # Returns the path and the distance from the spur node to each node on it.
+        g_scores = {spur: 0.0}
+        parents = {}
+        frontier = [(to_goal[spur], 0.0, spur)]
+        while frontier:
+            _, g_val, node = heappop(frontier)
+            if g_val > g_scores[node]:
+                if stats is not None:
+                    stats.stale_pops += 1
+                continue
+            if node == goal:
+                path = [goal]
+                while path[-1] != spur:
+                    path.append(parents[path[-1]])
+                path.reverse()
+                return path, [g_scores[node] for node in path]
+
+            lo = offsets[node]
+            hi = offsets[node + 1]
+            if stats is not None:
+                stats.nodes_expanded += 1
+                stats.edges_relaxed += int(hi - lo)
+
+            for nbr, airway_len in zip(targets[lo:hi].tolist(), weights[lo:hi].tolist()):
+                if nbr in removed_nodes or (node == spur and nbr in removed_next) or to_goal[nbr] == math.inf:
+                    continue
+                nbr_g = g_val + airway_len
+                if nbr_g < g_scores.get(nbr, math.inf):
+                    g_scores[nbr] = nbr_g
+                    parents[nbr] = node
+                    heappush(frontier, (nbr_g + to_goal[nbr], nbr_g, nbr))
+
+            if stats is not None and len(frontier) > stats.peak_frontier:
+                stats.peak_frontier = len(frontier)
+
+        return None, None
+
+    # 2. The first path follows the shortest path tree. Paths are stored as (nodes, distance from the start
+    # to each node, deviation index).
+    nodes = [start]
+    while nodes[-1] != goal:
+        nodes.append(next_hop[nodes[-1]])
+    found = [(nodes, [to_goal[start] - to_goal[node] for node in nodes], 0)]
+
+    # Next nodes taken after each path prefix by the paths found so far.
+    branches = {}
+
+    def add_branches(path: list):
+        for i in range(len(path) - 1):
+            branches.setdefault(tuple(path[:i + 1]), set()).add(path[i + 1])
+
+    add_branches(nodes)
+
+    # 3. Candidate paths, as (distance, nodes, cumulative distances, deviation index) entries.
+    candidates = []
+    seen = {tuple(nodes)}
+    while len(found) < k:
+        prev_nodes, prev_cumulative, deviation = found[-1]
+        for i in range(deviation, len(prev_nodes) - 1):
+            spur = prev_nodes[i]
+            root = prev_nodes[:i + 1]
+            path, spur_cumulative = spur_path(spur, set(root[:-1]), branches[tuple(root)])
+            if path is None:
+                continue
+
+            candidate = root[:-1] + path
+            key = tuple(candidate)
+            if key not in seen:
+                seen.add(key)
+                cumulative = prev_cumulative[:i] + [prev_cumulative[i] + dist for dist in spur_cumulative]
+                heappush(candidates, (cumulative[-1], candidate, cumulative, i))
+
+        if not candidates:
+            break
+
+        _, nodes, cumulative, deviation = heappop(candidates)
+        found.append((nodes, cumulative, deviation))
+        add_branches(nodes)
+
+    if stats is not None:
+        stats.total_time += time.perf_counter() - query_start
+
+    return [([graph.node_name(node) for node in nodes], cumulative[-1]) for nodes, cumulative, _ in found]
+
+
+def find_best_path_ch(graph: CompiledGraph, ch, start_ident: str, end_ident: str, stats: SearchStats = None) -> list:
+    """
+    Finds the best path between two identifiers with a contraction hierarchy. Dijkstra searches run
+    upward in the hierarchy from both the start and the end until neither can improve on the best
+    meeting point, then shortcuts on the resulting path are unpacked back into the original waypoints.
+
+    Arguments:
+    - `graph` (CompiledGraph): Compiled airway graph the hierarchy was built for.
+    - `ch` (ContractionHierarchy): Contraction hierarchy of the graph.
+    - `start_ident` (str): Named fix of the start point.
+    - `end_ident` (str): Named fix of the end point.
+    - `stats` (SearchStats, optional): search statistics to fill in.
+
+    Returns:
+    The list of waypoint identifiers from start to end, or an empty list if there is no path.
+    """
+    # Look up the start and end nodes.
+    start = graph.node_id(start_ident)
+    goal = graph.node_id(end_ident)
+
+    # Check that the provided identifiers exist.
+    if start < 0:
+        print(
+            f"Error: {start_ident} start identifier is not in the waypoints database. No path available")
+        return []
+    elif goal < 0:
+        print(
+            f"Error: {end_ident} end identifier is not in the waypoints database. No path available")
+        return []
+
+    # If we are flying to/from the same point, short-circuit the search and just return that point.
+    if start == goal:
+        return [start_ident]
+
+    if stats is not None:
+        query_start = time.perf_counter()
+
+    # Search state for the forward (index 0) and backward (index 1) searches. Parents are stored as
+    # (node, middle) pairs describing the hierarchy edge used to reach a node.
+    dist = ({start: 0.0}, {goal: 0.0})
+    parents = ({start: (-1, -1)}, {goal: (-1, -1)})
+    frontiers = ([(0.0, start)], [(0.0, goal)])
+    adjacency = ((ch.up_offsets, ch.up_targets, ch.up_weights, ch.up_middle),
+                 (ch.down_offsets, ch.down_sources, ch.down_weights, ch.down_middle))
+
+    best = math.inf
+    meet = -1
+    while True:
+        # Each search stops once its smallest key cannot improve on the best meeting point.
+        fwd_top = frontiers[0][0][0] if frontiers[0] else math.inf
+        bwd_top = frontiers[1][0][0] if frontiers[1] else math.inf
+        if min(fwd_top, bwd_top) >= best:
+            break
+        side = 0 if fwd_top <= bwd_top else 1
+
+        d_val, node = heapq.heappop(frontiers[side])
+        if d_val > dist[side][node]:
+            if stats is not None:
+                stats.stale_pops += 1
+            continue
+
+        # Check for a meeting point with the other search.
+        other_d = dist[1 - side].get(node)
+        if other_d is not None and d_val + other_d < best:
+            best = d_val + other_d
+            meet = node
+
+        # Stall-on-demand: if a higher ranked node already reached by this search has an edge into this
+        # node that gives a shorter distance, this node is not on a shortest path and need not be expanded.
+        offsets, others, weights, _ = adjacency[1 - side]
+        lo = offsets[node]
+        hi = offsets[node + 1]
+        stalled = False
+        for nbr, airway_len in zip(others[lo:hi].tolist(), weights[lo:hi].tolist()):
+            if dist[side].get(nbr, math.inf) + airway_len < d_val:
+                stalled = True
+                break
+        if stalled:
+            continue
+
+        offsets, others, weights, middles = adjacency[side]
+        lo = offsets[node]
+        hi = offsets[node + 1]
+        if stats is not None:
+            stats.nodes_expanded += 1
+            stats.edges_relaxed += int(hi - lo)
+
+        for nbr, airway_len, middle in zip(others[lo:hi].tolist(), weights[lo:hi].tolist(), middles[lo:hi].tolist()):
+            nbr_d = d_val + airway_len
+            if nbr_d < dist[side].get(nbr, math.inf):
+                dist[side][nbr] = nbr_d
+                parents[side][nbr] = (node, middle)
+                heapq.heappush(frontiers[side], (nbr_d, nbr))
+
+        if stats is not None:
+            stats.peak_frontier = max(stats.peak_frontier, len(frontiers[0]) + len(frontiers[1]))
+
+    if stats is not None:
+        stats.total_time += time.perf_counter() - query_start
+
+    if meet < 0:
+        print("No path available")
+        return []
+
+    # Walk the forward search back from the meeting point to the start, unpacking each edge.
+    fwd_edges = []
+    node = meet
+    while node != start:
+        prev, middle = parents[0][node]
+        fwd_edges.append((prev, node, middle))
+        node = prev
+    fwd_edges.reverse()
+
+    path = [start]
+    for prev, node, middle in fwd_edges:
+        path.extend(ch.unpack_edge(prev, node, middle))
+
+    # Walk the backward search from the meeting point to the end.
+    node = meet
+    while node != goal:
+        nxt, middle = parents[1][node]
+        path.extend(ch.unpack_edge(node, nxt, middle))
+        node = nxt
+
+    return [graph.node_name(node) for node in path]
+
+
+def find_airport_route(graph: CompiledGraph, procedures, start_ident: str, end_ident: str, stats: SearchStats = None,
+                       custom_airways: bool = True, blocked: np.ndarray = None,
+                       blocked_procedures: dict = None, trace: SearchTrace = None) -> tuple:
+    """
+    A* search between airports that leaves and joins the airway network through the airports' departure and
+    arrival procedures. Every departure option of the start airport seeds the search at the fix where it
+    ends, with the distance flown along the procedure, and every arrival option of the end airport finishes
+    the search from the fix where it starts. Airports without procedures are searched from and to directly,
+    so other waypoints can be used too.
+
+    Arguments:
+    - `graph` (CompiledGraph): Compiled airway graph to search on.
+    - `procedures` (ProcedureIndex): departure and arrival procedures of the graph's airports.
+    - `start_ident` (str): Identifier of the departure airport or starting waypoint.
+    - `end_ident` (str): Identifier of the arrival airport or ending waypoint.
+    - `stats` (SearchStats, optional): statistics to add the search counts to.
+    - `custom_airways` (bool, optional): allow the search to use CUSTOM airways between fixes.
+    - `blocked` (np.ndarray, optional): boolean mask over edge ids of closed airways to skip.
+    - `blocked_procedures` (dict, optional): boolean masks over the "departures" and "arrivals" option ids of
+                                             closed procedures to skip, such as the ones built by
+                                             `constraints.ConstraintSet.procedure_mask`. Procedures are not
+                                             airways, so `blocked` doesn't close them.
+    - `trace` (SearchTrace, optional): trace to record the expansions to.
+
+    Returns:
+    A (path, departure, arrival) tuple: the list of waypoint identifiers from start to end (empty if there is
+    no path), and the `TerminalProcedure` flown at each end, or `None` where the route doesn't fly one.
+    """
+    # Look up the start and end nodes.
+    start = graph.node_id(start_ident)
+    goal = graph.node_id(end_ident)
+
+    # Check that the provided identifiers exist.
+    if start < 0:
+        print(
+            f"Error: {start_ident} start identifier is not in the waypoints database. No path available")
+        return [], None, None
+    elif goal < 0:
+        print(
+            f"Error: {end_ident} end identifier is not in the waypoints database. No path available")
+        return [], None, None
+
+    # If we are flying to/from the same point, short-circuit the search and just return that point.
+    if start == goal:
+        return [start_ident], None, None
+
+    if stats is not None:
+        query_start = time.perf_counter()
+    if trace is not None:
+        trace.begin(start_ident, end_ident, graph.node_name)
+
+    # Per-query search state, indexed by node id. Nodes reached through a departure have the parent
+    # -2 - (departure option id).
+    n_nodes = graph.num_nodes
+    g_scores = [math.inf] * n_nodes
+    parents = [-1] * n_nodes
+
+    xyz = graph.ecef()
+    h_scores = distance_lower_bounds(xyz, xyz[goal]).tolist()
+    offsets = graph.offsets
+    targets = graph.targets
+    weights = search_weights(graph, custom_airways, blocked)
+
+    # Frontier entries are (f(x), g(x), node).
+    frontier = [(h_scores[start], 0.0, start)]
+    g_scores[start] = 0.0
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+
+    if blocked_procedures is None:
+        blocked_procedures = {}
+    dep_blocked = blocked_procedures.get("departures")
+    arr_blocked = blocked_procedures.get("arrivals")
+
+    # 1. Seed the frontier with the fix at the end of every open departure option.
+    departures = procedures.tables["departures"]
+    dep_lo, dep_hi = procedures.option_range("departures", start)
+    for option, (exit_node, cost) in enumerate(zip(departures["nodes"][dep_lo:dep_hi].tolist(),
+                                                   departures["cost"][dep_lo:dep_hi].tolist()), dep_lo):
+        if dep_blocked is not None and dep_blocked[option]:
+            continue
+        if cost < g_scores[exit_node] and h_scores[exit_node] < math.inf:
+            g_scores[exit_node] = cost
+            parents[exit_node] = -2 - option
+            heappush(frontier, (cost + h_scores[exit_node], cost, exit_node))
+
+    # 2. Map the fix at the start of every open arrival option to its options. Flying an arrival is like an
+    # airway from its first fix to the goal. The straight-line bound to the goal stays a lower bound,
+    # since no arrival is shorter than the straight line.
+    arrivals = procedures.tables["arrivals"]
+    arr_lo, arr_hi = procedures.option_range("arrivals", goal)
+    arrival_options = {}
+    for option, (entry_node, cost) in enumerate(zip(arrivals["nodes"][arr_lo:arr_hi].tolist(),
+                                                    arrivals["cost"][arr_lo:arr_hi].tolist()), arr_lo):
+        if arr_blocked is not None and arr_blocked[option]:
+            continue
+        arrival_options.setdefault(entry_node, []).append((cost, option))
+    goal_arrival = -1
+
+    goal_found = False
+    while frontier:
+        f_val, g_val, node = heappop(frontier)
+
+        # Skip entries that were superseded by a better path to the same node.
+        if g_val > g_scores[node]:
+            if stats is not None:
+                stats.stale_pops += 1
+            continue
+
+        if node == goal:
+            goal_found = True
+            break
+
+        if trace is not None:
+            trace.expand(node, g_val, f_val - g_val, len(frontier))
+
+        lo = offsets[node]
+        hi = offsets[node + 1]
+        nbrs = list(zip(targets[lo:hi].tolist(), weights[lo:hi].tolist()))
+        if stats is not None:
+            stats.nodes_expanded += 1
+            stats.edges_relaxed += len(nbrs)
+
+        for nbr, airway_len in nbrs:
+            nbr_g = g_val + airway_len
+            if nbr_g < g_scores[nbr]:
+                g_scores[nbr] = nbr_g
+                parents[nbr] = node
+                if nbr == goal:
+                    goal_arrival = -1
+
+                # An infinite bound means the goal is unreachable from this node.
+                h_val = h_scores[nbr]
+                if h_val < math.inf:
+                    heappush(frontier, (nbr_g + h_val, nbr_g, nbr))
+
+        # Finish through the arrivals that start here.
+        for cost, option in arrival_options.get(node, ()):
+            goal_g = g_val + cost
+            if goal_g < g_scores[goal]:
+                g_scores[goal] = goal_g
+                parents[goal] = node
+                goal_arrival = option
+                heappush(frontier, (goal_g, goal_g, goal))
+
+        if stats is not None and len(frontier) > stats.peak_frontier:
+            stats.peak_frontier = len(frontier)
+
+    if stats is not None:
+        stats.total_time += time.perf_counter() - query_start
+
+    if not goal_found:
         print("No path available")
+        if trace is not None:
+            trace.end([], stats)
+        return [], None, None
+
+    # Retrace the path from end to start, through the arrival and departure flown.
+    nodes = [goal]
+    arrival = None
+    if goal_arrival >= 0:
+        arrival = procedures.procedure(graph, "arrivals", goal_arrival)
+        nodes = procedures.option_path("arrivals", goal_arrival).tolist()[::-1]
+    departure = None
+    while nodes[-1] != start:
+        parent = parents[nodes[-1]]
+        if parent <= -2:
+            departure = procedures.procedure(graph, "departures", -2 - parent)
+            nodes.extend(procedures.option_path("departures", -2 - parent).tolist()[-2::-1])
+        else:
+            nodes.append(parent)
+    nodes.reverse()
+    path = [graph.node_name(node) for node in nodes]
+
+    if trace is not None:
+        trace.end(path, stats)
+
+    return path, departure, arrival
+
+
+def find_best_path_tiled(tiled, start_ident: str, end_ident: str, stats: SearchStats = None,
+                         custom_airways: bool = True) -> list:
+    """
+    A* search over a `tiled_graph.TiledGraph`. The search is the same as `find_best_path_compiled`, and
+    finds the same routes, but only the tiles of the waypoints it expands are loaded. Waypoints across a
+    tile boundary are reached through the backbone airways, whose end point coordinates give the
+    heuristic without loading the tile on the other side.
+
+    Arguments:
+    - `tiled` (TiledGraph): tiled airway graph to search on.
+    - `start_ident` (str): Identifier of the starting waypoint.
+    - `end_ident` (str): Identifier of the ending waypoint.
+    - `stats` (SearchStats, optional): statistics to add the search counts to.
+    - `custom_airways` (bool, optional): allow the search to use CUSTOM airways between fixes.
+
+    Returns:
+    The list of waypoint identifiers from start to end, or an empty list if there is no path.
+    """
+    # Look up the start and end nodes.
+    start = tiled.node_id(start_ident)
+    goal = tiled.node_id(end_ident)
+
+    # Check that the provided identifiers exist.
+    if start < 0:
+        print(
+            f"Error: {start_ident} start identifier is not in the waypoints database. No path available")
         return []
+    elif goal < 0:
+        print(
+            f"Error: {end_ident} end identifier is not in the waypoints database. No path available")
+        return []
+
+    # If we are flying to/from the same point, short-circuit the search and just return that point.
+    if start == goal:
+        return [start_ident]
+
+    if stats is not None:
+        query_start = time.perf_counter()
+
+    # Per-query search state. Only the waypoints the search reaches get an entry, so the state grows with
+    # the working set like the loaded tiles do.
+    g_scores = {start: 0.0}
+    parents = {}
+
+    # Heuristic bounds for the backbone airway ends, in the order of the backbone airways.
+    goal_xyz = tiled.tile(int(tiled.node_tile[goal])).xyz[tiled.node_local[goal]]
+    backbone_h = distance_lower_bounds(tiled.backbone_xyz, goal_xyz).tolist()
+
+    # Backbone arrays as lists, for the search loop. The backbone is small compared to the tiles.
+    backbone_targets = tiled.backbone_targets.tolist()
+    backbone_tile = tiled.backbone_tile.tolist()
+    backbone_local = tiled.backbone_local.tolist()
+    backbone_weights = tiled.backbone_weights
+    if not custom_airways:
+        backbone_weights = np.where(tiled.backbone_type == AirwayType.CUSTOM.value, np.inf, backbone_weights)
+    backbone_weights = backbone_weights.tolist()
+
+    # Frontier entries are (f(x), g(x), node, tile, local index in the tile).
+    start_tile = int(tiled.node_tile[start])
+    frontier = [(0.0, 0.0, start, start_tile, int(tiled.node_local[start]))]
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+
+    tile_id = -1
+    goal_found = False
+    while frontier:
+        f_val, g_val, node, node_tile, local = heappop(frontier)
+
+        # Skip entries that were superseded by a better path to the same node.
+        if g_val > g_scores[node]:
+            if stats is not None:
+                stats.stale_pops += 1
+            continue
+
+        if node == goal:
+            goal_found = True
+            break
+
+        # Load the node's tile if the search moved to another tile.
+        if node_tile != tile_id:
+            tile_id = node_tile
+            node_list, offsets, backbone_offsets, targets, tile_weights, h_scores = \
+                tiled.tile(tile_id).search_view(goal, goal_xyz, custom_airways)
+
+        # Airways inside the tile. An infinite bound means the goal is unreachable from a node.
+        lo = offsets[local]
+        hi = offsets[local + 1]
+        for nbr, airway_len in zip(targets[lo:hi].tolist(), tile_weights[lo:hi].tolist()):
+            nbr_g = g_val + airway_len
+            nbr_id = node_list[nbr]
+            if nbr_g < g_scores.get(nbr_id, math.inf):
+                g_scores[nbr_id] = nbr_g
+                parents[nbr_id] = node
+                h_val = h_scores[nbr]
+                if h_val < math.inf:
+                    heappush(frontier, (nbr_g + h_val, nbr_g, nbr_id, tile_id, nbr))
+
+        # Airways leaving the tile.
+        bb_lo = backbone_offsets[local]
+        bb_hi = backbone_offsets[local + 1]
+        if bb_hi > bb_lo:
+            for bb in range(bb_lo, bb_hi):
+                nbr_g = g_val + backbone_weights[bb]
+                nbr_id = backbone_targets[bb]
+                if nbr_g < g_scores.get(nbr_id, math.inf):
+                    g_scores[nbr_id] = nbr_g
+                    parents[nbr_id] = node
+                    h_val = backbone_h[bb]
+                    if h_val < math.inf:
+                        heappush(frontier, (nbr_g + h_val, nbr_g, nbr_id, backbone_tile[bb], backbone_local[bb]))
+
+        if stats is not None:
+            stats.nodes_expanded += 1
+            stats.edges_relaxed += (hi - lo) + (bb_hi - bb_lo)
+
+        if stats is not None and len(frontier) > stats.peak_frontier:
+            stats.peak_frontier = len(frontier)
+
+    if stats is not None:
+        stats.total_time += time.perf_counter() - query_start
+
+    path = []
+    if goal_found:
+        # Retrace the path from end to start.
+        nodes = [goal]
+        while nodes[-1] != start:
+            nodes.append(parents[nodes[-1]])
+        nodes.reverse()
+        path = [tiled.node_name(node) for node in nodes]
+    else:
+        print("No path available")
+
+    return path
+
+
+def path_distance(graph: CompiledGraph, path: list, weights: np.ndarray = None) -> float:
+    """
+    Computes the total airway distance of a path.
+
+    Arguments:
+    - `graph` (CompiledGraph): Compiled airway graph.
+    - `path` (list): waypoint identifiers along the path.
+    - `weights` (np.ndarray, optional): airway costs to add up instead of the airway lengths.
+
+    Returns:
+    The distance in meters (or the total cost), or infinity if consecutive waypoints are not connected by
+    an airway.
+    """
+    if weights is None:
+        weights = graph.weights
+    total = 0.0
+    nodes = [graph.node_id(ident) for ident in path]
+    for node, nxt in zip(nodes, nodes[1:]):
+        lo, hi = graph.edge_range(node)
+        matches = np.flatnonzero(graph.targets[lo:hi] == nxt)
+        if len(matches) == 0:
+            return math.inf
+        total += float(weights[lo + matches[0]])
+
+    return total
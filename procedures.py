@@ -0,0 +1,302 @@
+import argparse
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from compiled_graph import CompiledGraph, StringTable
+from geo_utils import METERS_PER_NM, geodesic_distances
+from graph_file import load_graph
+from map_types import TerminalProcedure
+
+# pandas is only needed to build the index from the NASR files, so route queries don't import it.
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Arrays stored for the departures and for the arrivals.
+_TABLE_KEYS = ["offsets", "nodes", "cost", "path_offsets", "path", "name_ids", "runway_ids"]
+
+
+class ProcedureIndex:
+    """
+    Departure (SID) and arrival (STAR) procedures of every airport, with their transitions.
+
+    Each option is a complete flown path between the airport and the en-route fix where the procedure
+    ends (departures) or starts (arrivals): the procedure body followed or preceded by one of its
+    transitions, or the body alone. Options are stored as CSR over the node ids, so the options of an
+    airport are found with one lookup. For each option the index keeps the en-route fix, the distance
+    along the path, the path itself, the procedure or transition computer code and the runway ends.
+
+    NASR lists procedure points from the en-route end backward for departures and forward from the
+    en-route end for arrivals, both in increasing `POINT_SEQ`; the paths here are in the order flown.
+    """
+
+    def __init__(self, names: StringTable, departures: dict, arrivals: dict):
+        """
+        Arguments:
+        - `names` (StringTable): procedure computer codes and runway lists.
+        - `departures` (dict): departure arrays, keyed by the names in `_TABLE_KEYS`.
+        - `arrivals` (dict): arrival arrays, keyed by the names in `_TABLE_KEYS`.
+        """
+        self.names = names
+        self.tables = {"departures": departures, "arrivals": arrivals}
+
+    @classmethod
+    def build(cls, graph: CompiledGraph, sid_rte: "pd.DataFrame", sid_apt: "pd.DataFrame",
+              star_rte: "pd.DataFrame", star_apt: "pd.DataFrame") -> "ProcedureIndex":
+        """
+        Builds the index from the NASR procedure tables. Options that pass through a waypoint that is not
+        in the graph are left out.
+
+        Arguments:
+        - `graph` (CompiledGraph): graph the index is for.
+        - `sid_rte` (DataFrame): parsed DP_RTE.csv
+        - `sid_apt` (DataFrame): parsed DP_APT.csv
+        - `star_rte` (DataFrame): parsed STAR_RTE.csv
+        - `star_apt` (DataFrame): parsed STAR_APT.csv
+        """
+        departures = _procedure_options(sid_rte, sid_apt, "DP_COMPUTER_CODE", departure=True)
+        arrivals = _procedure_options(star_rte, star_apt, "STAR_COMPUTER_CODE", departure=False)
+
+        names = {}
+        tables = [_options_table(graph, options, names, departure) for options, departure in
+                  ((departures, True), (arrivals, False))]
+
+        return cls(StringTable.from_strings(names.keys()), *tables)
+
+    @classmethod
+    def from_graph(cls, graph: CompiledGraph) -> "ProcedureIndex":
+        """
+        Loads the procedure index stored with a graph file.
+
+        Arguments:
+        - `graph` (CompiledGraph): graph opened from a binary graph file.
+
+        Returns:
+        The procedure index, or `None` if the graph has none.
+        """
+        gf = graph.graph_file
+        if gf is None or not gf.has_section("procedures.names.data"):
+            return None
+
+        tables = [{key: gf.array(f"procedures.{kind}.{key}") for key in _TABLE_KEYS}
+                  for kind in ("departures", "arrivals")]
+        return cls(gf.string_table("procedures.names"), *tables)
+
+    def to_sections(self) -> dict:
+        """
+        Get the procedure arrays as graph file sections.
+        """
+        sections = {
+            "procedures.names.data": self.names.data,
+            "procedures.names.offsets": self.names.offsets,
+            "procedures.names.sorted_ids": self.names.sorted_ids,
+        }
+        for kind, table in self.tables.items():
+            sections.update({f"procedures.{kind}.{key}": table[key] for key in _TABLE_KEYS})
+
+        return sections
+
+    def option_range(self, kind: str, node: int) -> tuple:
+        """
+        Get the range of option ids of an airport.
+
+        Arguments:
+        - `kind` (str): "departures" or "arrivals".
+        - `node` (int): node id of the airport.
+        """
+        offsets = self.tables[kind]["offsets"]
+        return int(offsets[node]), int(offsets[node + 1])
+
+    def option_path(self, kind: str, option: int) -> np.ndarray:
+        """
+        Get the node ids an option flies through, in the order flown.
+        """
+        table = self.tables[kind]
+        return table["path"][table["path_offsets"][option]:table["path_offsets"][option + 1]]
+
+    def options(self, graph: CompiledGraph, kind: str, airport: str) -> list:
+        """
+        Lists the departure or arrival options of an airport.
+
+        Arguments:
+        - `graph` (CompiledGraph): graph the index was built for.
+        - `kind` (str): "departures" or "arrivals".
+        - `airport` (str): airport identifier.
+
+        Returns:
+        A list of `TerminalProcedure`, empty if the airport has no procedures.
+        """
+        node = graph.node_id(airport)
+        if node < 0:
+            return []
+
+        lo, hi = self.option_range(kind, node)
+        return [self.procedure(graph, kind, option) for option in range(lo, hi)]
+
+    def procedure(self, graph: CompiledGraph, kind: str, option: int) -> TerminalProcedure:
+        """
+        Get one departure or arrival option by id.
+        """
+        table = self.tables[kind]
+        path = [graph.node_name(int(node)) for node in self.option_path(kind, option)]
+        return TerminalProcedure(name=self.names[int(table["name_ids"][option])],
+                                 airport=path[0] if kind == "departures" else path[-1],
+                                 runways=self.names[int(table["runway_ids"][option])],
+                                 path=path,
+                                 distance=float(table["cost"][option]))
+
+
+def _flown_paths(rte: "pd.DataFrame", keys: list) -> dict:
+    """
+    Groups procedure route rows into point lists in the order flown, which is decreasing `POINT_SEQ`.
+    """
+    rte = rte.sort_values(keys + ["POINT_SEQ"], ascending=[True] * len(keys) + [False], kind="stable")
+    return {key: points.tolist() for key, points in rte.groupby(keys, sort=False)["POINT"]}
+
+
+def _procedure_options(rte: "pd.DataFrame", apt: "pd.DataFrame", code_col: str, departure: bool) -> list:
+    """
+    Builds the options of every procedure in a pair of NASR route and airport tables.
+
+    Arguments:
+    - `rte` (DataFrame): parsed DP_RTE.csv or STAR_RTE.csv
+    - `apt` (DataFrame): parsed DP_APT.csv or STAR_APT.csv
+    - `code_col` (str): column of the procedure computer code.
+    - `departure` (bool): the tables are departures, flown from the airport.
+
+    Returns:
+    A list of (computer code, airport identifier, runways, flown path of identifiers) tuples.
+    """
+    rte = rte[rte["POINT"].notna()]
+    is_body = rte["ROUTE_PORTION_TYPE"] == "BODY"
+    bodies = _flown_paths(rte[is_body], [code_col, "ROUTE_NAME", "BODY_SEQ"])
+    transitions = {}
+    for (code, trans_code), points in _flown_paths(rte[~is_body & rte["TRANSITION_COMPUTER_CODE"].notna()],
+                                                   [code_col, "TRANSITION_COMPUTER_CODE"]).items():
+        transitions.setdefault(code, []).append((trans_code, points))
+
+    # Runway ends served by each body at each airport.
+    apt = apt[apt["ARPT_ID"].notna()]
+    runways = apt.groupby([code_col, "BODY_NAME", "BODY_SEQ", "ARPT_ID"], sort=False)["RWY_END_ID"].agg(
+        lambda rwys: ", ".join(sorted(rwys.dropna().astype(str).unique())))
+
+    options = []
+    for (code, body_name, body_seq, airport), rwys in runways.items():
+        body = bodies.get((code, body_name, body_seq))
+        if body is None:
+            continue
+
+        # The body alone, then with each transition that joins it. Departure transitions start where the
+        # body ends, arrival transitions end where the body starts.
+        if departure:
+            options.append((code, airport, rwys, [airport] + body))
+            for trans_code, points in transitions.get(code, []):
+                if points[0] == body[-1]:
+                    options.append((trans_code, airport, rwys, [airport] + body + points[1:]))
+        else:
+            options.append((code, airport, rwys, body + [airport]))
+            for trans_code, points in transitions.get(code, []):
+                if points[-1] == body[0]:
+                    options.append((trans_code, airport, rwys, points + body[1:] + [airport]))
+
+    return options
+
+
+def _options_table(graph: CompiledGraph, options: list, names: dict, departure: bool) -> dict:
+    """
+    Converts procedure options to the per-airport CSR arrays of `ProcedureIndex`.
+
+    Arguments:
+    - `graph` (CompiledGraph): graph the index is for.
+    - `options` (list): options from `_procedure_options`.
+    - `names` (dict): string ids of the codes and runway lists so far, updated with new strings.
+    - `departure` (bool): the options are departures, so the en-route fix is the last point.
+    """
+    # 1. Resolve the paths to node ids, dropping repeated points and options through unknown waypoints.
+    node_ids = {}
+    rows = []
+    seen = set()
+    for code, airport, rwys, path in options:
+        nodes = []
+        for ident in path:
+            node = node_ids.setdefault(ident, graph.node_id(ident))
+            if node < 0:
+                break
+            if len(nodes) == 0 or nodes[-1] != node:
+                nodes.append(node)
+        else:
+            # Skip options that don't leave the airport or repeat another option's path.
+            if len(nodes) < 2 or (code, tuple(nodes)) in seen:
+                continue
+            seen.add((code, tuple(nodes)))
+            airport_node = nodes[0] if departure else nodes[-1]
+            rows.append((airport_node, nodes, names.setdefault(code, len(names)), names.setdefault(rwys, len(names))))
+
+    # 2. Order the options by airport.
+    rows.sort(key=lambda row: row[0])
+    airports = np.array([row[0] for row in rows], dtype=np.int64)
+    offsets = np.zeros(graph.num_nodes + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(airports, minlength=graph.num_nodes))
+
+    # 3. Flatten the paths and add up their legs in one batch.
+    path_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    path_offsets[1:] = np.cumsum([len(row[1]) for row in rows])
+    path = np.array([node for row in rows for node in row[1]], dtype=np.int32)
+    legs = geodesic_distances(graph.lat[path[:-1]], graph.lon[path[:-1]], graph.lat[path[1:]], graph.lon[path[1:]])
+    legs = np.append(legs, 0.0)
+    # The leg out of the last point of each path leads into the next path, so it is left out.
+    legs[path_offsets[1:] - 1] = 0.0
+    cost = np.add.reduceat(legs, path_offsets[:-1]) if len(rows) > 0 else np.zeros(0)
+
+    return {
+        "offsets": offsets,
+        "nodes": path[path_offsets[1:] - 1] if departure else path[path_offsets[:-1]],
+        "cost": cost,
+        "path_offsets": path_offsets,
+        "path": path,
+        "name_ids": np.array([row[2] for row in rows], dtype=np.int32),
+        "runway_ids": np.array([row[3] for row in rows], dtype=np.int32),
+    }
+
+
+def read_procedure_index(graph: CompiledGraph, sid_rte_file: str, sid_apt_file: str, star_rte_file: str,
+                         star_apt_file: str, cache_dir: str = "") -> ProcedureIndex:
+    """
+    Builds the procedure index of a graph from the NASR procedure files.
+
+    Arguments:
+    - `graph` (CompiledGraph): graph the index is for.
+    - `sid_rte_file` (str): File path for the NASR DP_RTE.csv
+    - `sid_apt_file` (str): File path for the NASR DP_APT.csv
+    - `star_rte_file` (str): File path for the NASR STAR_RTE.csv
+    - `star_apt_file` (str): File path for the NASR STAR_APT.csv
+    - `cache_dir` (str, optional): directory of the parsed NASR table cache.
+    """
+    import nasr_ingest
+
+    return ProcedureIndex.build(graph,
+                                nasr_ingest.read_nasr_csv(sid_rte_file, cache_dir),
+                                nasr_ingest.read_nasr_csv(sid_apt_file, cache_dir),
+                                nasr_ingest.read_nasr_csv(star_rte_file, cache_dir),
+                                nasr_ingest.read_nasr_csv(star_apt_file, cache_dir))
+
+
+if __name__ == "__main__":
+    # Make this script configurable
+    parser = argparse.ArgumentParser(description="List the departure and arrival procedures of an airport.")
+    parser.add_argument("airport")
+    parser.add_argument("--graph_file", default="data/airway_graph.fpg")
+
+    args = parser.parse_args()
+
+    graph = load_graph(args.graph_file)
+    index = ProcedureIndex.from_graph(graph)
+    if index is None:
+        print(f"{args.graph_file} has no procedure index. Generate the graph again to add one.")
+    else:
+        for kind in ("departures", "arrivals"):
+            options = index.options(graph, kind, args.airport)
+            print(f"{len(options)} {kind}:")
+            for proc in options:
+                runways = f" (runways {proc.runways})" if proc.runways != "" else ""
+                print(f"  {proc.name}{runways}, {proc.distance / METERS_PER_NM:.1f} NM: {' '.join(proc.path)}")
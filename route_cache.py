@@ -0,0 +1,197 @@
+import json
+import os
+from collections import OrderedDict
+
+
+class RouteCache:
+    """
+    Bounded least-recently-used cache of route search results. Entries are keyed on the start and end
+    points, the search options and the NASR effective date of the graph they were computed on, so a graph
+    from a new NASR cycle never returns routes from the previous one. The cache also remembers which graph
+    file it was filled from (see `graph_identity`), so a graph rebuilt on the same cycle, for example with
+    custom airways or procedures added, doesn't reuse its routes either.
+    """
+
+    def __init__(self, max_size: int = 10000, cache_file: str = ""):
+        """
+        Arguments:
+        - `max_size` (int, optional): maximum number of cached routes.
+        - `cache_file` (str, optional): JSON file to persist the cache to. Existing entries are loaded from
+          it. Default is to keep the cache in memory only.
+        """
+        self.max_size = max_size
+        self.cache_file = cache_file
+
+        # NASR effective date and identity of the graph the entries were computed on.
+        self.eff_date = ""
+        self.graph_id = ""
+
+        # Counters since the cache was created.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+
+        if cache_file != "" and os.path.exists(cache_file):
+            self.load(cache_file)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def set_eff_date(self, eff_date: str, graph_id: str = "") -> bool:
+        """
+        Sets the NASR effective date and identity of the graph being searched. If either differs from the
+        graph of the cached entries, the cache is cleared.
+
+        Arguments:
+        - `eff_date` (str): NASR effective date of the loaded graph.
+        - `graph_id` (str, optional): identity of the loaded graph from `graph_identity`.
+
+        Returns:
+        True if the cached entries were dropped.
+        """
+        if eff_date == self.eff_date and graph_id == self.graph_id:
+            return False
+
+        dropped = len(self._entries) > 0
+        self._entries.clear()
+        self.eff_date = eff_date
+        self.graph_id = graph_id
+        return dropped
+
+    def key(self, start: str, end: str, options: dict = None) -> tuple:
+        """
+        Builds the cache key of a search.
+
+        Arguments:
+        - `start` (str): Named fix of the start point.
+        - `end` (str): Named fix of the end point.
+        - `options` (dict, optional): search options that can change the result.
+
+        Returns:
+        A hashable key tuple.
+        """
+        options = options if options is not None else {}
+        return (start, end, tuple(sorted(options.items())), self.eff_date)
+
+    def get(self, start: str, end: str, options: dict = None):
+        """
+        Looks up a cached result and marks it as recently used.
+
+        Returns:
+        The cached result, or `None` on a miss.
+        """
+        key = self.key(start, end, options)
+        if key not in self._entries:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, start: str, end: str, options: dict, result):
+        """
+        Caches a result, evicting the least recently used entries if the cache is full. Results must be
+        JSON serializable if the cache is persisted.
+        """
+        key = self.key(start, end, options)
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(self, start: str, end: str, options: dict, compute):
+        """
+        Returns the cached result of a search, running `compute()` and caching its result on a miss.
+        """
+        result = self.get(start, end, options)
+        if result is None:
+            result = compute()
+            self.put(start, end, options, result)
+
+        return result
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+        The cache size and its hit, miss and eviction counters.
+        """
+        lookups = self.hits + self.misses
+        return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0}
+
+    def save(self, cache_file: str = None):
+        """
+        Writes the cache to disk, from least to most recently used. The file is replaced atomically so an
+        interrupted save never leaves a truncated cache behind.
+
+        Arguments:
+        - `cache_file` (str, optional): file path to write to. Default is the file given at construction.
+        """
+        cache_file = cache_file if cache_file is not None else self.cache_file
+        if cache_file == "":
+            return
+
+        entries = [[start, end, [list(opt) for opt in options], result]
+                   for (start, end, options, _), result in self._entries.items()]
+        data = {"eff_date": self.eff_date, "graph_id": self.graph_id, "entries": entries}
+
+        tmp_file = f"{cache_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_file, cache_file)
+
+    def load(self, cache_file: str):
+        """
+        Replaces the cache entries with the ones saved in a cache file. Unreadable files are ignored, since
+        the cache can always be rebuilt.
+
+        Arguments:
+        - `cache_file` (str): file path written by `save`.
+        """
+        try:
+            with open(cache_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            print(f"Warning: could not read route cache {cache_file}, starting empty.")
+            return
+
+        self._entries.clear()
+        self.eff_date = data.get("eff_date", "")
+        self.graph_id = data.get("graph_id", "")
+        for start, end, options, result in data.get("entries", []):
+            key = (start, end, tuple(tuple(opt) for opt in options), self.eff_date)
+            self._entries[key] = result
+
+        # Respect the size limit if it was lowered since the file was saved.
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+def graph_identity(*files: str) -> str:
+    """
+    Identifies the exact graph (and contraction hierarchy) files routes are computed with, by their absolute
+    path, size and modification time. Rewriting a file changes its identity, even on the same NASR cycle.
+
+    Arguments:
+    - `files` (str): file paths. Empty paths are skipped.
+
+    Returns:
+    An identity string to pass to `RouteCache.set_eff_date`.
+    """
+    parts = []
+    for path in files:
+        if path == "":
+            continue
+        st = os.stat(path)
+        parts.append(f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}")
+
+    return "|".join(parts)
@@ -0,0 +1,94 @@
+import json
+import time
+from dataclasses import asdict
+
+from map_types import SearchStats
+
+
+class SearchTrace:
+    """
+    Structured trace of path searches. Each query emits a `begin` event, one `expand` event for every
+    `sample_every`-th waypoint expanded, and an `end` event with the search statistics. Events are
+    dictionaries passed to an optional callback and/or written to a file as JSON lines.
+    """
+
+    def __init__(self, trace_file: str = "", callback=None, sample_every: int = 1):
+        """
+        Arguments:
+        - `trace_file` (str, optional): JSON-lines file to append the events to. Default is no file.
+        - `callback` (callable, optional): function called with each event dictionary.
+        - `sample_every` (int, optional): only trace every n-th expansion of a query.
+        """
+        self.callback = callback
+        self.sample_every = max(int(sample_every), 1)
+        self._out = open(trace_file, "a") if trace_file != "" else None
+
+        # Number of queries traced, and expansions in the current query.
+        self.queries = 0
+        self._step = 0
+        self._node_name = None
+
+    def begin(self, start: str, end: str, node_name=None):
+        """
+        Starts tracing a query.
+
+        Arguments:
+        - `start` (str): Named fix of the start point.
+        - `end` (str): Named fix of the end point.
+        - `node_name` (callable, optional): converts the nodes passed to `expand` to identifiers, such as
+                                            `CompiledGraph.node_name`. Only called for sampled expansions.
+        """
+        self.queries += 1
+        self._step = 0
+        self._node_name = node_name
+        self._emit({"event": "begin", "query": self.queries, "start": start, "end": end, "time": time.time()})
+
+    def expand(self, node, g_val: float, h_val: float, frontier_size: int):
+        """
+        Records the expansion of a node.
+
+        Arguments:
+        - `node` (str or int): identifier of the expanded waypoint, or its node id.
+        - `g_val` (float): distance from the start in meters.
+        - `h_val` (float): heuristic distance to the end in meters.
+        - `frontier_size` (int): number of frontier entries left.
+        """
+        self._step += 1
+        if self._step % self.sample_every != 0:
+            return
+
+        if self._node_name is not None:
+            node = self._node_name(node)
+        self._emit({"event": "expand", "query": self.queries, "step": self._step, "node": node,
+                    "g": g_val, "h": h_val, "frontier": frontier_size})
+
+    def end(self, path: list, stats: SearchStats = None):
+        """
+        Finishes tracing a query.
+
+        Arguments:
+        - `path` (list): waypoint identifiers of the path found, empty if there is none.
+        - `stats` (SearchStats, optional): statistics of the search.
+        """
+        event = {"event": "end", "query": self.queries, "found": len(path) > 0, "path_len": len(path)}
+        if stats is not None:
+            event.update(asdict(stats))
+            del event["timed"]
+        self._emit(event)
+
+    def close(self):
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+
+    def __enter__(self) -> "SearchTrace":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _emit(self, event: dict):
+        if self.callback is not None:
+            self.callback(event)
+        if self._out is not None:
+            self._out.write(json.dumps(event) + "\n")
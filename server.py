@@ -0,0 +1,379 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from batch_plan import check_hierarchy, init_worker, plan_route
+from contraction import ContractionHierarchy
+from graph_file import load_graph
+from route_cache import RouteCache, graph_identity
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+            504: "Gateway Timeout"}
+
+# Largest request body accepted, in bytes.
+_MAX_BODY = 1 << 20
+
+
+class ServiceBusyError(Exception):
+    """
+    Raised when a route request is refused because too many searches are already queued or running.
+    """
+
+
+class RouteService:
+    """
+    Long-lived route planning service. The airway graph is loaded once into a pool of worker processes
+    (which share a memory-mapped graph file) and searches run in the pool, so the asyncio event loop
+    keeps serving other connections while routes are computed.
+
+    A request that times out is answered right away, but its search is not cancelled: a worker process
+    can't be interrupted, so a search that already started keeps its worker until it finishes. Only
+    searches still waiting in the queue are dropped. Those abandoned searches are still counted as in
+    flight, and new requests are refused once `max_pending` searches are queued or running, so a burst of
+    slow searches can't pile up an unbounded queue.
+    """
+
+    def __init__(self, graph_file: str, ch_file: str = "", workers: int = None, timeout: float = 10.0,
+                 use_landmarks: bool = True, cache_size: int = 10000, cache_file: str = "",
+                 max_pending: int = None):
+        self.timeout = timeout
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.use_landmarks = use_landmarks
+        self.max_pending = max_pending if max_pending is not None else 4 * self.workers
+
+        # Searches submitted to the worker pools that haven't finished, including the ones whose request
+        # timed out.
+        self._pending = set()
+
+        # Counters since the service started.
+        self.timed_out = 0
+        self.rejected = 0
+
+        # Incremented on every reload.
+        self.generation = 0
+
+        # Results of repeated requests. Entries are dropped when a different graph file is loaded.
+        self.cache = RouteCache(cache_size, cache_file) if cache_size > 0 else None
+
+        self._pool = None
+        self._graph_info = {}
+        self._reload_lock = asyncio.Lock()
+
+        self.graph_file = graph_file
+        self.ch_file = ch_file
+
+    async def start(self):
+        """
+        Starts the worker pool for the initial graph.
+        """
+        await self.reload(self.graph_file, self.ch_file)
+
+    async def reload(self, graph_file: str, ch_file: str = "") -> dict:
+        """
+        Loads a new graph without downtime. A new worker pool is started and warmed up with the new
+        graph while the current pool keeps answering requests, then the pools are swapped. Searches
+        already running on the old pool finish normally.
+
+        Raises:
+        `ValueError` if the contraction hierarchy wasn't built for the graph. The current graph is kept.
+
+        Arguments:
+        - `graph_file` (str): file path of the new airway graph.
+        - `ch_file` (str, optional): contraction hierarchy for the new graph.
+
+        Returns:
+        The health information of the new graph.
+        """
+        async with self._reload_lock:
+            loop = asyncio.get_running_loop()
+
+            # Read the graph header in this process for the health endpoint. This also validates the
+            # file before any worker is started.
+            graph = await loop.run_in_executor(None, load_graph, graph_file)
+
+            # A hierarchy built for another graph would give wrong routes, so fail the reload before the
+            # workers load it.
+            if ch_file != "":
+                ch = await loop.run_in_executor(None, ContractionHierarchy.load, ch_file)
+                check_hierarchy(graph, ch, graph_file, ch_file)
+
+            graph_info = {"graph_file": graph_file, "ch_file": ch_file, "eff_date": graph.eff_date,
+                          "nodes": graph.num_nodes, "edges": graph.num_edges}
+
+            pool = ProcessPoolExecutor(self.workers, initializer=init_worker,
+                                       initargs=(graph_file, ch_file, self.use_landmarks))
+
+            # Warm up the new pool so the graph is loaded before it takes traffic. If the workers cannot
+            # load the graph, keep serving from the current pool.
+            try:
+                await asyncio.gather(*(loop.run_in_executor(pool, _ready) for _ in range(self.workers)))
+            except Exception:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+
+            old_pool = self._pool
+            self._pool = pool
+            self._graph_info = graph_info
+            self.graph_file = graph_file
+            self.ch_file = ch_file
+            self.generation += 1
+
+            # Cached routes are only valid for the graph they were computed on. Reloading the same, unchanged
+            # files keeps them.
+            if self.cache is not None:
+                self.cache.set_eff_date(graph.eff_date, graph_identity(graph_file, ch_file))
+
+            if old_pool is not None:
+                old_pool.shutdown(wait=False)
+
+            return self.health()
+
+    @property
+    def in_flight(self) -> int:
+        """
+        Number of searches queued or running in the worker pools, including abandoned ones.
+        """
+        return len(self._pending)
+
+    def health(self) -> dict:
+        health = {"status": "ok", "generation": self.generation, "in_flight": self.in_flight,
+                  "max_pending": self.max_pending, "timed_out": self.timed_out, "rejected": self.rejected,
+                  "workers": self.workers, **self._graph_info}
+        if self.cache is not None:
+            health["cache"] = self.cache.stats()
+        return health
+
+    async def route(self, start: str, end: str) -> dict:
+        """
+        Plans a route in the worker pool, or returns it from the route cache if it was planned before on
+        the same graph.
+
+        Arguments:
+        - `start` (str): Named fix of the start point.
+        - `end` (str): Named fix of the end point.
+
+        Returns:
+        The `batch_plan.plan_route` result for the route.
+
+        Raises:
+        `ServiceBusyError` if `max_pending` searches are already queued or running.
+        `asyncio.TimeoutError` if the search takes longer than the request timeout. The search itself keeps
+        running if it had started.
+        """
+        options = {"ch": self.ch_file != "", "landmarks": self.use_landmarks}
+        if self.cache is not None:
+            cached = self.cache.get(start, end, options)
+            if cached is not None:
+                return {**cached, "cached": True}
+
+        if len(self._pending) >= self.max_pending:
+            self.rejected += 1
+            raise ServiceBusyError(f"{len(self._pending)} route searches are already queued or running")
+
+        # The search is tracked until the worker finishes it, whether or not the request is still waiting.
+        generation = self.generation
+        search = self._pool.submit(plan_route, (0, start, end, ""))
+        future = asyncio.wrap_future(search)
+        self._pending.add(future)
+        future.add_done_callback(self._search_done)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            # Drops the search if it is still queued. A running search can't be stopped.
+            search.cancel()
+            self.timed_out += 1
+            raise
+
+        # A result from the previous graph is still returned, but not cached for the new one.
+        del result["index"]
+        if self.cache is not None and generation == self.generation:
+            self.cache.put(start, end, options, result)
+        return result
+
+    def _search_done(self, future: asyncio.Future):
+        self._pending.discard(future)
+
+        # Retrieve the errors of abandoned searches, so they aren't reported as never retrieved.
+        if not future.cancelled():
+            future.exception()
+
+    async def shutdown(self):
+        if self.cache is not None:
+            self.cache.save()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serves HTTP/1.1 requests on one connection until the client closes it.
+        """
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+
+                method, target, headers, body = request
+                status, payload = await self.dispatch(method, target, body)
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                _write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:
+            _write_response(writer, 413 if "too large" in str(e) else 400, {"error": str(e)}, False)
+        finally:
+            writer.close()
+
+    async def dispatch(self, method: str, target: str, body: bytes) -> tuple:
+        """
+        Routes a request to its endpoint.
+
+        Endpoints:
+        - `GET /health`: graph and service status.
+        - `GET /route?start=X&end=Y` or `POST /route` with `{"start": X, "end": Y}`: plan a route.
+        - `POST /reload` with `{"graph_file": F, "ch_file": C}`: hot reload a new graph.
+
+        Returns:
+        A (status, JSON payload) tuple.
+        """
+        url = urlsplit(target)
+        try:
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if method == "POST" and len(body) > 0:
+                params.update(json.loads(body))
+        except (TypeError, ValueError):
+            return 400, {"error": "request body must be a JSON object"}
+
+        if url.path == "/health":
+            return 200, self.health()
+
+        if url.path == "/route":
+            if method not in ("GET", "POST"):
+                return 405, {"error": f"{method} not allowed"}
+            if "start" not in params or "end" not in params:
+                return 400, {"error": "start and end are required"}
+
+            try:
+                result = await self.route(str(params["start"]), str(params["end"]))
+            except ServiceBusyError as e:
+                return 503, {"error": f"service busy: {e}"}
+            except asyncio.TimeoutError:
+                return 504, {"error": f"route search timed out after {self.timeout} s"}
+            except Exception as e:
+                return 500, {"error": f"route search failed: {e!r}"}
+            return 200, result
+
+        if url.path == "/reload":
+            if method != "POST":
+                return 405, {"error": f"{method} not allowed"}
+            if "graph_file" not in params:
+                return 400, {"error": "graph_file is required"}
+
+            try:
+                return 200, await self.reload(params["graph_file"], params.get("ch_file", ""))
+            except Exception as e:
+                return 500, {"error": f"reload failed: {e!r}"}
+
+        return 404, {"error": f"unknown endpoint {url.path}"}
+
+
+def _ready() -> bool:
+    # Runs in a worker once the initializer has loaded the graph.
+    return True
+
+
+async def _read_request(reader: asyncio.StreamReader):
+    """
+    Reads one HTTP request.
+
+    Returns:
+    A (method, target, headers, body) tuple, or `None` if the connection was closed.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise ValueError("malformed request line")
+    method, target, _ = parts
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length", "0"))
+    if length > _MAX_BODY:
+        raise ValueError("request body too large")
+    body = await reader.readexactly(length) if length > 0 else b""
+
+    return method.upper(), target, headers, body
+
+
+def _write_response(writer: asyncio.StreamWriter, status: int, payload: dict, keep_alive: bool):
+    body = json.dumps(payload).encode("utf-8")
+    head = (f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode("latin-1") + body)
+
+
+async def serve(graph_file: str, host: str, port: int, ch_file: str = "", workers: int = None,
+                timeout: float = 10.0, use_landmarks: bool = True, cache_size: int = 10000, cache_file: str = "",
+                max_pending: int = None):
+    """
+    Runs the route planning service until cancelled.
+    """
+    service = RouteService(graph_file, ch_file, workers, timeout, use_landmarks, cache_size, cache_file,
+                           max_pending)
+    await service.start()
+
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print(f"Serving routes from {graph_file} on http://{host}:{port} with {service.workers} workers")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.shutdown()
+
+
+if __name__ == "__main__":
+    # Configurable parameters
+    parser = argparse.ArgumentParser(description="Serve route requests over HTTP with the graph held in memory.")
+    parser.add_argument("--graph_file", default="data/airway_graph.fpg")
+    parser.add_argument("--ch_file", default="", help="Contraction hierarchy to search with instead of A*")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=None, help="Search processes. Default is the CPU count")
+    parser.add_argument("--timeout", type=float, default=10.0,
+                        help="Route request timeout in seconds. Searches that already started still finish")
+    parser.add_argument("--max_pending", type=int, default=None,
+                        help="Searches queued or running before requests are refused. Default is 4 per worker")
+    parser.add_argument("--no_landmarks", action="store_true")
+    parser.add_argument("--cache_size", type=int, default=10000, help="Routes kept in the route cache (0 to disable)")
+    parser.add_argument("--cache_file", default="", help="File the route cache is loaded from and saved to on exit")
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    try:
+        asyncio.run(serve(args.graph_file, args.host, args.port, args.ch_file, args.workers, args.timeout,
+                          not args.no_landmarks, args.cache_size, args.cache_file, args.max_pending))
+    except KeyboardInterrupt:
+        print(f"Stopped after {time.perf_counter() - start_time:.0f} s")
@@ -0,0 +1,478 @@
+import argparse
+import heapq
+import multiprocessing
+
+import numpy as np
+
+from compiled_graph import CompiledGraph
+from geo_utils import METERS_PER_NM, ecef, geodesic_distances
+from map_types import WaypointType
+
+
+class SpatialIndex:
+    """
+    KD-tree over the waypoints for geographic queries. The tree is built on WGS84 ECEF coordinates, where
+    the straight-line (chord) distance between two points is a lower bound on their geodesic distance.
+    The tree prunes with chord distances, and exact geodesic distances are only computed for the
+    remaining candidates.
+
+    Each tree node covers the range ranges[i, 0]:ranges[i, 1] of `perm` and has the bounding box
+    box_min[i]:box_max[i]. Leaves have children -1.
+    """
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, perm: np.ndarray, xyz: np.ndarray, ranges: np.ndarray,
+                 children: np.ndarray, box_min: np.ndarray, box_max: np.ndarray, lat_order: np.ndarray,
+                 lat_sorted: np.ndarray):
+        # Waypoint coordinates, indexed by node id.
+        self.lat = lat
+        self.lon = lon
+
+        # Node ids in tree order, and their ECEF coordinates in the same order.
+        self.perm = perm
+        self.xyz = xyz
+
+        # Tree nodes.
+        self.ranges = ranges
+        self.children = children
+        self.box_min = box_min
+        self.box_max = box_max
+
+        # Node ids sorted by latitude, for bounding box queries.
+        self.lat_order = lat_order
+        self.lat_sorted = lat_sorted
+
+        # The traversal runs on Python lists, which are much faster than numpy for scalar access.
+        self._ranges = ranges.tolist()
+        self._children = children.tolist()
+        self._box_min = box_min.tolist()
+        self._box_max = box_max.tolist()
+
+    @classmethod
+    def build(cls, graph: CompiledGraph, leaf_size: int = 16) -> "SpatialIndex":
+        """
+        Builds the KD-tree over the waypoints of a graph.
+
+        Arguments:
+        - `graph` (CompiledGraph): graph whose waypoints are indexed.
+        - `leaf_size` (int, optional): maximum number of waypoints in a leaf.
+        """
+        return cls.from_points(graph.lat, graph.lon, leaf_size)
+
+    @classmethod
+    def from_points(cls, lat: np.ndarray, lon: np.ndarray, leaf_size: int = 16) -> "SpatialIndex":
+        """
+        Builds the KD-tree by splitting each node at the median of its widest dimension. Node ids are the
+        positions in the coordinate arrays.
+
+        Arguments:
+        - `lat` (np.ndarray): latitudes in decimal degrees.
+        - `lon` (np.ndarray): longitudes in decimal degrees.
+        - `leaf_size` (int, optional): maximum number of points in a leaf.
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        xyz = ecef(lat, lon)
+        perm = np.arange(len(lat), dtype=np.int32)
+
+        ranges = []
+        children = []
+        box_min = []
+        box_max = []
+
+        def build_node(start: int, end: int) -> int:
+            pts = xyz[perm[start:end]]
+            node = len(ranges)
+            ranges.append((start, end))
+            children.append([-1, -1])
+            box_min.append(pts.min(axis=0) if end > start else np.zeros(3))
+            box_max.append(pts.max(axis=0) if end > start else np.zeros(3))
+
+            if end - start <= leaf_size:
+                return node
+
+            # Split at the median of the widest dimension.
+            dim = int(np.argmax(box_max[node] - box_min[node]))
+            mid = (start + end) // 2
+            order = np.argpartition(pts[:, dim], mid - start)
+            perm[start:end] = perm[start:end][order]
+
+            children[node][0] = build_node(start, mid)
+            children[node][1] = build_node(mid, end)
+            return node
+
+        build_node(0, len(lat))
+
+        lat_order = np.argsort(lat, kind="stable").astype(np.int32)
+        return cls(lat, lon, perm, xyz[perm], np.array(ranges, dtype=np.int32),
+                   np.array(children, dtype=np.int32), np.array(box_min), np.array(box_max),
+                   lat_order, lat[lat_order])
+
+    @classmethod
+    def from_graph(cls, graph: CompiledGraph) -> "SpatialIndex":
+        """
+        Loads the spatial index stored with a graph file.
+
+        Arguments:
+        - `graph` (CompiledGraph): graph opened from a binary graph file.
+
+        Returns:
+        The spatial index, or `None` if the graph has no spatial index.
+        """
+        gf = graph.graph_file
+        if gf is None or not gf.has_section("spatial.perm"):
+            return None
+
+        return cls(graph.lat, graph.lon, gf.array("spatial.perm"), gf.array("spatial.xyz"),
+                   gf.array("spatial.ranges"), gf.array("spatial.children"), gf.array("spatial.box_min"),
+                   gf.array("spatial.box_max"), gf.array("spatial.lat_order"), gf.array("spatial.lat_sorted"))
+
+    def to_sections(self) -> dict:
+        """
+        Get the index arrays as graph file sections.
+        """
+        return {
+            "spatial.perm": self.perm,
+            "spatial.xyz": self.xyz,
+            "spatial.ranges": self.ranges,
+            "spatial.children": self.children,
+            "spatial.box_min": self.box_min,
+            "spatial.box_max": self.box_max,
+            "spatial.lat_order": self.lat_order,
+            "spatial.lat_sorted": self.lat_sorted,
+        }
+
+    def __len__(self) -> int:
+        return len(self.perm)
+
+    def nearest(self, lat: float, lon: float, k: int = 1, mask: np.ndarray = None) -> tuple:
+        """
+        Finds the k waypoints closest to a point.
+
+        Arguments:
+        - `lat` (float): latitude of the point in decimal degrees.
+        - `lon` (float): longitude of the point in decimal degrees.
+        - `k` (int, optional): number of waypoints to return.
+        - `mask` (np.ndarray, optional): boolean array over node ids of the waypoints to consider.
+
+        Returns:
+        A (node ids, geodesic distances in meters) tuple of arrays, closest first.
+        """
+        query = ecef(lat, lon)[0]
+
+        # 1. Find the k nearest waypoints by chord distance.
+        candidates = self._nearest_chord(query, k, mask)
+        if len(candidates) == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+
+        # 2. The true k nearest are no farther along the geodesic than the worst of these candidates,
+        # so they are all within that chord distance too.
+        radius = geodesic_distances(np.full(len(candidates), lat), np.full(len(candidates), lon),
+                                    self.lat[candidates], self.lon[candidates]).max()
+
+        # 3. Refine every waypoint in that radius with exact distances.
+        nodes, dists = self._refine(lat, lon, self._within_chord(query, radius, mask))
+        return nodes[:k], dists[:k]
+
+    def within(self, lat: float, lon: float, radius: float, mask: np.ndarray = None) -> tuple:
+        """
+        Finds all waypoints within a geodesic distance of a point.
+
+        Arguments:
+        - `lat` (float): latitude of the point in decimal degrees.
+        - `lon` (float): longitude of the point in decimal degrees.
+        - `radius` (float): search radius in meters.
+        - `mask` (np.ndarray, optional): boolean array over node ids of the waypoints to consider.
+
+        Returns:
+        A (node ids, geodesic distances in meters) tuple of arrays, closest first.
+        """
+        query = ecef(lat, lon)[0]
+        nodes, dists = self._refine(lat, lon, self._within_chord(query, radius, mask))
+        inside = dists <= radius
+        return nodes[inside], dists[inside]
+
+    def in_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                mask: np.ndarray = None) -> np.ndarray:
+        """
+        Finds all waypoints in a latitude/longitude box. Boxes with `min_lon` greater than `max_lon` cross
+        the antimeridian.
+
+        Returns:
+        An array of node ids, sorted by latitude.
+        """
+        # Binary search the latitude band, then filter its longitudes.
+        lo = np.searchsorted(self.lat_sorted, min_lat, side="left")
+        hi = np.searchsorted(self.lat_sorted, max_lat, side="right")
+        nodes = self.lat_order[lo:hi]
+
+        lon = self.lon[nodes]
+        if min_lon <= max_lon:
+            inside = (lon >= min_lon) & (lon <= max_lon)
+        else:
+            inside = (lon >= min_lon) | (lon <= max_lon)
+        if mask is not None:
+            inside &= mask[nodes]
+
+        return nodes[inside]
+
+    def leaves(self) -> np.ndarray:
+        """
+        Get the ids of the tree's leaf nodes, in tree order.
+        """
+        return np.flatnonzero(self.children[:, 0] < 0)
+
+    def neighbors(self, k: int, leaves: np.ndarray = None) -> tuple:
+        """
+        Finds the k nearest other points of every indexed point by chord distance. The points of a leaf are
+        processed together: the leaves nearest to it provide an upper bound on each point's k-th neighbor
+        distance, then every leaf within that bound is compared against all of the leaf's points in one
+        distance matrix. For the short distances between neighbors, chord and geodesic distances rank
+        points the same way except for near-ties.
+
+        Arguments:
+        - `k` (int): number of neighbors per point.
+        - `leaves` (np.ndarray, optional): leaf nodes whose points are processed. Default is all of them.
+
+        Returns:
+        A (node ids, neighbors) tuple, where neighbors[i] holds the node ids of the k nearest points to
+        node ids[i], closest first, padded with -1 when there are fewer than k other points.
+        """
+        all_leaves = self.leaves()
+        leaves = all_leaves if leaves is None else leaves
+        leaf_min = self.box_min[all_leaves]
+        leaf_max = self.box_max[all_leaves]
+        leaf_ranges = self.ranges[all_leaves]
+        leaf_counts = leaf_ranges[:, 1] - leaf_ranges[:, 0]
+
+        ids = []
+        nbrs = []
+        for leaf in np.asarray(leaves).tolist():
+            start, end = self._ranges[leaf]
+            if end == start:
+                continue
+            query = self.xyz[start:end]
+
+            # Distances between the leaf's bounding box and every other leaf's box.
+            gap = np.maximum(0.0, np.maximum(leaf_min - self.box_max[leaf], self.box_min[leaf] - leaf_max))
+            box_dist = np.sqrt(np.sum(gap ** 2, axis=1))
+            order = np.argsort(box_dist, kind="stable")
+
+            # 1. Bound the k-th neighbor distance with the closest leaves holding at least k other points.
+            n_take = int(np.searchsorted(np.cumsum(leaf_counts[order]), k + 1)) + 1
+            _, dists = self._leaf_neighbors(query, start, leaf_ranges[order[:n_take]], k)
+            bound = dists[:, -1].max()
+
+            # 2. Compare against every leaf within the bound.
+            pos, dists = self._leaf_neighbors(query, start, leaf_ranges[box_dist <= bound], k)
+            found = self.perm[pos]
+            found[~np.isfinite(dists)] = -1
+
+            ids.append(self.perm[start:end])
+            nbrs.append(found)
+
+        if len(ids) == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros((0, k), dtype=np.int32)
+
+        return np.concatenate(ids), np.concatenate(nbrs)
+
+    def _leaf_neighbors(self, query: np.ndarray, start: int, ranges: np.ndarray, k: int) -> tuple:
+        # Positions (in tree order) and chord distances of the k nearest candidates for each query point.
+        pos = np.concatenate([np.arange(lo, hi) for lo, hi in ranges.tolist()])
+        dists = np.sqrt(np.sum((query[:, None, :] - self.xyz[pos][None, :, :]) ** 2, axis=2))
+
+        # A point is not its own neighbor.
+        dists[pos[None, :] == np.arange(start, start + len(query))[:, None]] = np.inf
+
+        # Pad with infinite distances when there are fewer than k candidates.
+        if dists.shape[1] < k:
+            pad = k - dists.shape[1]
+            dists = np.hstack((dists, np.full((len(query), pad), np.inf)))
+            pos = np.concatenate((pos, np.full(pad, pos[0])))
+
+        nearest = np.argsort(dists, axis=1, kind="stable")[:, :k]
+        return pos[nearest], np.take_along_axis(dists, nearest, axis=1)
+
+    def _nearest_chord(self, query: np.ndarray, k: int, mask: np.ndarray) -> np.ndarray:
+        # Best-first traversal: tree nodes are visited by their box distance, and the search stops once
+        # the closest unvisited box is farther than the k-th best waypoint.
+        qx, qy, qz = query.tolist()
+        best = []
+        frontier = [(0.0, 0)]
+        while len(frontier) > 0:
+            box_dist, node = heapq.heappop(frontier)
+            if len(best) == k and box_dist > -best[0][0]:
+                break
+
+            left, right = self._children[node]
+            if left < 0:
+                start, end = self._ranges[node]
+                ids, d2 = self._leaf(query, start, end, mask)
+                for i in np.argsort(d2)[:k].tolist():
+                    if len(best) < k:
+                        heapq.heappush(best, (-d2[i], int(ids[i])))
+                    elif d2[i] < -best[0][0]:
+                        heapq.heapreplace(best, (-d2[i], int(ids[i])))
+                    else:
+                        break
+                continue
+
+            for child in (left, right):
+                heapq.heappush(frontier, (self._box_dist2(qx, qy, qz, child), child))
+
+        return np.array([node for _, node in best], dtype=np.int32)
+
+    def _within_chord(self, query: np.ndarray, radius: float, mask: np.ndarray) -> np.ndarray:
+        qx, qy, qz = query.tolist()
+        r2 = radius * radius
+        found = []
+        stack = [0]
+        while len(stack) > 0:
+            node = stack.pop()
+            if self._box_dist2(qx, qy, qz, node) > r2:
+                continue
+
+            left, right = self._children[node]
+            if left < 0:
+                start, end = self._ranges[node]
+                ids, d2 = self._leaf(query, start, end, mask)
+                found.append(ids[d2 <= r2])
+            else:
+                stack.extend((left, right))
+
+        return np.concatenate(found) if len(found) > 0 else np.zeros(0, dtype=np.int32)
+
+    def _leaf(self, query: np.ndarray, start: int, end: int, mask: np.ndarray) -> tuple:
+        ids = self.perm[start:end]
+        d2 = np.sum((self.xyz[start:end] - query) ** 2, axis=1)
+        if mask is not None:
+            keep = mask[ids]
+            ids, d2 = ids[keep], d2[keep]
+        return ids, d2
+
+    def _box_dist2(self, qx: float, qy: float, qz: float, node: int) -> float:
+        # Squared distance from the query to the bounding box of a tree node.
+        (x0, y0, z0), (x1, y1, z1) = self._box_min[node], self._box_max[node]
+        dx = x0 - qx if qx < x0 else (qx - x1 if qx > x1 else 0.0)
+        dy = y0 - qy if qy < y0 else (qy - y1 if qy > y1 else 0.0)
+        dz = z0 - qz if qz < z0 else (qz - z1 if qz > z1 else 0.0)
+        return dx * dx + dy * dy + dz * dz
+
+    def _refine(self, lat: float, lon: float, nodes: np.ndarray) -> tuple:
+        # Exact geodesic distances to the candidates, closest first.
+        dists = geodesic_distances(np.full(len(nodes), lat), np.full(len(nodes), lon),
+                                   self.lat[nodes], self.lon[nodes])
+        order = np.lexsort((nodes, dists))
+        return nodes[order], dists[order]
+
+
+# Spatial index used by `neighbors_table` worker processes.
+_worker_index = None
+
+
+def _init_neighbors_worker(index: SpatialIndex):
+    global _worker_index
+    _worker_index = index
+
+
+def _neighbors_chunk(task: tuple) -> tuple:
+    leaves, k = task
+    return _worker_index.neighbors(k, leaves)
+
+
+def neighbors_table(index: SpatialIndex, k: int, processes: int = 1, chunk_leaves: int = 256) -> tuple:
+    """
+    Finds the k nearest neighbors of every indexed point, optionally splitting the leaves of the tree
+    across worker processes.
+
+    Arguments:
+    - `index` (SpatialIndex): index of the points.
+    - `k` (int): number of neighbors per point.
+    - `processes` (int, optional): number of worker processes. 1 runs in this process, `None` uses
+                                   the number of CPUs.
+    - `chunk_leaves` (int, optional): number of leaves handed to a worker at a time.
+
+    Returns:
+    A (node ids, neighbors) tuple sorted by node id, as described in `SpatialIndex.neighbors`.
+    """
+    if processes == 1:
+        ids, nbrs = index.neighbors(k)
+    else:
+        leaves = index.leaves()
+        tasks = [(leaves[i:i + chunk_leaves], k) for i in range(0, len(leaves), chunk_leaves)]
+        with multiprocessing.Pool(processes, initializer=_init_neighbors_worker, initargs=(index,)) as pool:
+            results = pool.map(_neighbors_chunk, tasks)
+
+        ids = np.concatenate([r[0] for r in results])
+        nbrs = np.concatenate([r[1] for r in results])
+
+    order = np.argsort(ids, kind="stable")
+    return ids[order], nbrs[order]
+
+
+def network_mask(graph: CompiledGraph) -> np.ndarray:
+    """
+    Get a mask of the waypoints that are on at least one airway, in either direction.
+    """
+    rev_offsets, _, _ = graph.reverse_adjacency()
+    return (np.diff(graph.offsets) > 0) | (np.diff(rev_offsets) > 0)
+
+
+def snap_to_network(graph: CompiledGraph, index: SpatialIndex, lat: float, lon: float) -> tuple:
+    """
+    Snaps a coordinate onto the airway network.
+
+    Arguments:
+    - `graph` (CompiledGraph): graph to snap onto.
+    - `index` (SpatialIndex): spatial index of the graph.
+    - `lat` (float): latitude in decimal degrees.
+    - `lon` (float): longitude in decimal degrees.
+
+    Returns:
+    The identifier of the closest waypoint on an airway and its distance in meters, or ("", inf) if the
+    graph has no airways.
+    """
+    nodes, dists = index.nearest(lat, lon, 1, network_mask(graph))
+    if len(nodes) == 0:
+        return "", float("inf")
+
+    return graph.node_name(int(nodes[0])), float(dists[0])
+
+
+if __name__ == "__main__":
+    from graph_file import load_graph
+
+    # Make this script configurable
+    parser = argparse.ArgumentParser(description="Find waypoints near a coordinate.")
+    parser.add_argument("lat", type=float)
+    parser.add_argument("lon", type=float)
+    parser.add_argument("--graph_file", default="data/airway_graph.fpg")
+    parser.add_argument("--k", type=int, default=5, help="Number of nearest waypoints")
+    parser.add_argument("--radius_nm", type=float, default=0.0,
+                        help="List all waypoints within this many nautical miles instead")
+    parser.add_argument("--type", default="", choices=["", "fix", "navaid", "airport"],
+                        help="Only return waypoints of this type")
+    parser.add_argument("--snap", action="store_true", help="Snap the coordinate onto the airway network")
+
+    args = parser.parse_args()
+
+    graph = load_graph(args.graph_file)
+    index = SpatialIndex.from_graph(graph)
+    if index is None:
+        index = SpatialIndex.build(graph)
+
+    if args.snap:
+        ident, dist = snap_to_network(graph, index, args.lat, args.lon)
+        print(f"{ident} {dist / METERS_PER_NM:.1f} NM")
+    else:
+        mask = None
+        if args.type != "":
+            mask = graph.wpt_type == WaypointType[args.type.upper()].value
+
+        if args.radius_nm > 0:
+            nodes, dists = index.within(args.lat, args.lon, args.radius_nm * METERS_PER_NM, mask)
+        else:
+            nodes, dists = index.nearest(args.lat, args.lon, args.k, mask)
+
+        for node, dist in zip(nodes.tolist(), dists.tolist()):
+            print(f"{graph.node_name(node):>10} {WaypointType(int(graph.wpt_type[node])).name:>8} "
+                  f"{dist / METERS_PER_NM:8.1f} NM")
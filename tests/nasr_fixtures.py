@@ -0,0 +1,25 @@
+import os
+
+from airway_graph import AirwayGraph
+
+# Two small NASR cycles around Oklahoma City and Dallas. The second moves HOWWW, removes ITEMM and adds MIKEE
+# on a new airway. NOVMB can only be reached through the SOONR1.NOVMB departure transition from OKC.
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+NASR_FILES = ["FIX_BASE.csv", "APT_BASE.csv", "NAV_BASE.csv", "AWY_SEG.csv", "STAR_RTE.csv", "STAR_APT.csv",
+              "DP_RTE.csv", "DP_APT.csv"]
+
+
+def nasr_files(cycle: str) -> list:
+    """
+    Get the NASR file paths of a test cycle, in the argument order of `AirwayGraph.load_nasr_data`.
+    """
+    return [os.path.join(DATA_DIR, cycle, name) for name in NASR_FILES]
+
+
+def bulk_graph(cycle: str, processes: int = 1) -> AirwayGraph:
+    """
+    Builds the airway graph of a test cycle with the bulk build.
+    """
+    graph = AirwayGraph(verbose=False)
+    graph.load_nasr_data_bulk(*nasr_files(cycle), processes=processes)
+    return graph
@@ -0,0 +1,67 @@
+import pytest
+
+from compiled_graph import CompiledGraph
+from constraints import Closure, ConstraintSet
+from nasr_fixtures import NASR_FILES, bulk_graph, nasr_files
+from path_search import find_airport_route
+from procedures import read_procedure_index
+from search_trace import SearchTrace
+
+
+@pytest.fixture(scope="module")
+def graph() -> CompiledGraph:
+    return CompiledGraph.from_airway_graph(bulk_graph("cycle_b"))
+
+
+@pytest.fixture(scope="module")
+def procedures(graph):
+    files = dict(zip(NASR_FILES, nasr_files("cycle_b")))
+    return read_procedure_index(graph, files["DP_RTE.csv"], files["DP_APT.csv"], files["STAR_RTE.csv"],
+                                files["STAR_APT.csv"])
+
+
+def constrained_route(graph, procedures, start: str, end: str, closure: Closure) -> tuple:
+    constraint_set = ConstraintSet(graph, procedures=procedures)
+    blocked_procedures = {kind: constraint_set.procedure_mask(procedures, kind, [closure])
+                          for kind in ("departures", "arrivals")}
+    return find_airport_route(graph, procedures, start, end, blocked=constraint_set.edge_mask([closure]),
+                              blocked_procedures=blocked_procedures)
+
+
+def test_departure_transition_is_flown(graph, procedures):
+    path, departure, _ = find_airport_route(graph, procedures, "OKC", "NOVMB")
+
+    assert path == ["OKC", "IRW", "BAKER", "FOXXX", "NOVMB"]
+    assert departure.name == "SOONR1.NOVMB"
+
+
+def test_airport_route_is_traced(graph, procedures):
+    events = []
+    path, _, _ = find_airport_route(graph, procedures, "OKC", "NOVMB", trace=SearchTrace(callback=events.append))
+
+    assert [event["event"] for event in (events[0], events[-1])] == ["begin", "end"]
+    assert events[-1]["found"] and events[-1]["path_len"] == len(path)
+    assert any(event["event"] == "expand" for event in events)
+
+
+@pytest.mark.parametrize("closure", [
+    # The FOXXX -> NOVMB leg of the transition is not an airway of the graph.
+    Closure(polygon=[(33.7, -97.3), (33.8, -97.3), (33.8, -97.2), (33.7, -97.2)]),
+    Closure(fixes=["FOXXX"]),
+    Closure(airways=["SOONR1.NOVMB"]),
+])
+def test_closed_departure_is_not_flown(graph, procedures, closure):
+    path, departure, _ = constrained_route(graph, procedures, "OKC", "NOVMB", closure)
+
+    # The transition is the only way to NOVMB.
+    assert path == []
+    assert departure is None
+
+
+def test_closed_arrival_is_not_flown(graph, procedures):
+    open_path, _, open_arrival = find_airport_route(graph, procedures, "OKC", "DFW")
+    assert open_arrival.name == "GEORG.COWBY1"
+
+    path, _, arrival = constrained_route(graph, procedures, "OKC", "DFW", Closure(airways=["GEORG.COWBY1"]))
+    assert path[-1] == "DFW"
+    assert arrival is None or arrival.name != "GEORG.COWBY1"
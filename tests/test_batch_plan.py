@@ -0,0 +1,27 @@
+from batch_plan import plan_route, read_pairs
+
+
+def test_read_pairs_reports_invalid_rows(tmp_path):
+    pairs_file = tmp_path / "pairs.jsonl"
+    pairs_file.write_text('{"start": "OKC", "end": "DFW"}\n'
+                          'not json\n'
+                          '{"origin": "OKC"}\n'
+                          '{"origin": " TUL ", "destination": "DFW"}\n')
+
+    pairs = list(read_pairs(str(pairs_file)))
+
+    assert [pair[:3] for pair in pairs] == [(0, "OKC", "DFW"), (1, "", ""), (2, "OKC", ""), (3, "TUL", "DFW")]
+    assert pairs[0][3] == "" and pairs[3][3] == ""
+    assert pairs[1][3].startswith("invalid JSON")
+    assert pairs[2][3] == "row is missing the start or the end"
+
+
+def test_invalid_rows_are_failed_routes(tmp_path):
+    pairs_file = tmp_path / "pairs.csv"
+    pairs_file.write_text("start,end\nOKC,\n")
+
+    result = plan_route(next(read_pairs(str(pairs_file))))
+
+    assert result["path"] == []
+    assert result["invalid"]
+    assert result["error"] == "row is missing the start or the end"
@@ -0,0 +1,47 @@
+import pytest
+
+from airway_index import read_airway_index
+from compiled_graph import CompiledGraph
+from constraints import Closure, ConstraintSet
+from nasr_fixtures import NASR_FILES, bulk_graph, nasr_files
+from path_search import find_best_path_compiled
+from procedures import read_procedure_index
+
+
+@pytest.fixture(scope="module")
+def graph() -> CompiledGraph:
+    return CompiledGraph.from_airway_graph(bulk_graph("cycle_a"))
+
+
+@pytest.fixture(scope="module")
+def constraint_set(graph) -> ConstraintSet:
+    files = dict(zip(NASR_FILES, nasr_files("cycle_a")))
+    airways = read_airway_index(graph, files["AWY_SEG.csv"])
+    procedures = read_procedure_index(graph, files["DP_RTE.csv"], files["DP_APT.csv"], files["STAR_RTE.csv"],
+                                      files["STAR_APT.csv"])
+    return ConstraintSet(graph, airways=airways, procedures=procedures)
+
+
+def test_closed_airway_is_not_flown(graph, constraint_set):
+    assert find_best_path_compiled(graph, "ABLEE", "DOGGY") == ["ABLEE", "BAKER", "CHRLY", "DOGGY"]
+
+    blocked = constraint_set.edge_mask([Closure(airways=["V1"])])
+    # V1 has three segments, closed in both directions.
+    assert int(blocked.sum()) == 6
+
+    v1_legs = {("ABLEE", "BAKER"), ("BAKER", "CHRLY"), ("CHRLY", "DOGGY")}
+    for start, end in (("ABLEE", "DOGGY"), ("DOGGY", "ABLEE")):
+        path = find_best_path_compiled(graph, start, end, blocked=blocked)
+        assert len(path) > 0
+        legs = set(zip(path, path[1:])) | set(zip(path[1:], path))
+        assert legs.isdisjoint(v1_legs), path
+
+
+def test_unknown_airway_is_reported(constraint_set, capsys):
+    blocked = constraint_set.edge_mask([Closure(name="NOTAM 1", airways=["J99", "SOONR1.NOVMB"])])
+
+    assert not blocked.any()
+    out = capsys.readouterr().out
+    assert "J99" in out
+    # Procedures are closed by `procedure_mask`, so their computer codes are not reported.
+    assert "SOONR1.NOVMB" not in out
@@ -0,0 +1,149 @@
+import itertools
+import math
+
+import pytest
+
+import nasr_delta
+from airway_graph import AirwayGraph
+from compiled_graph import CompiledGraph
+from contraction import ContractionHierarchy
+from landmarks import LandmarkIndex
+from nasr_fixtures import bulk_graph, nasr_files
+from path_search import (find_best_path_bidirectional, find_best_path_ch, find_best_path_compiled, find_best_path_tiled,
+                         find_k_best_paths, path_distance)
+from tiled_graph import TiledGraph, write_tiled_graph
+
+
+def graph_rows(graph: AirwayGraph) -> tuple:
+    """
+    Get the waypoints and airways of a graph as comparable rows, in dictionary order.
+    """
+    waypoints = [(name, wpt.lat, wpt.lon, wpt.wpt_type) for name, wpt in graph.waypoints.items()]
+    airways = [(from_id, to_id, awy.start_pt.name, awy.end_pt.name, awy.airway_type, awy.name, awy.distance)
+               for from_id, ends in graph.airways.items() for to_id, awy in ends.items()]
+    return graph.eff_date, waypoints, airways
+
+
+def assert_same_graph(actual: AirwayGraph, expected: AirwayGraph, rel_tol: float = 0.0):
+    actual_date, actual_wpts, actual_awys = graph_rows(actual)
+    expected_date, expected_wpts, expected_awys = graph_rows(expected)
+    assert actual_date == expected_date
+    assert actual_wpts == expected_wpts
+    assert [row[:-1] for row in actual_awys] == [row[:-1] for row in expected_awys]
+    for actual_row, expected_row in zip(actual_awys, expected_awys):
+        assert math.isclose(actual_row[-1], expected_row[-1], rel_tol=rel_tol), actual_row[:2]
+
+
+@pytest.fixture(scope="module")
+def compiled() -> CompiledGraph:
+    return CompiledGraph.from_airway_graph(bulk_graph("cycle_b"))
+
+
+@pytest.fixture(scope="module")
+def pairs(compiled) -> list:
+    return list(itertools.permutations(compiled.names.tolist(), 2))
+
+
+def test_bulk_build_matches_sequential():
+    sequential = AirwayGraph(verbose=False)
+    sequential.load_nasr_data(*nasr_files("cycle_a"))
+
+    # The bulk build may compute the distances with pyproj instead of geographiclib.
+    assert_same_graph(bulk_graph("cycle_a"), sequential, rel_tol=1e-12)
+
+
+def test_parallel_bulk_build_matches_single_process():
+    assert_same_graph(bulk_graph("cycle_a", processes=2), bulk_graph("cycle_a"))
+
+
+def test_delta_update_matches_full_rebuild():
+    prev_tables = nasr_delta.resolve_nasr_tables(*nasr_files("cycle_a"))
+    new_tables = nasr_delta.resolve_nasr_tables(*nasr_files("cycle_b"))
+
+    graph = bulk_graph("cycle_a")
+    delta = graph.update_nasr_data(prev_tables, new_tables)["delta"]
+
+    assert delta.added_waypoints == ["MIKEE"]
+    assert delta.removed_waypoints == ["ITEMM"]
+    assert delta.modified_waypoints == ["HOWWW"]
+    assert_same_graph(graph, bulk_graph("cycle_b"))
+
+
+def test_tiled_routes_match_compiled(compiled, pairs, tmp_path):
+    # One degree tiles split the test area, so routes cross tile boundaries.
+    tiled_file = str(tmp_path / "graph.fpt")
+    write_tiled_graph(tiled_file, compiled, tile_deg=1.0)
+    tiled = TiledGraph(tiled_file)
+    assert tiled.num_tiles > 1
+
+    for start, end in pairs:
+        assert find_best_path_tiled(tiled, start, end) == find_best_path_compiled(compiled, start, end), (start, end)
+
+
+def test_contraction_hierarchy_matches_astar(compiled, pairs):
+    ch = ContractionHierarchy.build(compiled)
+    assert ch.matches(compiled)
+
+    for start, end in pairs:
+        astar_path = find_best_path_compiled(compiled, start, end)
+        ch_path = find_best_path_ch(compiled, ch, start, end)
+        if len(astar_path) == 0:
+            assert ch_path == [], (start, end)
+        else:
+            assert math.isclose(path_distance(compiled, ch_path), path_distance(compiled, astar_path),
+                                rel_tol=1e-9), (start, end)
+
+
+def test_contraction_hierarchy_with_custom_airways():
+    graph = bulk_graph("cycle_a")
+    graph.build_custom_airways(3)
+    compiled = CompiledGraph.from_airway_graph(graph)
+
+    with pytest.raises(ValueError):
+        ContractionHierarchy.build(compiled)
+
+    ch = ContractionHierarchy.build(compiled, allow_custom=True)
+    for start, end in itertools.permutations(["ABLEE", "DOGGY", "LOVEE", "OKC"], 2):
+        astar_path = find_best_path_compiled(compiled, start, end)
+        ch_path = find_best_path_ch(compiled, ch, start, end)
+        assert math.isclose(path_distance(compiled, ch_path), path_distance(compiled, astar_path),
+                            rel_tol=1e-9), (start, end)
+
+
+@pytest.mark.parametrize("n_landmarks", [0, 4])
+def test_bidirectional_matches_astar(compiled, pairs, n_landmarks):
+    landmarks = LandmarkIndex.build(compiled, n_landmarks) if n_landmarks > 0 else None
+
+    for start, end in pairs:
+        astar_path = find_best_path_compiled(compiled, start, end)
+        bidir_path = find_best_path_bidirectional(compiled, start, end, landmarks=landmarks)
+        if len(astar_path) == 0:
+            assert bidir_path == [], (start, end)
+        else:
+            assert bidir_path[0] == start and bidir_path[-1] == end
+            assert math.isclose(path_distance(compiled, bidir_path), path_distance(compiled, astar_path),
+                                rel_tol=1e-9), (start, end)
+
+
+def test_k_best_paths(compiled, pairs):
+    for start, end in pairs:
+        astar_path = find_best_path_compiled(compiled, start, end)
+        best = find_k_best_paths(compiled, start, end, k=1)
+        routes = find_k_best_paths(compiled, start, end, k=4)
+        if len(astar_path) == 0:
+            assert best == [] and routes == [], (start, end)
+            continue
+
+        # With k=1, the best route is the A* route.
+        assert len(best) == 1
+        assert math.isclose(best[0][1], path_distance(compiled, astar_path), rel_tol=1e-9), (start, end)
+
+        # Routes are loopless, unique, and in order of distance.
+        assert len({tuple(path) for path, _ in routes}) == len(routes), (start, end)
+        for path, distance in routes:
+            assert path[0] == start and path[-1] == end
+            assert len(set(path)) == len(path), (start, end, path)
+            assert math.isclose(distance, path_distance(compiled, path), rel_tol=1e-9), (start, end, path)
+        distances = [distance for _, distance in routes]
+        assert all(a <= b * (1 + 1e-12) for a, b in zip(distances, distances[1:])), (start, end)
+        assert math.isclose(distances[0], best[0][1], rel_tol=1e-9)
@@ -0,0 +1,100 @@
+import math
+
+import pandas as pd
+import pytest
+
+import nasr_ingest
+from airway_index import AirwayIndex
+from compiled_graph import CompiledGraph
+from filed_routes import expand_route_nodes, expand_routes
+from geo_utils import geodesic_distances
+from nasr_fixtures import NASR_FILES, bulk_graph, nasr_files
+from procedures import read_procedure_index
+
+
+@pytest.fixture(scope="module")
+def files() -> dict:
+    return dict(zip(NASR_FILES, nasr_files("cycle_a")))
+
+
+@pytest.fixture(scope="module")
+def graph() -> CompiledGraph:
+    return CompiledGraph.from_airway_graph(bulk_graph("cycle_a"))
+
+
+@pytest.fixture(scope="module")
+def airways(graph, files) -> AirwayIndex:
+    # V9 passes ZULUU, which is not a waypoint of the graph, so it is split in two pieces.
+    awy_seg = nasr_ingest.read_nasr_csv(files["AWY_SEG.csv"])
+    v9 = pd.DataFrame({"EFF_DATE": "2023/11/30", "AWY_LOCATION": "C", "AWY_ID": "V9",
+                       "POINT_SEQ": [10, 20, 30, 40, 50],
+                       "SEG_VALUE": ["ABLEE", "EASYY", "ZULUU", "KINGG", "LOVEE"],
+                       "NEXT_SEG": ["EASYY", "ZULUU", "KINGG", "LOVEE", ""]})
+    return AirwayIndex.build(graph, pd.concat([awy_seg, v9], ignore_index=True))
+
+
+@pytest.fixture(scope="module")
+def procedures(graph, files):
+    return read_procedure_index(graph, files["DP_RTE.csv"], files["DP_APT.csv"], files["STAR_RTE.csv"],
+                                files["STAR_APT.csv"])
+
+
+def expand(graph, airways, route: str, procedures=None) -> tuple:
+    nodes, errors = expand_route_nodes(graph, airways, route, procedures)
+    return [graph.node_name(node) for node in nodes], errors
+
+
+@pytest.mark.parametrize("route, path", [
+    ("ABLEE V1 DOGGY", ["ABLEE", "BAKER", "CHRLY", "DOGGY"]),
+    ("DOGGY V1 BAKER", ["DOGGY", "CHRLY", "BAKER"]),
+    ("IRW V4 BAKER J11 JIGGY DCT LOVEE/N0450F350", ["IRW", "BAKER", "FOXXX", "JIGGY", "LOVEE"]),
+])
+def test_airway_segments(graph, airways, route, path):
+    assert expand(graph, airways, route) == (path, [])
+
+
+def test_fix_not_on_airway(graph, airways):
+    path, errors = expand(graph, airways, "ABLEE V1 LOVEE")
+
+    # The route goes on directly to the next waypoint.
+    assert errors == ["V1: LOVEE not on the airway"]
+    assert path == ["ABLEE", "LOVEE"]
+
+
+def test_split_airway(graph, airways):
+    pieces = airways.pieces("V9")
+    assert [[graph.node_name(int(node)) for node in fixes] for fixes in pieces] == [["ABLEE", "EASYY"],
+                                                                                   ["KINGG", "LOVEE"]]
+
+    assert expand(graph, airways, "LOVEE V9 KINGG") == (["LOVEE", "KINGG"], [])
+    path, errors = expand(graph, airways, "ABLEE V9 LOVEE")
+    assert errors == ["V9: ABLEE and LOVEE are on separate parts of the airway"]
+    assert path == ["ABLEE", "LOVEE"]
+
+
+def test_icao_airport_codes(graph, airways, procedures):
+    assert expand(graph, airways, "KOKC IRW V4 BAKER") == (["OKC", "IRW", "BAKER"], [])
+    assert expand(graph, airways, "KOKC SOONR1.NOVMB NOVMB", procedures) == \
+        (["OKC", "IRW", "BAKER", "FOXXX", "NOVMB"], [])
+    assert expand(graph, airways, "CHRLY CHRLY.COWBY1 KDFW", procedures) == \
+        (["CHRLY", "GEORG", "KINGG", "DFW"], [])
+
+    # Only airports are found by their FAA id. IRW is a navaid.
+    _, errors = expand(graph, airways, "KIRW V4 BAKER")
+    assert errors[0] == "KIRW: unknown waypoint, airway or procedure"
+
+
+def test_batch_distances(graph, airways, procedures):
+    routes = ["ABLEE V1 DOGGY", "KOKC SOONR1.NOVMB NOVMB", "QQQQQ", "LOVEE", "DOGGY V1 BAKER"]
+    expanded = expand_routes(graph, airways, routes, procedures)
+
+    # Legs between the end of one route and the start of the next are not part of either.
+    for route in expanded:
+        names = route.path
+        lat = [graph.lat[graph.node_id(name)] for name in names]
+        lon = [graph.lon[graph.node_id(name)] for name in names]
+        expected = float(geodesic_distances(lat[:-1], lon[:-1], lat[1:], lon[1:]).sum()) if len(names) > 1 else 0.0
+        assert math.isclose(route.distance, expected, rel_tol=1e-9, abs_tol=1e-6), route.route
+
+    assert [len(route.errors) for route in expanded] == [0, 0, 1, 0, 0]
+    assert expanded[2].distance == 0.0 and expanded[3].distance == 0.0
@@ -0,0 +1,34 @@
+import os
+
+from route_cache import RouteCache, graph_identity
+
+
+def test_rewritten_graph_invalidates_cache(tmp_path):
+    graph_file = tmp_path / "graph.fpg"
+    graph_file.write_bytes(b"cycle")
+    cache = RouteCache()
+    cache.set_eff_date("2023/12/28", graph_identity(str(graph_file)))
+    cache.put("OKC", "DFW", {}, ["OKC", "DFW"])
+
+    # The same, unchanged graph keeps its routes.
+    assert not cache.set_eff_date("2023/12/28", graph_identity(str(graph_file)))
+    assert cache.get("OKC", "DFW", {}) == ["OKC", "DFW"]
+
+    # A graph rebuilt on the same NASR cycle doesn't.
+    graph_file.write_bytes(b"cycle with custom airways")
+    os.utime(graph_file, ns=(0, 0))
+    assert cache.set_eff_date("2023/12/28", graph_identity(str(graph_file)))
+    assert cache.get("OKC", "DFW", {}) is None
+
+
+def test_graph_identity_is_saved(tmp_path):
+    cache_file = str(tmp_path / "routes.json")
+    cache = RouteCache(cache_file=cache_file)
+    cache.set_eff_date("2023/12/28", "graph-a")
+    cache.put("OKC", "DFW", {}, ["OKC", "DFW"])
+    cache.save()
+
+    loaded = RouteCache(cache_file=cache_file)
+    assert not loaded.set_eff_date("2023/12/28", "graph-a")
+    assert loaded.set_eff_date("2023/12/28", "graph-b")
+    assert len(loaded) == 0
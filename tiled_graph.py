@@ -0,0 +1,359 @@
+import argparse
+import collections
+import os
+import time
+
+import numpy as np
+
+from compiled_graph import CompiledGraph
+from geo_utils import distance_lower_bounds, ecef
+from graph_file import GraphFile, load_graph, write_sections
+from map_types import AirwayType
+
+# Header metadata key marking a tiled graph file.
+TILED_FORMAT = "tiled"
+
+
+class Tile:
+    """
+    The waypoints of one geographic tile and the airways between them, loaded into memory.
+    """
+
+    def __init__(self, nodes: np.ndarray, lat: np.ndarray, lon: np.ndarray, offsets: np.ndarray,
+                 targets: np.ndarray, weights: np.ndarray, airway_type: np.ndarray, backbone_offsets: np.ndarray):
+        """
+        Arguments:
+        - `nodes` (np.ndarray): global node ids of the tile's waypoints.
+        - `lat` (np.ndarray): waypoint latitudes in decimal degrees.
+        - `lon` (np.ndarray): waypoint longitudes in decimal degrees.
+        - `offsets` (np.ndarray): CSR offsets of the airways leaving each waypoint, over the local indices.
+        - `targets` (np.ndarray): local index of the end of each airway.
+        - `weights` (np.ndarray): airway lengths in meters.
+        - `airway_type` (np.ndarray): `AirwayType` value of each airway.
+        - `backbone_offsets` (np.ndarray): range of the backbone airways leaving each waypoint.
+        """
+        self.nodes = nodes
+        self.lat = lat
+        self.lon = lon
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self.airway_type = airway_type
+        self.backbone_offsets = backbone_offsets
+        self.xyz = ecef(lat, lon)
+
+        # Per-waypoint arrays as lists, for the search loop.
+        self.node_list = nodes.tolist()
+        self.offsets_list = offsets.tolist()
+        self.backbone_list = backbone_offsets.tolist()
+
+        # Search arrays for the last goal searched for.
+        self._view_key = None
+        self._view = None
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.nodes, self.lat, self.lon, self.offsets, self.targets, self.weights, self.airway_type,
+                  self.backbone_offsets, self.xyz)
+        # The lists hold a pointer and an int or float object per entry, with one list of distance bounds
+        # for the search.
+        return sum(arr.nbytes for arr in arrays) + 4 * 36 * len(self.node_list)
+
+    def search_view(self, goal: int, goal_xyz: np.ndarray, custom_airways: bool = True) -> tuple:
+        """
+        Get the arrays a search toward a goal reads from this tile. They are kept until the next search
+        toward a different goal.
+
+        Arguments:
+        - `goal` (int): node id of the goal.
+        - `goal_xyz` (np.ndarray): ECEF coordinates of the goal.
+        - `custom_airways` (bool, optional): allow the search to use CUSTOM airways.
+
+        Returns:
+        A (node ids, offsets, backbone offsets, targets, weights, distance bounds to the goal) tuple.
+        """
+        key = (goal, custom_airways)
+        if self._view_key != key:
+            weights = self.weights
+            if not custom_airways:
+                weights = np.where(self.airway_type == AirwayType.CUSTOM.value, np.inf, weights)
+            h_scores = distance_lower_bounds(self.xyz, goal_xyz).tolist()
+            self._view = (self.node_list, self.offsets_list, self.backbone_list, self.targets, weights, h_scores)
+            self._view_key = key
+
+        return self._view
+
+
+class TiledGraph:
+    """
+    Airway graph split into geographic tiles that are read from a tiled graph file on demand.
+
+    Only the backbone is always in memory: the waypoint name index, the tile of every waypoint, and the
+    airways that cross between tiles, with the tile and coordinates of their end points. A search loads the
+    tile of each waypoint it expands, and the least recently used tiles are dropped once the loaded tiles
+    exceed the memory budget.
+
+    Waypoints in a tile have a local index, their position in the tile, and backbone airways are grouped
+    by the tile and local index of their start.
+    """
+
+    def __init__(self, tiled_file: str, memory_budget: int = 0):
+        """
+        Arguments:
+        - `tiled_file` (str): tiled graph file written by `write_tiled_graph`.
+        - `memory_budget` (int, optional): bytes of tiles to keep loaded. 0 keeps every loaded tile.
+        """
+        gf = GraphFile(tiled_file)
+        if gf.metadata.get("format") != TILED_FORMAT:
+            raise ValueError(f"{tiled_file} is not a tiled graph file")
+
+        self.graph_file = gf
+        self.eff_date = gf.eff_date
+        self.tile_deg = gf.metadata["tile_deg"]
+        self.memory_budget = memory_budget
+
+        # Backbone.
+        self.names = gf.string_table("names")
+        self.node_tile = np.array(gf.array("node_tile"))
+        self.node_local = np.array(gf.array("node_local"))
+        self.tile_keys = np.array(gf.array("tile_keys"))
+        self.tile_node_offsets = np.array(gf.array("tile_node_offsets"))
+        self.tile_edge_offsets = np.array(gf.array("tile_edge_offsets"))
+        self.backbone_targets = np.array(gf.array("backbone.targets"))
+        self.backbone_tile = np.array(gf.array("backbone.target_tile"))
+        self.backbone_local = np.array(gf.array("backbone.target_local"))
+        self.backbone_weights = np.array(gf.array("backbone.weights"))
+        self.backbone_type = np.array(gf.array("backbone.airway_type"))
+        self.backbone_xyz = np.array(gf.array("backbone.xyz"))
+
+        # Loaded tiles, from least to most recently used.
+        self._tiles = collections.OrderedDict()
+        self.loaded_bytes = 0
+        self.peak_bytes = 0
+        self.loads = 0
+        self.evictions = 0
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_tile)
+
+    @property
+    def num_tiles(self) -> int:
+        return len(self.tile_keys)
+
+    @property
+    def backbone_nbytes(self) -> int:
+        arrays = (self.node_tile, self.node_local, self.tile_keys, self.tile_node_offsets, self.tile_edge_offsets,
+                  self.backbone_targets, self.backbone_tile, self.backbone_local, self.backbone_weights,
+                  self.backbone_type, self.backbone_xyz)
+        return sum(arr.nbytes for arr in arrays)
+
+    def node_id(self, ident: str) -> int:
+        """
+        Get the node id of a waypoint identifier, -1 if it is not in the graph.
+        """
+        return self.names.find(ident)
+
+    def node_name(self, node: int) -> str:
+        return self.names[node]
+
+    def tile(self, tile_id: int) -> Tile:
+        """
+        Get a tile, reading it from the file if it is not loaded.
+
+        Arguments:
+        - `tile_id` (int): index of the tile.
+        """
+        tile = self._tiles.get(tile_id)
+        if tile is not None:
+            self._tiles.move_to_end(tile_id)
+            return tile
+
+        # 1. Read the tile's waypoints and airways.
+        node_lo, node_hi = int(self.tile_node_offsets[tile_id]), int(self.tile_node_offsets[tile_id + 1])
+        edge_lo, edge_hi = int(self.tile_edge_offsets[tile_id]), int(self.tile_edge_offsets[tile_id + 1])
+        with open(self.graph_file.path, "rb") as f:
+            def read(name, lo, hi):
+                return self.graph_file.read_range(name, lo, hi, f)
+
+            offsets = np.append(read("tile.edge_starts", node_lo, node_hi) - edge_lo, edge_hi - edge_lo)
+            tile = Tile(read("tile.nodes", node_lo, node_hi),
+                        read("tile.lat", node_lo, node_hi),
+                        read("tile.lon", node_lo, node_hi),
+                        offsets,
+                        read("tile.targets", edge_lo, edge_hi),
+                        read("tile.weights", edge_lo, edge_hi),
+                        read("tile.airway_type", edge_lo, edge_hi),
+                        read("tile.backbone_starts", node_lo, node_hi + 1))
+        self._tiles[tile_id] = tile
+        self.loaded_bytes += tile.nbytes
+        self.peak_bytes = max(self.peak_bytes, self.loaded_bytes)
+        self.loads += 1
+
+        # 2. Evict the least recently used tiles to get back under the budget. The new tile always stays.
+        while self.memory_budget > 0 and self.loaded_bytes > self.memory_budget and len(self._tiles) > 1:
+            _, old = self._tiles.popitem(last=False)
+            self.loaded_bytes -= old.nbytes
+            self.evictions += 1
+
+        return tile
+
+    def clear(self):
+        """
+        Drops every loaded tile.
+        """
+        self._tiles.clear()
+        self.loaded_bytes = 0
+
+    def path_distance(self, path: list) -> float:
+        """
+        Computes the total airway distance of a path, as `path_search.path_distance` does on a full graph.
+
+        Arguments:
+        - `path` (list): waypoint identifiers along the path.
+
+        Returns:
+        The distance in meters, or infinity if consecutive waypoints are not connected by an airway.
+        """
+        total = 0.0
+        nodes = [self.node_id(ident) for ident in path]
+        for start, end in zip(nodes[:-1], nodes[1:]):
+            if start < 0 or end < 0:
+                return np.inf
+
+            # The airway is either inside a tile or on the backbone.
+            tile = self.tile(int(self.node_tile[start]))
+            local = self.node_local[start]
+            if self.node_tile[start] == self.node_tile[end]:
+                lo, hi = tile.offsets[local], tile.offsets[local + 1]
+                matches = np.flatnonzero(tile.targets[lo:hi] == self.node_local[end])
+                weights = tile.weights[lo:hi]
+            else:
+                lo, hi = tile.backbone_offsets[local], tile.backbone_offsets[local + 1]
+                matches = np.flatnonzero(self.backbone_targets[lo:hi] == end)
+                weights = self.backbone_weights[lo:hi]
+
+            if len(matches) == 0:
+                return np.inf
+            total += float(weights[matches[0]])
+
+        return total
+
+
+def tile_sections(graph: CompiledGraph, tile_deg: float = 5.0) -> dict:
+    """
+    Splits a compiled graph into square latitude/longitude tiles and a backbone of the airways between
+    tiles, as graph file sections.
+
+    Arguments:
+    - `graph` (CompiledGraph): graph to split.
+    - `tile_deg` (float, optional): size of the tiles in degrees.
+
+    Returns:
+    A dictionary of section name to array.
+    """
+    # 1. Assign every waypoint to a tile, numbering only the tiles that have waypoints.
+    rows = np.floor(np.asarray(graph.lat) / tile_deg).astype(np.int32)
+    cols = np.floor(np.asarray(graph.lon) / tile_deg).astype(np.int32)
+    tile_keys, node_tile = np.unique(np.stack((rows, cols), axis=1), axis=0, return_inverse=True)
+    node_tile = node_tile.reshape(-1).astype(np.int32)
+    n_tiles = len(tile_keys)
+
+    # 2. Order the waypoints by tile. Waypoints keep their relative order inside a tile.
+    order = np.argsort(node_tile, kind="stable")
+    tile_node_offsets = np.zeros(n_tiles + 1, dtype=np.int64)
+    tile_node_offsets[1:] = np.cumsum(np.bincount(node_tile, minlength=n_tiles))
+    node_local = np.empty(graph.num_nodes, dtype=np.int32)
+    node_local[order] = np.arange(graph.num_nodes) - tile_node_offsets[node_tile[order]]
+
+    # 3. Split the airways into those inside a tile and the backbone of airways crossing between tiles.
+    degree = np.diff(graph.offsets)
+    sources = np.repeat(np.arange(graph.num_nodes), degree)
+    targets = np.asarray(graph.targets)
+    crossing = node_tile[sources] != node_tile[targets]
+
+    # 4. Tile airways, grouped by source in tile order, with local end point indices.
+    inside = ~crossing
+    rank = np.empty(graph.num_nodes, dtype=np.int64)
+    rank[order] = np.arange(graph.num_nodes)
+    in_edges = np.flatnonzero(inside)
+    in_edges = in_edges[np.argsort(rank[sources[in_edges]], kind="stable")]
+    in_degree = np.bincount(sources[in_edges], minlength=graph.num_nodes)[order]
+    edge_starts = np.zeros(graph.num_nodes, dtype=np.int64)
+    edge_starts[1:] = np.cumsum(in_degree)[:-1]
+    tile_edge_offsets = np.append(edge_starts[tile_node_offsets[:-1]], len(in_edges)) if n_tiles > 0 else \
+        np.zeros(1, dtype=np.int64)
+
+    # 5. Backbone airways, grouped by source in tile order like the tile airways. The end point tiles and
+    # coordinates are kept, so the search can bound the distance from a waypoint in a tile that isn't loaded.
+    bb_edges = np.flatnonzero(crossing)
+    bb_edges = bb_edges[np.argsort(rank[sources[bb_edges]], kind="stable")]
+    backbone_starts = np.zeros(graph.num_nodes + 1, dtype=np.int64)
+    backbone_starts[1:] = np.cumsum(np.bincount(sources[bb_edges], minlength=graph.num_nodes)[order])
+    bb_targets = targets[bb_edges]
+
+    sections = {
+        "names.data": graph.names.data,
+        "names.offsets": graph.names.offsets,
+        "names.sorted_ids": graph.names.sorted_ids,
+        "node_tile": node_tile,
+        "node_local": node_local,
+        "tile_keys": tile_keys.astype(np.int32),
+        "tile_node_offsets": tile_node_offsets,
+        "tile_edge_offsets": tile_edge_offsets.astype(np.int64),
+        "tile.nodes": order.astype(np.int32),
+        "tile.lat": np.asarray(graph.lat, dtype=np.float64)[order],
+        "tile.lon": np.asarray(graph.lon, dtype=np.float64)[order],
+        "tile.edge_starts": edge_starts,
+        "tile.targets": node_local[targets[in_edges]],
+        "tile.weights": np.asarray(graph.weights)[in_edges],
+        "tile.airway_type": np.asarray(graph.airway_type)[in_edges],
+        "tile.backbone_starts": backbone_starts,
+        "backbone.targets": bb_targets.astype(np.int32),
+        "backbone.target_tile": node_tile[bb_targets],
+        "backbone.target_local": node_local[bb_targets],
+        "backbone.weights": np.asarray(graph.weights)[bb_edges],
+        "backbone.airway_type": np.asarray(graph.airway_type)[bb_edges],
+        "backbone.xyz": graph.ecef()[bb_targets],
+    }
+
+    return sections
+
+
+def write_tiled_graph(tiled_file: str, graph: CompiledGraph, tile_deg: float = 5.0):
+    """
+    Writes a compiled graph as a tiled graph file for `TiledGraph`.
+
+    Arguments:
+    - `tiled_file` (str): output file path.
+    - `graph` (CompiledGraph): graph to write.
+    - `tile_deg` (float, optional): size of the tiles in degrees.
+    """
+    header = {
+        "eff_date": graph.eff_date,
+        "num_nodes": graph.num_nodes,
+        "num_edges": graph.num_edges,
+        "metadata": {"format": TILED_FORMAT, "tile_deg": tile_deg},
+    }
+    write_sections(tiled_file, tile_sections(graph, tile_deg), header)
+
+
+if __name__ == "__main__":
+    # Make this script configurable
+    parser = argparse.ArgumentParser(description="Split an airway graph into tiles that are loaded on demand.")
+    parser.add_argument("--graph_file", default="data/airway_graph.fpg")
+    parser.add_argument("--tiled_file", default="data/airway_graph.tiles.fpg")
+    parser.add_argument("--tile_deg", type=float, default=5.0, help="Size of the tiles in degrees")
+
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    graph = load_graph(args.graph_file)
+    write_tiled_graph(args.tiled_file, graph, args.tile_deg)
+
+    tiled = TiledGraph(args.tiled_file)
+    n_backbone = len(tiled.backbone_targets)
+    print(f"Wrote {tiled.num_tiles} tiles of {args.tile_deg:g} degrees to {args.tiled_file} in "
+          f"{time.perf_counter() - start_time:.2f} s. {n_backbone} of {graph.num_edges} airways "
+          f"({100 * n_backbone / max(graph.num_edges, 1):.1f}%) cross between tiles. Backbone: "
+          f"{tiled.backbone_nbytes / 1e6:.1f} MB, graph file: {os.path.getsize(args.graph_file) / 1e6:.1f} MB")
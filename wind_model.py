@@ -0,0 +1,253 @@
+import argparse
+
+import numpy as np
+
+from compiled_graph import CompiledGraph
+from geo_utils import METERS_PER_NM, WGS84_E2
+from graph_file import load_graph
+
+# Meters per second in a knot.
+MPS_PER_KT = METERS_PER_NM / 3600
+
+
+class WindField:
+    """
+    Gridded wind forecast. Winds are stored as eastward (u) and northward (v) components in knots, on a
+    regular latitude/longitude grid at a set of pressure altitudes and forecast hours.
+    """
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, levels: np.ndarray, hours: np.ndarray, u: np.ndarray,
+                 v: np.ndarray, issued: str = ""):
+        """
+        Arguments:
+        - `lat` (np.ndarray): grid latitudes in decimal degrees, increasing.
+        - `lon` (np.ndarray): grid longitudes in decimal degrees, increasing. Either -180..180 or 0..360.
+        - `levels` (np.ndarray): altitudes of the grid levels in feet, increasing.
+        - `hours` (np.ndarray): forecast hours, increasing.
+        - `u` (np.ndarray): (hours, levels, lat, lon) eastward wind components in knots.
+        - `v` (np.ndarray): (hours, levels, lat, lon) northward wind components in knots.
+        - `issued` (str, optional): issue time of the forecast.
+        """
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.levels = np.asarray(levels, dtype=np.float64)
+        self.hours = np.asarray(hours, dtype=np.float64)
+        self.u = np.asarray(u, dtype=np.float32)
+        self.v = np.asarray(v, dtype=np.float32)
+        self.issued = issued
+
+        shape = (len(self.hours), len(self.levels), len(self.lat), len(self.lon))
+        if self.u.shape != shape or self.v.shape != shape:
+            raise ValueError(f"Wind components must have shape {shape}, not {self.u.shape} and {self.v.shape}")
+
+    def save(self, wind_file: str):
+        """
+        Saves the wind field as a NumPy archive.
+        """
+        with open(wind_file, "wb") as f:
+            np.savez(f, lat=self.lat, lon=self.lon, levels=self.levels, hours=self.hours, u=self.u, v=self.v,
+                     issued=np.array(self.issued))
+
+    @classmethod
+    def load(cls, wind_file: str) -> "WindField":
+        """
+        Loads a wind field saved with `save`, or any npz archive with the same arrays.
+
+        Arguments:
+        - `wind_file` (str): file path of the wind field.
+        """
+        with np.load(wind_file) as data:
+            issued = str(data["issued"]) if "issued" in data.files else ""
+            return cls(data["lat"], data["lon"], data["levels"], data["hours"], data["u"], data["v"], issued)
+
+    def slice(self, level: float, hour: float) -> tuple:
+        """
+        Gets the wind grid at one altitude and forecast hour, interpolating linearly between the nearest
+        levels and hours. Values outside the grid are clamped to its edges.
+
+        Arguments:
+        - `level` (float): altitude in feet.
+        - `hour` (float): forecast hour.
+
+        Returns:
+        A (u, v) tuple of (lat, lon) arrays in knots.
+        """
+        h0, h1, h_frac = _bracket(self.hours, hour)
+        l0, l1, l_frac = _bracket(self.levels, level)
+
+        def blend(comp):
+            at_h0 = (1 - l_frac) * comp[h0, l0] + l_frac * comp[h0, l1]
+            at_h1 = (1 - l_frac) * comp[h1, l0] + l_frac * comp[h1, l1]
+            return ((1 - h_frac) * at_h0 + h_frac * at_h1).astype(np.float64)
+
+        return blend(self.u), blend(self.v)
+
+    def sample(self, grid: np.ndarray, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        """
+        Bilinearly interpolates a (lat, lon) grid from `slice` at many points.
+
+        Arguments:
+        - `grid` (np.ndarray): (lat, lon) values on this field's grid.
+        - `lat` (np.ndarray): latitudes in decimal degrees.
+        - `lon` (np.ndarray): longitudes in decimal degrees, -180..180.
+
+        Returns:
+        The interpolated values at each point.
+        """
+        # Grids going from 0 to 360 degrees need the western longitudes wrapped.
+        if self.lon[-1] > 180:
+            lon = np.mod(lon, 360)
+
+        i0, i1, y_frac = _bracket(self.lat, lat)
+        j0, j1, x_frac = _bracket(self.lon, lon)
+        top = (1 - x_frac) * grid[i0, j0] + x_frac * grid[i0, j1]
+        bottom = (1 - x_frac) * grid[i1, j0] + x_frac * grid[i1, j1]
+
+        return (1 - y_frac) * top + y_frac * bottom
+
+
+def _bracket(axis: np.ndarray, values):
+    """
+    Finds the grid indices on each side of the values along an increasing axis, and how far along the
+    interval each value is. Values outside the axis are clamped to its ends.
+    """
+    values = np.clip(values, axis[0], axis[-1])
+    hi = np.clip(np.searchsorted(axis, values, side="right"), 1, len(axis) - 1) if len(axis) > 1 else \
+        np.zeros_like(values, dtype=np.int64)
+    lo = np.maximum(hi - 1, 0)
+    span = axis[hi] - axis[lo]
+    frac = np.divide(values - axis[lo], span, out=np.zeros_like(span, dtype=np.float64), where=span > 0)
+
+    return lo, hi, frac
+
+
+class WindCostModel:
+    """
+    Flight time of every airway in a wind field. The times of all airways are computed together for one
+    altitude and forecast hour and kept, so the graph itself never changes with the winds.
+    """
+
+    def __init__(self, graph: CompiledGraph, wind: WindField, tas_kt: float):
+        """
+        Arguments:
+        - `graph` (CompiledGraph): Compiled airway graph.
+        - `wind` (WindField): wind forecast.
+        - `tas_kt` (float): true airspeed in knots.
+        """
+        if tas_kt <= 0:
+            raise ValueError("True airspeed must be positive")
+
+        self.graph = graph
+        self.wind = wind
+        self.tas_kt = tas_kt
+        self._cache = {}
+
+        # 1. Find the end points of every airway.
+        sources = np.repeat(np.arange(graph.num_nodes), np.diff(graph.offsets))
+        targets = graph.targets
+
+        # 2. Take the airway midpoints where the ray through the middle of the chord meets the ellipsoid. The
+        # geodetic latitude there follows from the direction of the ray, since the ellipsoid's normal is
+        # (x, y, z / (1 - e^2)) scaled.
+        xyz = graph.ecef()
+        p = xyz[sources]
+        q = xyz[targets]
+        mid = p + q
+        mid_lat = np.arctan2(mid[:, 2], (1.0 - WGS84_E2) * np.hypot(mid[:, 0], mid[:, 1]))
+        mid_lon = np.arctan2(mid[:, 1], mid[:, 0])
+
+        # 3. Get the course of each airway from its chord, in east/north components at the midpoint.
+        chord = q - p
+        east = -np.sin(mid_lon) * chord[:, 0] + np.cos(mid_lon) * chord[:, 1]
+        north = (-np.sin(mid_lat) * np.cos(mid_lon) * chord[:, 0] - np.sin(mid_lat) * np.sin(mid_lon) * chord[:, 1]
+                 + np.cos(mid_lat) * chord[:, 2])
+        length = np.maximum(np.hypot(east, north), 1e-9)
+        self._course_e = east / length
+        self._course_n = north / length
+
+        # 4. Winds are sampled at the start, middle and end of each airway.
+        self._sample_lat = (graph.lat[sources], np.degrees(mid_lat), graph.lat[targets])
+        self._sample_lon = (graph.lon[sources], np.degrees(mid_lon), graph.lon[targets])
+
+    def set_wind(self, wind: WindField):
+        """
+        Switches to a new wind forecast, dropping the cached airway times.
+        """
+        self.wind = wind
+        self._cache.clear()
+
+    def edge_times(self, level: float, hour: float) -> np.ndarray:
+        """
+        Computes the flight time of every airway at an altitude and forecast hour.
+
+        Arguments:
+        - `level` (float): altitude in feet.
+        - `hour` (float): forecast hour.
+
+        Returns:
+        The flight times in seconds, indexed by edge id. Airways where the crosswind or headwind is too
+        strong to make progress take infinitely long.
+        """
+        key = (float(level), float(hour))
+        if key in self._cache:
+            return self._cache[key]
+
+        # 1. Average the wind over the samples along each airway.
+        u_grid, v_grid = self.wind.slice(level, hour)
+        u = sum(self.wind.sample(u_grid, lat, lon) for lat, lon in zip(self._sample_lat, self._sample_lon)) / 3
+        v = sum(self.wind.sample(v_grid, lat, lon) for lat, lon in zip(self._sample_lat, self._sample_lon)) / 3
+
+        # 2. Solve the wind triangle: the heading is set to cancel the crosswind, and the rest of the true
+        # airspeed plus the tailwind is the ground speed.
+        tailwind = u * self._course_e + v * self._course_n
+        crosswind = u * self._course_n - v * self._course_e
+        along = self.tas_kt ** 2 - crosswind ** 2
+        ground_speed = tailwind + np.sqrt(np.maximum(along, 0))
+        ground_speed = np.where((along > 0) & (ground_speed > 0), ground_speed, 0)
+
+        # 3. Time = distance / ground speed.
+        with np.errstate(divide="ignore"):
+            times = self.graph.weights / (ground_speed * MPS_PER_KT)
+
+        self._cache[key] = times
+        return times
+
+    def max_ground_speed(self, level: float, hour: float) -> float:
+        """
+        Gets an upper bound on the ground speed anywhere at an altitude and forecast hour, in knots.
+        """
+        u_grid, v_grid = self.wind.slice(level, hour)
+        return self.tas_kt + float(np.sqrt(u_grid ** 2 + v_grid ** 2).max())
+
+    def heuristic_scale(self, level: float, hour: float) -> float:
+        """
+        Gets the factor turning distance lower bounds in meters into flight time lower bounds in seconds,
+        for the `h_scale` argument of the searches. No airway can be flown faster than the strongest
+        tailwind allows, so the scaled heuristic stays admissible.
+        """
+        return 1 / (self.max_ground_speed(level, hour) * MPS_PER_KT)
+
+
+if __name__ == "__main__":
+    # Make this script configurable
+    parser = argparse.ArgumentParser(description="Compute airway flight times from a gridded wind forecast.")
+    parser.add_argument("wind_file", help="NumPy archive with lat, lon, levels, hours, u and v arrays")
+    parser.add_argument("--graph_file", default="data/airway_graph.fpg")
+    parser.add_argument("--altitude", type=float, required=True, help="Altitude in feet")
+    parser.add_argument("--hours", type=float, nargs="+", default=[0.0], help="Forecast hours to compute")
+    parser.add_argument("--tas", type=float, default=120.0, help="True airspeed in knots")
+
+    args = parser.parse_args()
+
+    graph = load_graph(args.graph_file)
+    model = WindCostModel(graph, WindField.load(args.wind_file), args.tas)
+
+    # Summarize the airway times at each forecast hour against still air.
+    still_air = graph.weights / (args.tas * MPS_PER_KT)
+    for hour in args.hours:
+        times = model.edge_times(args.altitude, hour)
+        flyable = np.isfinite(times) & (still_air > 0)
+        ratio = times[flyable] / still_air[flyable]
+        print(f"Hour {hour:g}: max ground speed {model.max_ground_speed(args.altitude, hour):.0f} kt, "
+              f"airway times {ratio.min():.2f}x to {ratio.max():.2f}x still air, "
+              f"{int((~np.isfinite(times)).sum())} airways not flyable.")